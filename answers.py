@@ -0,0 +1,88 @@
+import functools
+import unicodedata
+
+# typographic variants that users can't easily type
+CHARACTER_MAP = str.maketrans({"’": "'", "‘": "'", "ʼ": "'", "“": '"', "”": '"', "–": "-", "—": "-"})
+
+@functools.lru_cache(maxsize=4096)
+def normalize(text):
+	"""Returns the form answers are compared in: accents stripped, casefolded, and whitespace collapsed.
+	"""
+	decomposed = unicodedata.normalize("NFKD", str(text).translate(CHARACTER_MAP))
+	stripped = "".join(character for character in decomposed if not unicodedata.combining(character))
+	return " ".join(stripped.casefold().split())
+
+@functools.lru_cache(maxsize=4096)
+def within_distance(a, b, max_distance):
+	"""Returns whether the Levenshtein distance between a and b is at most max_distance.
+		Only a band of 2*max_distance + 1 diagonals is computed, and the check stops as soon as a row exceeds the bound.
+	"""
+	if abs(len(a) - len(b)) > max_distance:
+		return False
+	if max_distance == 0:
+		return a == b
+	too_far = max_distance + 1
+	previous = [j if j <= max_distance else too_far for j in range(len(b) + 1)]
+	for i in range(1, len(a) + 1):
+		low, high = max(1, i - max_distance), min(len(b), i + max_distance)
+		current = [too_far]*(len(b) + 1)
+		current[0] = i if i <= max_distance else too_far
+		row_best = current[0]
+		for j in range(low, high + 1):
+			cost = previous[j - 1] + (a[i - 1] != b[j - 1])
+			if previous[j] + 1 < cost:
+				cost = previous[j] + 1
+			if current[j - 1] + 1 < cost:
+				cost = current[j - 1] + 1
+			current[j] = min(cost, too_far)
+			if cost < row_best:
+				row_best = cost
+		if row_best > max_distance:
+			return False
+		previous = current
+	return previous[len(b)] <= max_distance
+
+class AnswerIndex:
+	"""AnswerIndex -
+		Accepted answers of a deck's cards, for checking typed responses leniently.
+
+		A card accepts its back side and the back sides of later rows with the same front side (alternates).
+			The normalized forms of a card's answers are computed once per refresh, on first use.
+
+		alternates (dictionary): [front side]: list of alternate back sides
+		chars_per_typo (int): answers get one typo allowed per chars_per_typo characters..
+		max_typos (int): ..up to max_typos
+	"""
+	def __init__(self, chars_per_typo=5, max_typos=2):
+		self.chars_per_typo = chars_per_typo
+		self.max_typos      = max_typos
+		self.alternates     = {}
+		self.normalized     = {}
+
+	def reset(self, alternates):
+		"""Called by the deck on refresh, with the alternates collected while reconciling its cards.
+		"""
+		self.alternates = alternates
+		self.normalized = {}
+
+	def accepted(self, front_side, back_side):
+		"""Returns the set of normalized answers accepted for a card.
+		"""
+		accepted = self.normalized.get(front_side)
+		if (accepted is None) or (back_side not in accepted[0]):
+			answers = [back_side] + self.alternates.get(front_side, [])
+			accepted = (frozenset(answers), frozenset(normalize(answer) for answer in answers))
+			self.normalized[front_side] = accepted
+		return accepted[1]
+
+	def allowed_typos(self, answer):
+		return min(self.max_typos, len(answer)//self.chars_per_typo)
+
+	def check(self, front_side, back_side, response):
+		"""Returns whether response is an accepted answer for the card, ignoring case, accents, whitespace and small typos.
+		"""
+		accepted = self.accepted(front_side, back_side)
+		response = normalize(response)
+		if response in accepted:
+			return True
+		return any(within_distance(response, answer, self.allowed_typos(answer)) for answer in accepted)
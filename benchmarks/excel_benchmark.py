@@ -0,0 +1,75 @@
+# benchmark for ExcelDataSource.pull_data against the original per-cell loop
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import openpyxl
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import carta_local
+
+def write_workbook(file_name, num_rows, num_fields):
+	workbook = openpyxl.Workbook(write_only=True)
+	excel_sheet = workbook.create_sheet()
+	excel_sheet.append(["field_{}".format(j) for j in range(num_fields)])
+	for i in range(num_rows):
+		excel_sheet.append(["value_{}_{}".format(i, j) for j in range(num_fields)])
+	workbook.save(file_name)
+
+def per_cell_pull(file_name):
+	"""The original pull_data loop: one cell() call per cell. xlrd no longer reads .xlsx, so the
+		loop runs over a fully loaded openpyxl worksheet instead.
+	"""
+	data_matrix = []
+	data_dict   = {}
+	excel_sheet = openpyxl.load_workbook(file_name).worksheets[0]
+	nrows, ncols = excel_sheet.max_row, excel_sheet.max_column
+	for i in range(1, nrows + 1):
+		row = []
+		for j in range(1, ncols + 1):
+			row.append(excel_sheet.cell(i, j).value)
+		data_matrix.append(row)
+	header = data_matrix[0]
+	data_matrix = data_matrix[1:]
+	for i, field_name in enumerate(header):
+		data_dict[field_name] = [row[i] for row in data_matrix]
+	return data_dict
+
+def measure_call(fn):
+	"""Returns (seconds, peak traced memory in MB) for a call to fn.
+	"""
+	tracemalloc.start()
+	start = time.perf_counter()
+	fn()
+	seconds = time.perf_counter() - start
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return seconds, peak/(1 << 20)
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark Excel ingestion.")
+	parser.add_argument("--rows", type=int, default=100000)
+	parser.add_argument("--fields", type=int, default=4)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+		file_name = os.path.join(temp_dir, "benchmark.xlsx")
+		write_workbook(file_name, args.rows, args.fields)
+		excel_source = carta_local.ExcelDataSource(file_name)
+
+		results = {
+			"per_cell": measure_call(lambda: per_cell_pull(file_name)),
+			"bulk": measure_call(excel_source.pull_data),
+			"bulk_two_fields": measure_call(lambda: excel_source.pull_data(["field_0", "field_1"]))
+		}
+	print ("{} rows x {} fields".format(args.rows, args.fields))
+	for name, (seconds, peak_mb) in results.items():
+		print ("{}: {:.2f}s, peak {:.1f} MB".format(name, seconds, peak_mb))
+
+if __name__=="__main__":
+	main()
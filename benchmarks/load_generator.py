@@ -0,0 +1,125 @@
+# load generator for carta_server
+#
+# usage: python benchmarks/load_generator.py --spawn-rows 100000 --users 50 --duration 10
+#        python benchmarks/load_generator.py --port 8765 --users 50 --duration 10
+#
+# Each virtual user keeps one connection open and loops: fetch review items, then submit answers for them.
+# Reports throughput and p50/p99 latency per request type.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "carta_server.py")
+
+class Connection:
+	"""Minimal HTTP/1.1 keep-alive client for the server's JSON API.
+	"""
+	def __init__(self, reader, writer):
+		self.reader = reader
+		self.writer = writer
+
+	async def request(self, method, target, body=None):
+		payload = b"" if body is None else json.dumps(body).encode()
+		self.writer.write("{} {} HTTP/1.1\r\nHost: carta\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(
+			method, target, len(payload)).encode() + payload)
+		await self.writer.drain()
+		status = int((await self.reader.readline()).split()[1])
+		length = 0
+		while True:
+			line = await self.reader.readline()
+			if line in (b"\r\n", b""):
+				break
+			name, value = line.decode("latin-1").split(":", 1)
+			if name.strip().lower() == "content-length":
+				length = int(value)
+		response = json.loads(await self.reader.readexactly(length))
+		if status != 200:
+			raise Exception("{} {} failed: {}".format(method, target, response))
+		return response
+
+async def connect(args):
+	if args.socket is not None:
+		return Connection(*(await asyncio.open_unix_connection(args.socket)))
+	return Connection(*(await asyncio.open_connection(args.host, args.port)))
+
+async def virtual_user(user_id, args, deadline, latencies):
+	rng = random.Random(user_id)
+	connection = await connect(args)
+	deck_id = (await connection.request("GET", "/decks"))["decks"][0]["deck_id"]
+	while time.perf_counter() < deadline:
+		start = time.perf_counter()
+		items = (await connection.request("GET", "/review?user=user{}&deck={}&limit={}&options=4".format(
+			user_id, deck_id, args.batch)))["items"]
+		latencies["review"].append(time.perf_counter() - start)
+
+		results = [[item["key"], rng.random() < 0.8, None] for item in items]
+		start = time.perf_counter()
+		await connection.request("POST", "/answers", {"user": "user{}".format(user_id), "deck": deck_id, "results": results})
+		latencies["answers"].append(time.perf_counter() - start)
+	connection.writer.close()
+
+def percentile(values, fraction):
+	ordered = sorted(values)
+	return ordered[min(int(fraction*len(ordered)), len(ordered) - 1)]
+
+async def run_load(args):
+	latencies = {"review": [], "answers": []}
+	start = time.perf_counter()
+	deadline = start + args.duration
+	await asyncio.gather(*[virtual_user(i, args, deadline, latencies) for i in range(args.users)])
+	elapsed = time.perf_counter() - start
+
+	total = sum(len(values) for values in latencies.values())
+	print ("{} users, {:.1f}s: {} requests, {:.0f} requests/s".format(args.users, elapsed, total, total/elapsed))
+	for name, values in latencies.items():
+		if values:
+			print ("{:<8} n={:<7} p50={:.2f}ms p99={:.2f}ms".format(
+				name, len(values), percentile(values, 0.5)*1000, percentile(values, 0.99)*1000))
+
+def wait_for_server(server_process):
+	line = server_process.stdout.readline()
+	if not line.startswith("Serving"):
+		raise Exception("Server failed to start: {}".format(line))
+
+def main():
+	parser = argparse.ArgumentParser(description="Generate load against carta_server.")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8765)
+	parser.add_argument("--socket")
+	parser.add_argument("--users", type=int, default=20)
+	parser.add_argument("--duration", type=float, default=10)
+	parser.add_argument("--batch", type=int, default=10, help="review items fetched per round trip")
+	parser.add_argument("--spawn-rows", type=int, help="start a server over a synthetic csv with this many rows")
+	args = parser.parse_args()
+
+	if args.spawn_rows is None:
+		asyncio.run(run_load(args))
+		return
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+		csv_file = synthetic.write_csv(os.path.join(temp_dir, "load.csv"), args.spawn_rows)
+		command = [sys.executable, SERVER_SCRIPT, "--csv", csv_file, "--front", "word", "--back", "translation",
+		           "--state-dir", os.path.join(temp_dir, "users")]
+		if args.socket is not None:
+			command += ["--socket", args.socket]
+		else:
+			command += ["--host", args.host, "--port", str(args.port)]
+		server_process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+		try:
+			wait_for_server(server_process)
+			asyncio.run(run_load(args))
+		finally:
+			server_process.terminate()
+			server_process.wait()
+
+if __name__=="__main__":
+	main()
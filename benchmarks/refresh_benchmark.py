@@ -0,0 +1,49 @@
+# benchmark for refresh.refresh_all: serial against parallel refresh of a multi-data-set collection
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import carta_local
+import data
+import deck
+import refresh
+import review_scheme
+import synthetic
+
+def build_collection(file_names, decks_per_data_set):
+	data_sets = [data.DataSet(carta_local.CsvDataSource(file_name)) for file_name in file_names]
+	decks = []
+	sides = [("word", "translation"), ("translation", "word"), ("word", "category"), ("category", "word")]
+	for data_set in data_sets:
+		for front, back in sides[:decks_per_data_set]:
+			decks.append(deck.Deck(data_set, front, back, review_scheme.LeitnerReviewScheme()))
+	return data_sets, decks
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark serial and parallel data set refresh.")
+	parser.add_argument("--data-sets", type=int, default=40)
+	parser.add_argument("--rows", type=int, default=50000)
+	parser.add_argument("--decks-per-data-set", type=int, default=4)
+	parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+		file_names = synthetic.write_collection(temp_dir, args.data_sets, args.rows)
+		data_sets, decks = build_collection(file_names, args.decks_per_data_set)
+		print ("{} data sets x {} rows, {} decks".format(args.data_sets, args.rows, len(decks)))
+		serial_seconds = None
+		for workers in args.workers:
+			start = time.perf_counter()
+			refresh.refresh_all(data_sets, workers=workers, force=True)
+			seconds = time.perf_counter() - start
+			if serial_seconds is None:
+				serial_seconds = seconds
+			print ("workers={:<3} {:.2f}s ({:.2f}x)".format(workers, seconds, serial_seconds/seconds))
+
+if __name__=="__main__":
+	main()
@@ -0,0 +1,146 @@
+# benchmark suite for carta
+#
+# usage: python benchmarks/run_benchmarks.py [--sizes 1000 10000 ...] [--output results.json] [--baseline old.json]
+#
+# Times the hot paths on synthetic data sets of each size, writes the results as JSON, and optionally
+# compares them against a baseline JSON file, exiting with status 1 if any case regressed.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import carta_local
+import data
+import deck
+import review_scheme
+import synthetic
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+NUM_LOOKUPS = 1000
+NUM_REVIEWS = 20
+# cases faster than this are too noisy to flag as regressions
+MIN_COMPARABLE_SECONDS = 0.001
+
+def measure(fn, repeat):
+	"""Returns the fastest of repeat timed calls to fn, in seconds.
+	"""
+	best = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		fn()
+		seconds = time.perf_counter() - start
+		if (best is None) or (seconds < best):
+			best = seconds
+	return best
+
+def age_cards(bench_deck, rng):
+	"""Gives about half the cards a review history, so due queries have real work to do.
+	"""
+	now = datetime.datetime.now()
+	for card in bench_deck.cards:
+		if rng.random() < 0.5:
+			card.status = rng.randrange(0, 6)
+			card.status_dt = now - datetime.timedelta(days=rng.random()*10)
+	if bench_deck.due_queue is not None:
+		bench_deck.due_queue.rebuild(bench_deck.cards)
+
+def run_size(num_rows, repeat, temp_dir):
+	rng = random.Random(num_rows)
+	csv_file = synthetic.write_csv(os.path.join(temp_dir, "bench_{}.csv".format(num_rows)), num_rows)
+	save_file = os.path.join(temp_dir, "carta_data_{}.p".format(num_rows))
+	results = {}
+
+	bare_data_set = data.DataSet(carta_local.CsvDataSource(csv_file))
+	results["data_set_update"] = measure(lambda: bare_data_set.update(force=True), repeat)
+	results["data_set_update_unchanged"] = measure(bare_data_set.update, repeat)
+
+	data_set = data.DataSet(carta_local.CsvDataSource(csv_file))
+	leitner_deck = deck.Deck(data_set, "word", "translation", review_scheme.LeitnerReviewScheme())
+	streak_deck = deck.Deck(data_set, "word", "translation", review_scheme.StreakReviewScheme())
+	age_cards(leitner_deck, rng)
+	age_cards(streak_deck, rng)
+
+	results["deck_load_data_from_source"] = measure(leitner_deck.load_data_from_source, repeat)
+	results["get_cards_to_review_leitner"] = measure(leitner_deck.get_cards_to_review, repeat)
+	results["get_cards_to_review_streak"] = measure(streak_deck.get_cards_to_review, repeat)
+
+	lookups = [leitner_deck.get_random_card() for i in range(NUM_LOOKUPS)]
+	lookups = [(card.front_side, card.back_side) for card in lookups]
+	results["find_card_by_side_x{}".format(NUM_LOOKUPS)] = measure(
+		lambda: [leitner_deck.find_card_by_side(front, back) for front, back in lookups], repeat)
+	results["get_options_x{}".format(NUM_LOOKUPS)] = measure(
+		lambda: [leitner_deck.review_scheme.get_options(4, back, leitner_deck) for front, back in lookups], repeat)
+
+	data_sets, decks = [data_set], [leitner_deck, streak_deck]
+	results["save_data_checkpoint"] = measure(lambda: carta_local.save_data(data_sets, decks, save_file, compact=True), repeat)
+	def review_and_save():
+		for card in leitner_deck.get_cards_to_review(NUM_REVIEWS)[:NUM_REVIEWS]:
+			card.update_card(rng.random() < 0.8)
+		carta_local.save_data(data_sets, decks, save_file)
+	results["save_data_journal_{}_reviews".format(NUM_REVIEWS)] = measure(review_and_save, repeat)
+	results["load_from_file"] = measure(lambda: carta_local.load_from_file(save_file), repeat)
+	return results
+
+def compare(results, baseline, tolerance):
+	"""Prints the ratio of each result to the baseline. Returns the (case, size) pairs slower by more than tolerance.
+	"""
+	regressions = []
+	for case, by_size in results.items():
+		for size, seconds in by_size.items():
+			base_seconds = baseline.get(case, {}).get(size)
+			if not base_seconds:
+				continue
+			ratio = seconds/base_seconds
+			flag = ""
+			if (ratio > 1 + tolerance) and (seconds >= MIN_COMPARABLE_SECONDS):
+				flag = "  REGRESSION"
+				regressions.append((case, size))
+			print ("{:<40} {:>9} {:>10.4f}s {:>8.2f}x{}".format(case, size, seconds, ratio, flag))
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(description="Run the carta benchmark suite.")
+	parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--output", default="benchmark_results.json")
+	parser.add_argument("--baseline", default=None, help="results JSON from an earlier run to compare against")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown relative to the baseline")
+	args = parser.parse_args()
+
+	results = {}
+	with tempfile.TemporaryDirectory() as temp_dir:
+		for num_rows in args.sizes:
+			print ("Running {} rows..".format(num_rows))
+			for case, seconds in run_size(num_rows, args.repeat, temp_dir).items():
+				results.setdefault(case, {})[str(num_rows)] = seconds
+
+	output = {
+		"meta": {
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"date": datetime.datetime.now().isoformat(),
+			"sizes": args.sizes,
+			"repeat": args.repeat
+		},
+		"results": results
+	}
+	with open(args.output, "w") as output_file:
+		json.dump(output, output_file, indent=2)
+	print ("Results written to {}".format(args.output))
+
+	if args.baseline is not None:
+		with open(args.baseline) as baseline_file:
+			baseline = json.load(baseline_file)["results"]
+		if compare(results, baseline, args.tolerance):
+			sys.exit(1)
+
+if __name__=="__main__":
+	main()
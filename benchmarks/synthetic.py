@@ -0,0 +1,33 @@
+# synthetic data sets for the benchmarks
+
+import csv
+import os
+import random
+
+FIELDS = ["word", "translation", "category", "notes"]
+
+def write_csv(file_name, num_rows, num_categories=50, seed=0):
+	"""Writes a vocabulary-like csv with num_rows rows. Fronts (word) are unique, translations repeat
+		roughly ten times each, and category has num_categories distinct values.
+	"""
+	rng = random.Random(seed)
+	num_translations = max(num_rows//10, 4)
+	with open(file_name, "w", newline="") as csvfile:
+		csv_writer = csv.writer(csvfile)
+		csv_writer.writerow(FIELDS)
+		for i in range(num_rows):
+			csv_writer.writerow([
+				"word_{}".format(i),
+				"translation_{}".format(rng.randrange(num_translations)),
+				"category_{}".format(rng.randrange(num_categories)),
+				"note {} for word {}".format(rng.random(), i)
+			])
+	return file_name
+
+def write_collection(directory, num_data_sets, num_rows, seed=0):
+	"""Writes num_data_sets csv files of num_rows rows each, returning their paths.
+	"""
+	file_names = []
+	for i in range(num_data_sets):
+		file_names.append(write_csv(os.path.join(directory, "data_set_{}.csv".format(i)), num_rows, seed=seed + i))
+	return file_names
@@ -0,0 +1,337 @@
+import bisect
+import datetime
+import math
+import random
+import time
+
+import diagnostics
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+class CardView:
+	"""CardView -
+		Lightweight Card over a CardStore. Reads and writes go straight to the store's arrays,
+			so a view can be created on demand and discarded.
+
+		store (CardStore): the store holding the card's data
+		position (int): index of the card within the store
+	"""
+	__slots__ = ("store", "position")
+
+	def __init__(self, store, position):
+		self.store    = store
+		self.position = position
+
+	@property
+	def front_side(self):
+		return self.store.front_column[self.store.rows[self.position]]
+
+	@property
+	def back_side(self):
+		return self.store.back_column[self.store.rows[self.position]]
+
+	@property
+	def status(self):
+		return int(self.store.statuses[self.position])
+
+	@status.setter
+	def status(self, value):
+		self.store.statuses[self.position] = value
+
+	@property
+	def status_dt(self):
+		return datetime.datetime.fromtimestamp(int(self.store.status_ts[self.position]))
+
+	@status_dt.setter
+	def status_dt(self, value):
+		self.store.status_ts[self.position] = int(value.timestamp())
+
+	@property
+	def parent(self):
+		return self.store.deck
+
+	@diagnostics.timed("Card.update_card")
+	def update_card(self, success, status_dt=None):
+		with self.parent.review_lock:
+			prior_status, prior_status_ts = self.status, self.store.status_ts[self.position]
+			self.status = self.parent.review_scheme.status_update(success, self)
+			if status_dt is None:
+				self.store.status_ts[self.position] = int(time.time())
+			else:
+				self.status_dt = status_dt
+			try:
+				self.parent.record_review(self, success, prior_status)
+			except BaseException:
+				# the review wasn't journaled, so it must not be kept in memory either
+				self.status, self.store.status_ts[self.position] = prior_status, prior_status_ts
+				raise
+
+	def __eq__(self, other):
+		return isinstance(other, CardView) and (self.store is other.store) and (self.position == other.position)
+
+	def __hash__(self):
+		return hash((id(self.store), self.position))
+
+class CardStore:
+	"""CardStore -
+		Columnar storage for the cards of a Deck, used in place of a list of Card objects.
+
+		Sides are not copied: each card holds the index of its row in the parent DataSet's columns.
+			Behaves as a sequence of CardView objects, so it can stand in for Deck.cards.
+
+		deck (Deck): deck that owns the store
+		front_column, back_column (list): the DataSet columns the rows index into
+		rows (int64 array): row of each card within the columns
+		statuses (int16 array): status of each card
+		status_ts (int64 array): time each status was last updated, in seconds since the epoch
+		index (dictionary): [front side]: position of the card in the store
+		count_cache (DueCounter): incremental due and new counts for due_counts, or None until first counted
+	"""
+	def __init__(self, deck):
+		if np is None:
+			raise Exception("The columnar card store requires numpy.")
+		self.deck         = deck
+		self.front_column = []
+		self.back_column  = []
+		self.rows         = np.empty(0, dtype=np.int64)
+		self.statuses     = np.empty(0, dtype=np.int16)
+		self.status_ts    = np.empty(0, dtype=np.int64)
+		self.index        = {}
+		self.count_cache  = None
+
+	def reconcile(self, front_column, back_column, filter_fn, row_indices=None, alternates=None):
+		"""Rebuilds the store against new DataSet columns in one pass, keeping the state of existing cards.
+
+			Mirrors Deck.load_data_from_source, and returns the same summary dictionary.
+			filter_fn may be None, and row_indices restricts the pass to those rows of the columns.
+			The back sides of rows with a duplicate front side are added to alternates, if given.
+		"""
+		default_status = self.deck.review_scheme.default_status
+		n_rows = min(len(front_column), len(back_column))
+		rows      = np.empty(n_rows, dtype=np.int64)
+		statuses  = np.full(n_rows, default_status, dtype=np.int16)
+		status_ts = np.full(n_rows, int(time.time()), dtype=np.int64)
+		is_new    = np.ones(n_rows, dtype=bool)
+		new_index = {}
+		updated   = 0
+
+		n_cards = 0
+		for row in (range(n_rows) if row_indices is None else row_indices):
+			if row >= n_rows:
+				break
+			front = front_column[row]
+			if front in new_index:
+				if alternates is not None:
+					alternates.setdefault(front, []).append(back_column[row])
+				continue
+			new_index[front] = n_cards
+			rows[n_cards] = row
+			old_position = self.index.get(front)
+			if old_position is not None:
+				is_new[n_cards]    = False
+				statuses[n_cards]  = self.statuses[old_position]
+				status_ts[n_cards] = self.status_ts[old_position]
+				if self.back_column[self.rows[old_position]] != back_column[row]:
+					updated += 1
+			n_cards += 1
+
+		old_count = len(self.index)
+		self.front_column = front_column
+		self.back_column  = back_column
+		self.rows         = rows[:n_cards].copy()
+		self.statuses     = statuses[:n_cards].copy()
+		self.status_ts    = status_ts[:n_cards].copy()
+		self.index        = new_index
+		self.count_cache  = None
+		is_new            = is_new[:n_cards]
+
+		keep = None if filter_fn is None else np.fromiter((filter_fn(card) for card in self), dtype=bool, count=n_cards)
+		if (keep is not None) and not keep.all():
+			self._compress(keep)
+			is_new = is_new[keep]
+
+		added = int(is_new.sum())
+		return {"added": added, "updated": updated, "removed": old_count - (len(self) - added)}
+
+	def append(self, front_side, back_side, status):
+		"""Adds a card whose sides are not (yet) in the DataSet columns.
+		"""
+		if (type(self.front_column) != list) or (self.front_column is self.deck.parent[self.deck.front_side]):
+			self.front_column = list(self.front_column)
+			self.back_column  = list(self.back_column)
+		self.front_column.append(front_side)
+		self.back_column.append(back_side)
+		self.rows      = np.append(self.rows, len(self.front_column) - 1)
+		self.statuses  = np.append(self.statuses, np.int16(status))
+		self.status_ts = np.append(self.status_ts, np.int64(time.time()))
+		self.index[front_side] = len(self) - 1
+		self.count_cache = None
+		return self[len(self) - 1]
+
+	def get(self, front_side):
+		position = self.index.get(front_side)
+		if position is None:
+			return None
+		return CardView(self, position)
+
+	def select(self, due_times, new_limit, now=None, due_limit=None):
+		"""Returns the cards due at time now, in due order, followed by up to new_limit new cards.
+
+			due_times (array): next due time of each card, as computed by the review scheme
+		"""
+		if now is None:
+			now = time.time()
+		reviewed = self.statuses != self.deck.review_scheme.default_status
+		due_positions = np.flatnonzero(reviewed & (due_times <= now))
+		due_positions = due_positions[np.argsort(due_times[due_positions], kind="stable")]
+		if due_limit is not None:
+			due_positions = due_positions[:due_limit]
+		new_positions = np.flatnonzero(~reviewed)[:new_limit]
+		return [CardView(self, int(position)) for position in np.concatenate((due_positions, new_positions))]
+
+	def due_counts(self, scheme, now=None):
+		"""Returns (number of reviewed cards due at time now, number of new cards). The first call counts with a
+			vectorized pass; after that reviews adjust the counts (see note_review), so each call is O(log n).
+		"""
+		if now is None:
+			now = time.time()
+		counter = self.count_cache
+		if (counter is None) or (counter.scheme is not scheme) or (now < counter.counted_at):
+			counter = DueCounter(self, scheme, now)
+			self.count_cache = counter
+		return counter.counts(now)
+
+	def note_review(self, position):
+		"""Called by the deck after the status of the card at position changes, to adjust the counts.
+		"""
+		counter = self.count_cache
+		if counter is not None:
+			if self.statuses[position] == counter.scheme.default_status:
+				counter.update(position, None)
+			else:
+				counter.update(position, counter.scheme.due_time(CardView(self, position)))
+
+	def iter_select(self, due_times, new_limit, now=None, due_limit=None, batch_size=64):
+		"""Generator version of select. Due cards are ordered batch_size at a time with a partial sort,
+			so taking the first cards doesn't sort every due card.
+		"""
+		if now is None:
+			now = time.time()
+		reviewed = self.statuses != self.deck.review_scheme.default_status
+		due_positions = np.flatnonzero(reviewed & (due_times <= now))
+		new_positions = np.flatnonzero(~reviewed)[:new_limit]
+		if due_limit is not None:
+			due_limit = min(due_limit, len(due_positions))
+		else:
+			due_limit = len(due_positions)
+		due_times = due_times[due_positions]
+		taken = 0
+		while taken < due_limit:
+			k = min(batch_size, len(due_positions))
+			if k < len(due_positions):
+				order = np.argpartition(due_times, k - 1)
+				batch, rest = order[:k], order[k:]
+			else:
+				batch, rest = np.arange(len(due_positions)), np.arange(0)
+			batch = batch[np.argsort(due_times[batch], kind="stable")]
+			for position in due_positions[batch][:due_limit - taken].tolist():
+				taken += 1
+				yield CardView(self, position)
+			due_positions, due_times = due_positions[rest], due_times[rest]
+		for position in new_positions.tolist():
+			yield CardView(self, position)
+
+	def shuffle(self):
+		permutation = np.random.permutation(len(self))
+		self.rows      = self.rows[permutation]
+		self.statuses  = self.statuses[permutation]
+		self.status_ts = self.status_ts[permutation]
+		self._rebuild_index()
+
+	def _compress(self, mask):
+		self.rows      = self.rows[mask]
+		self.statuses  = self.statuses[mask]
+		self.status_ts = self.status_ts[mask]
+		self._rebuild_index()
+
+	def _rebuild_index(self):
+		self.index = {self.front_column[row]: position for position, row in enumerate(self.rows.tolist())}
+		self.count_cache = None
+
+	def __len__(self):
+		return len(self.rows)
+
+	def __getitem__(self, key):
+		if key < 0:
+			key += len(self)
+		if (key < 0) or (key >= len(self)):
+			raise IndexError("card index out of range")
+		return CardView(self, key)
+
+	def __iter__(self):
+		for position in range(len(self)):
+			yield CardView(self, position)
+
+class DueCounter:
+	"""DueCounter -
+		Due and new card counts of a CardStore, kept up to date review by review.
+
+		Built with one vectorized pass at time counted_at: cards due by then are counted in num_due, and the due
+			times of the others are kept sorted in pending. A review adjusts the counts by the card's old and new
+			due time; new due times after counted_at go to added, and old ones that were still pending go to removed,
+			so the count at a later time is a few binary searches. The counter is rebuilt after MAX_CHANGES reviews.
+
+		due_at (float64 array): due time of each card as counted, or nan for new cards
+	"""
+	MAX_CHANGES = 4096
+
+	def __init__(self, store, scheme, now):
+		self.scheme     = scheme
+		self.counted_at = now
+		due_times = scheme.due_times(store).astype(np.float64)
+		reviewed = store.statuses != scheme.default_status
+		due = reviewed & (due_times <= now)
+		self.due_at  = np.where(reviewed, due_times, np.nan)
+		self.num_due = int(due.sum())
+		self.num_new = int(len(reviewed) - reviewed.sum())
+		self.pending = np.sort(due_times[reviewed & ~due])
+		self.added   = []
+		self.removed = []
+
+	def update(self, position, due_time):
+		"""Moves the card at position from its counted due time to due_time (None for a new card).
+		"""
+		old = self.due_at[position]
+		if math.isnan(old):
+			self.num_new -= 1
+		elif old <= self.counted_at:
+			self.num_due -= 1
+		else:
+			bisect.insort(self.removed, old)
+		if due_time is None:
+			self.num_new += 1
+			self.due_at[position] = np.nan
+		else:
+			if due_time <= self.counted_at:
+				self.num_due += 1
+			else:
+				bisect.insort(self.added, due_time)
+			self.due_at[position] = due_time
+		if len(self.added) + len(self.removed) > self.MAX_CHANGES:
+			self.rebase()
+
+	def rebase(self):
+		"""Folds added and removed into pending, by sorting the current due times again.
+		"""
+		self.pending = np.sort(self.due_at[self.due_at > self.counted_at])
+		self.added, self.removed = [], []
+
+	def counts(self, now):
+		"""Returns (due, new) at time now, which must not be earlier than counted_at.
+		"""
+		due = (self.num_due + int(np.searchsorted(self.pending, now, side="right"))
+		       + bisect.bisect_right(self.added, now) - bisect.bisect_right(self.removed, now))
+		return due, self.num_new
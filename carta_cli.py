@@ -9,44 +9,57 @@ import review_scheme
 import data
 import deck
 import carta_local
+import review_session
+import refresh
+import diagnostics
+import review_stats
+import forecast
 
 data_sets = []
 decks = []
+saver = None
+store = None
+
+# the collection is saved to DATA_FILE, or to STORE_FILE when CARTA_STORE=sqlite, which writes reviews through as they happen
+DATA_FILE = "carta_data.p"
+STORE_FILE = "carta_data.db"
+
+# set CARTA_DIAGNOSTICS=1 to collect timings from startup, and CARTA_PROFILE=<file> to also profile the session
+DIAGNOSTICS_FILE = "carta_diagnostics.json"
+# review items prepared in the background while the current one is answered
+PREFETCH_ITEMS = 3
 
 def input_review(deck):
-	cards = deck.review_scheme.get_cards_to_review(deck)
-	for card in cards:
-		print ("Front side: {}".format(card.front_side))
+	with review_session.ReviewSession(deck, prefetch=PREFETCH_ITEMS) as session:
+		run_input_review(session)
+
+def run_input_review(session):
+	for item in session:
+		print ("Front side: {}".format(item.front_side))
 		answer = input("Enter the answer: ")
-		if answer == card.back_side:
-			print ("Correct!")
-			card.update_card(True)
+		if session.answer(item, answer):
+			if answer == item.back_side:
+				print ("Correct!")
+			else:
+				print ("Correct! - exactly: {}".format(item.back_side))
 		else:
-			print ("Incorrect!")
-			card.update_card(False)
+			print ("Incorrect - the correct answer is: {}".format(item.back_side))
 
 def multichoice_review(deck):
-	cards = deck.review_scheme.get_cards_to_review(deck)
-	for card in cards:
-		print ("Front side: {}".format(card.front_side))
-		options = [card]
-		while (len(options) < 4) or (len(options) == len(deck.cards)):
-			new_card = deck.get_random_card()
-			if new_card in options:
-				continue
-			options.append(new_card)
-		random.shuffle(options)
-		for i, option in enumerate(options):
-			print ("{}: {}".format(i, option.back_side))
+	with review_session.ReviewSession(deck, num_options=4, prefetch=PREFETCH_ITEMS) as session:
+		run_multichoice_review(session)
+
+def run_multichoice_review(session):
+	for item in session:
+		print ("Front side: {}".format(item.front_side))
+		for i, option in enumerate(item.options):
+			print ("{}: {}".format(i, option))
 		
 		answer = int(input("Enter the answer: "))
-		answer = options[answer].back_side
-		if answer == card.back_side:
+		if session.answer(item, item.options[answer]):
 			print ("Correct!")
-			card.update_card(True)
 		else:
-			print ("Incorrect - the correct answer is: {}".format(card.back_side))
-			card.update_card(False)
+			print ("Incorrect - the correct answer is: {}".format(item.back_side))
 
 def view_all_cards(deck):
 	for card in deck.cards:
@@ -95,7 +108,14 @@ def add_new_deck(data_set = None):
 		review_scheme_obj = review_scheme.LeitnerReviewScheme()
 	elif review_scheme_no == 2:
 		review_scheme_obj = review_scheme.StreakReviewScheme()
-	decks.append(deck.Deck(data_set, front_side, back_side, review_scheme_obj))
+	new_deck = deck.Deck(data_set, front_side, back_side, review_scheme_obj)
+	new_deck.history = collection_history()
+	decks.append(new_deck)
+
+def collection_history():
+	"""Returns the ReviewHistory kept next to the collection's save file, so new decks record reviews before the first save.
+	"""
+	return carta_local.get_history(STORE_FILE if store is not None else DATA_FILE)
 
 def deck_detail(deck):
 	print ("-"*30)
@@ -105,6 +125,8 @@ def deck_detail(deck):
 	
 	print ("1: review")
 	print ("2: delete deck")
+	print ("3: statistics")
+	print ("4: forecast")
 	print ("0: return")
 	selection = int(input("Enter your selection: "))
 	
@@ -113,17 +135,44 @@ def deck_detail(deck):
 	elif selection == 1:
 		review_menu(deck)
 	elif selection == 2:
-		global decks
 		print ("Deleting..")
-		decks = [d for d in decks if d != deck]
+		# in place, as the background saver holds the list
+		decks[:] = [d for d in decks if d != deck]
+	elif selection == 3:
+		deck_statistics(deck)
+	elif selection == 4:
+		deck_forecast(deck)
 	else:
 		print ("Invalid input..")
 		deck_detail()
 		return		
 
+def deck_statistics(deck):
+	if deck.history is None:
+		print ("This deck has no review history.")
+		return
+	records = deck.history.records(deck.deck_id)
+	print ("{} reviews recorded.".format(len(records)))
+	by_status = review_stats.pass_rates(records)
+	for status, reviews, pass_rate in zip(by_status["status"], by_status["reviews"], by_status["pass_rate"]):
+		print ("status {:>3}: {:>7} reviews, {:.0%} passed".format(status, reviews, pass_rate))
+	curve = review_stats.retention_curve(records)
+	for days, reviews, retention in zip(curve["bin_days"], curve["reviews"], curve["retention"]):
+		if reviews:
+			print ("up to {:>4} days: {:>7} reviews, {:.0%} retained".format(days, reviews, retention))
+	load = review_stats.daily_load(records)
+	for day, reviews in list(zip(load["day"], load["reviews"]))[-7:]:
+		print ("{}: {} reviews".format(day, reviews))
+
+def deck_forecast(deck):
+	days = int(input("Days to forecast: "))
+	success_probability = float(input("Expected success rate (0-1): "))
+	print ("Reviews per week, with this deck's settings:")
+	print (forecast.report(forecast.compare(deck, days=days, success_probability=success_probability)))
+
 def view_decks():
-	for i, deck in enumerate(decks):
-		print ("{}: {}".format(i+1, deck.name()))
+	for i, (deck, due, new) in enumerate(review_session.due_summary(decks, store=store)["decks"]):
+		print ("{}: {} ({} due, {} new)".format(i+1, deck.name(), due, new))
 	
 	print ("0: Return")
 	selection = int(input("Enter your selection: "))
@@ -155,10 +204,9 @@ def data_set_detail(data_set):
 	elif selection == 2:
 		print ("Note: this will delete all child decks.")
 		if input("Are you sure you want to continue (Y/N").lower() == "y":
-			global data_sets
-			global decks
-			data_sets = [ds for ds in data_sets if ds != data_set]
-			decks = [d for d in decks if d.parent != data_set]
+			# in place, as the background saver holds the lists
+			data_sets[:] = [ds for ds in data_sets if ds != data_set]
+			decks[:] = [d for d in decks if d.parent != data_set]
 		return
 	else:
 		print ("Invalid input..")
@@ -183,24 +231,39 @@ def view_data_sets():
 def add_new_data_set():
 	print ("1: New csv data set")
 	print ("2: New excel data set")
+	print ("3: New sqlite data set")
+	print ("4: New data set from a directory or glob of csv/excel files")
 	selection = int(input("Enter your selection: "))
-	file_name = input("Enter the file location: ")
+	file_name = input("Enter the {}: ".format("directory or pattern" if selection == 4 else "file location"))
 	data_source = None
 	if selection == 1:
 		data_source = carta_local.CsvDataSource(file_name)
 	elif selection == 2:
-		data_source = carta_local.ExcelDataSource(file_name)
-	data_set = data.DataSet(data_source)
+		sheet = input("Enter the sheet name (blank for the first sheet): ")
+		data_source = carta_local.ExcelDataSource(file_name, sheet if sheet else 0)
+	elif selection == 3:
+		table_name = input("Enter the table name: ")
+		data_source = carta_local.SqliteDataSource(file_name, table_name)
+	elif selection == 4:
+		data_source = carta_local.MultiFileDataSource(file_name)
+	data_set = data.DataSet(data_source, lazy=(selection == 3), cache=(selection in [1, 2]))
 	data_sets.append(data_set)
 	
 
+def refresh_data_sets():
+	results = refresh.refresh_all(data_sets)
+	refreshed = len([result for result in results if result["reloaded"]])
+	print ("Refreshed {} of {} data sets.".format(refreshed, len(data_sets)))
+
 def data_set_menu():
 	next_steps = {
 		1: view_data_sets,
-		2: add_new_data_set
+		2: add_new_data_set,
+		3: refresh_data_sets
 	}
 	print ("1: View Data Sets")
 	print ("2: Add a New Data Set")
+	print ("3: Refresh All Data Sets")
 	print ("0: Return")
 	selection = int(input("Enter your selection: "))
 	if selection == 0:
@@ -221,17 +284,60 @@ def deck_menu():
 	next_steps[selection]()
 
 def save_data():
-	carta_local.save_data(data_sets, decks, "carta_data.p")
+	if store is not None:
+		store.save(data_sets, decks)
+		return
+	saver.request()
+	if saver.last_error is not None:
+		print ("The last save failed: {}".format(saver.last_error))
+
+def diagnostics_menu():
+	print ("Instrumentation is {}.".format("on" if diagnostics.enabled else "off"))
+	print (diagnostics.report())
+	print ("1: {} Instrumentation".format("Disable" if diagnostics.enabled else "Enable"))
+	print ("2: Reset")
+	print ("3: Write to {}".format(DIAGNOSTICS_FILE))
+	print ("0: Return")
+	selection = int(input("Enter your selection: "))
+	if selection == 1:
+		if diagnostics.enabled:
+			diagnostics.disable()
+		else:
+			diagnostics.enable()
+	elif selection == 2:
+		diagnostics.reset()
+	elif selection == 3:
+		diagnostics.dump(DIAGNOSTICS_FILE)
+
+def review_everything():
+	print ("1: Multiple Choice Review")
+	print ("2: Input Review")
+	print ("0: Return")
+	selection = int(input("Enter your selection: "))
+	if selection == 0:
+		return
+	num_options = 4 if selection == 1 else 0
+	with review_session.CollectionReviewSession(decks, num_options=num_options, prefetch=PREFETCH_ITEMS) as session:
+		if selection == 1:
+			run_multichoice_review(session)
+		else:
+			run_input_review(session)
 
 def carta_menu():
 	next_steps = {
 		1: data_set_menu,
 		2: deck_menu,
-		3: save_data
+		3: save_data,
+		4: diagnostics_menu,
+		5: review_everything
 	}
+	summary = review_session.due_summary(decks, store=store)
+	print ("Due now: {} reviews and {} new cards, across {} decks.".format(summary["due"], summary["new"], len(decks)))
 	print ("1: Data Sets")
 	print ("2: Decks")
 	print ("3: Save")
+	print ("4: Diagnostics")
+	print ("5: Review Everything Due")
 	print ("0: Exit")
 	
 	selection = int (input("Enter your selection: "))
@@ -248,10 +354,32 @@ def main_loop():
 			break
 
 if __name__=="__main__":
-	if (os.path.isfile('carta_data.p')):
-		c_data = carta_local.load_from_file('carta_data.p')
+	if os.environ.get("CARTA_DIAGNOSTICS") or os.environ.get("CARTA_PROFILE"):
+		diagnostics.enable(os.environ.get("CARTA_PROFILE"))
+
+	if os.environ.get("CARTA_STORE") == "sqlite":
+		store = carta_local.SqliteStore(STORE_FILE)
+		c_data = store.load()
+		data_sets = c_data["data_set"]
+		decks = c_data["decks"]
+		for loaded_deck in decks:
+			loaded_deck.history = collection_history()
+	elif (os.path.isfile(DATA_FILE)):
+		c_data = carta_local.load_from_file(DATA_FILE)
 		data_sets = c_data["data_set"]
 		decks = c_data["decks"]
 	
-	
-	main_loop()
+	if store is None:
+		saver = carta_local.BackgroundSaver(data_sets, decks, DATA_FILE)
+	try:
+		main_loop()
+	finally:
+		if saver is not None:
+			saver.close()
+			if saver.last_error is not None:
+				print ("Saving failed: {}".format(saver.last_error))
+		if store is not None:
+			store.close()
+		if diagnostics.enabled or diagnostics.timers:
+			diagnostics.disable()
+			diagnostics.dump(DIAGNOSTICS_FILE)
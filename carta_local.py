@@ -1,60 +1,202 @@
+import concurrent.futures
 import csv
+import glob
 import random
 import json
 import os
 import datetime
 import re
+import hashlib
+import sqlite3
+import threading
+import uuid
 import xlrd
+import openpyxl
 import dill
 
 import data
+import answers
+import column_cache
 import deck
+import diagnostics
+import filters
+import review_history
 import review_scheme
 
 DEFAULT_DATETIME_REP = "%m/%d/%Y, %H:%M:%S"
 
+def file_fingerprint(file_name, hash_content=False):
+        """Fingerprint of a file for change detection: (mtime, size), plus a content digest if hash_content is set.
+        """
+        file_stat = os.stat(file_name)
+        fingerprint = (file_stat.st_mtime_ns, file_stat.st_size)
+        if hash_content:
+                digest = hashlib.blake2b(digest_size=16)
+                with open(file_name, "rb") as input_file:
+                        for chunk in iter(lambda: input_file.read(1 << 20), b""):
+                                digest.update(chunk)
+                fingerprint += (digest.hexdigest(),)
+        return fingerprint
+
+def field_positions(header, fields, source_str):
+        """Positions of fields (all fields if None) within header.
+        """
+        if fields is None:
+                return list(range(len(header)))
+        for field_name in fields:
+                if field_name not in header:
+                        raise Exception("Field {} not found in {}.".format(field_name, source_str))
+        return [header.index(field_name) for field_name in fields]
+
 class CsvDataSource(data.DataSource):
         """Pulls/pushes data from a csv file. Uses header and standard delimitation settings. 
+
+                hash_content (bool): include a hash of the file in its fingerprint, to catch edits that keep the mtime and size
         """
-        def __init__(self, file_name, read_only=True):
+        supports_where = True
+
+        def __init__(self, file_name, read_only=True, hash_content=False):
                 super().__init__(read_only)
                 self.file_name = file_name
+                self.hash_content = hash_content
+
+        def fingerprint(self):
+                return file_fingerprint(self.file_name, self.hash_content)
+
+        def cache_path(self):
+                return self.file_name + ".carta-cache"
         
-        def pull_data(self):
-                data_matrix = []
-                data_dict   = {}
-                with open(self.file_name) as csvfile:
-                        csv_reader = csv.reader(csvfile)
-                        data_matrix = [row for row in csv_reader]
-                header = data_matrix[0]
-                data_matrix = data_matrix[1:]
+        def header(self):
+                with open(self.file_name, newline="") as csvfile:
+                        return self.read_header(csv.reader(csvfile))
 
-                num_fields = len(header)
+        def read_header(self, csv_reader):
+                header = next(csv_reader, None)
+                if header is None:
+                        raise Exception("Invalid csv file: {} has no header.".format(self.file_name))
+                return header
 
-                for row in data_matrix:
-                        if len(row) != num_fields:
-                                raise Exception("Invalid csv file.")
-                
-                for i, field_name in enumerate(header):
-                        data_dict[field_name] = [row[i] for row in data_matrix]
-                return data_dict
+        def check_row(self, row, num_fields, csv_reader):
+                if len(row) != num_fields:
+                        raise Exception("Invalid csv file: line {} of {} has {} fields, expected {}.".format(
+                                csv_reader.line_num, self.file_name, len(row), num_fields))
+
+        def iter_rows(self, chunk_size=10000, fields=None, where=None):
+                """Streams the file, yielding lists of up to chunk_size rows. Each row is a list of the
+                	values of fields (all fields if None), in that order. Rows not matching where are skipped.
+                """
+                with open(self.file_name, newline="") as csvfile:
+                        csv_reader = csv.reader(csvfile)
+                        header = self.read_header(csv_reader)
+                        num_fields = len(header)
+                        positions = field_positions(header, fields, self.file_name)
+                        predicate = None if where is None else filters.compile_for_header(where, header)
+                        chunk = []
+                        for row in csv_reader:
+                                self.check_row(row, num_fields, csv_reader)
+                                if (predicate is not None) and not predicate(row):
+                                        continue
+                                chunk.append([row[i] for i in positions])
+                                if len(chunk) >= chunk_size:
+                                        yield chunk
+                                        chunk = []
+                        if chunk:
+                                yield chunk
+
+        def pull_data(self, fields=None, where=None):
+                """Builds the columns in a single streaming pass, keeping only the values of fields (all fields if None)
+                	for the rows matching where.
+                """
+                with open(self.file_name, newline="") as csvfile:
+                        csv_reader = csv.reader(csvfile)
+                        header = self.read_header(csv_reader)
+                        num_fields = len(header)
+                        positions = field_positions(header, fields, self.file_name)
+                        predicate = None if where is None else filters.compile_for_header(where, header)
+                        columns = [[] for i in positions]
+                        appends = list(zip([column.append for column in columns], positions))
+                        for row in csv_reader:
+                                self.check_row(row, num_fields, csv_reader)
+                                if (predicate is not None) and not predicate(row):
+                                        continue
+                                for append, i in appends:
+                                        append(row[i])
+                return {header[i]: column for i, column in zip(positions, columns)}
         
         def push_data(self, data_dict):
+                """Writes data_dict ([FIELD NAME]: [list of values]) as the whole file, or applies a data.ChangeSet.
+                """
                 assert (not self.read_only)
-                header = []
-                data_matrix = []
-                for i, field_name in enumerate(data_dict.keys()):
-                        header.append(field_name)
-                        for j, val in enumerate(data_dict[field_name]):
-                                if i == 0:
-                                        data_matrix.append([val])
-                                else:
-                                        data_matrix[j].append(val)
-                data_matrix = [header] + data_matrix
-                with open(self.file_name, "w") as csvfile:
+                if isinstance(data_dict, data.ChangeSet):
+                        return self.push_changes(data_dict)
+                with self.rewrite() as csvfile:
                         csvwriter = csv.writer(csvfile)
-                        for row in data_matrix:
-                                csvwriter.writerow(row)
+                        csvwriter.writerow(list(data_dict.keys()))
+                        csvwriter.writerows(zip(*data_dict.values()))
+
+        def rewrite(self):
+                return AtomicRewrite(self.file_name)
+
+        def writer_format(self):
+                """Returns (line terminator, quoting) of the existing file, so written rows match the rows around them.
+                """
+                with open(self.file_name, newline="") as csvfile:
+                        first_line = csvfile.readline()
+                lineterminator = "\r\n" if first_line.endswith("\r\n") else "\n"
+                quoting = csv.QUOTE_ALL if first_line.startswith('"') else csv.QUOTE_MINIMAL
+                return lineterminator, quoting
+
+        def push_changes(self, change_set):
+                """Applies a data.ChangeSet, at a cost that scales with the change set. Inserts alone are appended to the
+                	file; updates and deletes stream the file into a replacement, copying unchanged rows verbatim.
+                	Inserted keys are not checked against existing rows.
+                """
+                header = self.header()
+                if change_set.key_field not in header:
+                        raise Exception("Field {} not found in {}.".format(change_set.key_field, self.file_name))
+                key_position = header.index(change_set.key_field)
+                lineterminator, quoting = self.writer_format()
+                def to_row(values, row=None):
+                        row = list(row) if row is not None else [""]*len(header)
+                        for field_name, val in values.items():
+                                if field_name not in header:
+                                        raise Exception("Field {} not found in {}.".format(field_name, self.file_name))
+                                row[header.index(field_name)] = val
+                        return row
+                inserted = [to_row(values) for values in change_set.inserted]
+
+                if not (change_set.updated or change_set.deleted):
+                        with open(self.file_name, "rb+") as csvfile:
+                                csvfile.seek(0, os.SEEK_END)
+                                if csvfile.tell() > 0:
+                                        csvfile.seek(-1, os.SEEK_END)
+                                        if csvfile.read(1) != b"\n":
+                                                csvfile.write(lineterminator.encode())
+                        with open(self.file_name, "a", newline="") as csvfile:
+                                csv.writer(csvfile, lineterminator=lineterminator, quoting=quoting).writerows(inserted)
+                        return
+
+                updated = {str(values[change_set.key_field]): values for values in change_set.updated}
+                deleted = set(str(key) for key in change_set.deleted)
+                with open(self.file_name, newline="") as input_file, self.rewrite() as csvfile:
+                        lines = RecordedLines(input_file)
+                        csv_reader = csv.reader(lines)
+                        csvwriter = csv.writer(csvfile, lineterminator=lineterminator, quoting=quoting)
+                        for i, row in enumerate(csv_reader):
+                                raw = lines.take()
+                                if (i > 0) and row:
+                                        key = row[key_position]
+                                        if key in deleted:
+                                                continue
+                                        if key in updated:
+                                                csvwriter.writerow(to_row(updated.pop(key), row))
+                                                continue
+                                if not raw.endswith("\n"):
+                                        raw += lineterminator
+                                csvfile.write(raw)
+                        if updated:
+                                raise Exception("Keys {} not found in {}.".format(", ".join(sorted(updated)), self.file_name))
+                        csvwriter.writerows(inserted)
         
         def name(self):
                 return self.file_name.split("/")[-1]
@@ -62,29 +204,132 @@ class CsvDataSource(data.DataSource):
         def get_source_str(self):
                 return self.file_name
 
-class ExcelDataSource(data.DataSource):
-        """Read-only data source for Excel files.
+class RecordedLines:
+        """Line iterator for csv.reader that keeps the raw text of the lines read since the last take(),
+        	so unchanged records (even ones spanning lines) can be copied exactly.
+        """
+        def __init__(self, lines):
+                self.lines = iter(lines)
+                self.record = []
+
+        def __iter__(self):
+                return self
+
+        def __next__(self):
+                line = next(self.lines)
+                self.record.append(line)
+                return line
+
+        def take(self):
+                raw = "".join(self.record)
+                self.record = []
+                return raw
+
+class AtomicRewrite:
+        """Context manager giving a text file that replaces file_name when the block completes, with an fsync
+        	before the rename. If the block raises, file_name is left untouched.
         """
         def __init__(self, file_name):
+                self.file_name = file_name
+                self.temp_file_name = file_name + ".tmp"
+
+        def __enter__(self):
+                self.handle = open(self.temp_file_name, "w", newline="")
+                return self.handle
+
+        def __exit__(self, exc_type, exc_value, traceback):
+                if exc_type is not None:
+                        self.handle.close()
+                        os.remove(self.temp_file_name)
+                        return False
+                self.handle.flush()
+                os.fsync(self.handle.fileno())
+                self.handle.close()
+                os.replace(self.temp_file_name, self.file_name)
+                fsync_directory(self.file_name)
+                return False
+
+class ExcelDataSource(data.DataSource):
+        """Read-only data source for Excel files. .xlsx files are streamed row by row from a read-only
+        	openpyxl workbook, and legacy .xls files are read a column at a time with xlrd.
+
+                sheet (int or str): index or name of the worksheet to read
+        """
+        supports_where = True
+
+        def __init__(self, file_name, sheet=0, hash_content=False):
                 super().__init__(True)
                 self.file_name = file_name
-        
-        def pull_data(self):
-                data_matrix = []
-                data_dict   = {}
-                excel_source = xlrd.open_workbook(self.file_name)
-                excel_sheet = excel_source.sheet_by_index(0)
-                
-                for i in range(0, excel_sheet.nrows):
-                        row = []
-                        for j in range(0, excel_sheet.ncols):
-                                row.append(excel_sheet.cell(i,j).value)
-                        data_matrix.append(row)
-                header = data_matrix[0]
-                data_matrix = data_matrix[1:]
-                for i, field_name in enumerate(header):
-                        data_dict[field_name] = [row[i] for row in data_matrix]
-                return data_dict
+                self.sheet = sheet
+                self.hash_content = hash_content
+
+        def fingerprint(self):
+                return file_fingerprint(self.file_name, self.hash_content)
+
+        def cache_path(self):
+                return "{}.{}.carta-cache".format(self.file_name, self.sheet)
+
+        def is_legacy(self):
+                return self.file_name.split(".")[-1].lower() == "xls"
+
+        def iter_sheet_rows(self):
+                """Yields the rows of an .xlsx sheet as tuples, starting with the header, keeping memory flat.
+                """
+                workbook = openpyxl.load_workbook(self.file_name, read_only=True, data_only=True)
+                try:
+                        if type(self.sheet) == str:
+                                excel_sheet = workbook[self.sheet]
+                        else:
+                                excel_sheet = workbook.worksheets[self.sheet]
+                        for row in excel_sheet.iter_rows(values_only=True):
+                                yield row
+                finally:
+                        workbook.close()
+
+        def open_legacy_sheet(self):
+                excel_source = xlrd.open_workbook(self.file_name, on_demand=True)
+                if type(self.sheet) == str:
+                        return excel_source.sheet_by_name(self.sheet)
+                return excel_source.sheet_by_index(self.sheet)
+
+        def header(self):
+                if self.is_legacy():
+                        return self.open_legacy_sheet().row_values(0)
+                for row in self.iter_sheet_rows():
+                        return list(row)
+                raise Exception("Invalid excel file: {} has no header.".format(self.file_name))
+
+        def pull_data(self, fields=None, where=None):
+                """Reads the values of fields (all fields if None) in bulk, rather than one cell at a time, for the
+                	rows matching where.
+                """
+                if self.is_legacy():
+                        excel_sheet = self.open_legacy_sheet()
+                        header = excel_sheet.row_values(0)
+                        positions = field_positions(header, fields, self.file_name)
+                        if where is None:
+                                return {header[j]: excel_sheet.col_values(j, start_rowx=1) for j in positions}
+                        read_positions = positions + [j for j in field_positions(header, list(where.fields()), self.file_name) if j not in positions]
+                        data_table = filters.filter_table({header[j]: excel_sheet.col_values(j, start_rowx=1) for j in read_positions}, where)
+                        return {header[j]: data_table[header[j]] for j in positions}
+
+                rows = self.iter_sheet_rows()
+                header = next(rows, None)
+                if header is None:
+                        raise Exception("Invalid excel file: {} has no header.".format(self.file_name))
+                positions = field_positions(list(header), fields, self.file_name)
+                predicate = None if where is None else filters.compile_for_header(where, list(header))
+                num_fields = len(header)
+                columns = [[] for j in positions]
+                appends = list(zip([column.append for column in columns], positions))
+                for row in rows:
+                        if len(row) < num_fields:
+                                row = tuple(row) + (None,)*(num_fields - len(row))
+                        if (predicate is not None) and not predicate(row):
+                                continue
+                        for append, j in appends:
+                                append(row[j])
+                return {header[j]: column for j, column in zip(positions, columns)}
         
         def push_data(self, data_dict):
                 raise Exception("Pushing data not supported with excel.")
@@ -95,36 +340,749 @@ class ExcelDataSource(data.DataSource):
         def get_source_str(self):
                 return self.file_name
         
-def save_data(data_sets, decks, output_file_location):
-        """Creates a JSON file describing all relevant objects.
+def connect_sqlite(file_name):
+        """Opens a local SQLite database in WAL mode.
+        """
+        connection = sqlite3.connect(file_name)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.create_function("REGEXP", 2, sqlite_regexp, deterministic=True)
+        return connection
+
+def sqlite_regexp(pattern, value):
+        """Backs SQLite's "value REGEXP pattern" operator, used by filters.Matches.
+        """
+        return (value is not None) and (re.search(pattern, str(value)) is not None)
+
+def quote_identifier(name):
+        return '"' + name.replace('"', '""') + '"'
+
+class SqliteDataSource(data.DataSource):
+        """Pulls/pushes data from a table in a SQLite database. Supports projection, so a lazy DataSet
+        	only reads the columns its decks use.
+        """
+        supports_where = True
+
+        def __init__(self, file_name, table_name, read_only=True):
+                super().__init__(read_only)
+                self.file_name = file_name
+                self.table_name = table_name
+
+        def fingerprint(self):
+                """Writes may sit in the write-ahead log rather than the database file, so both are included.
+                """
+                wal_file_name = self.file_name + "-wal"
+                wal_fingerprint = file_fingerprint(wal_file_name) if os.path.isfile(wal_file_name) else None
+                return (file_fingerprint(self.file_name), wal_fingerprint)
+
+        def header(self):
+                connection = connect_sqlite(self.file_name)
+                try:
+                        table_info = connection.execute("PRAGMA table_info({})".format(quote_identifier(self.table_name))).fetchall()
+                finally:
+                        connection.close()
+                if len(table_info) == 0:
+                        raise Exception("Table {} not found in {}.".format(self.table_name, self.file_name))
+                return [column[1] for column in table_info]
+
+        def pull_data(self, fields=None, where=None):
+                """Reads the columns fields (all columns if None), translating where to a WHERE clause.
+                """
+                if fields is None:
+                        fields = self.header()
+                if len(fields) == 0:
+                        return {}
+                where_sql, parameters = "", []
+                if where is not None:
+                        where_sql, parameters = where.to_sql(quote_identifier)
+                        where_sql = " WHERE " + where_sql
+                query = "SELECT {} FROM {}{} ORDER BY rowid".format(", ".join(quote_identifier(field) for field in fields),
+                                                                    quote_identifier(self.table_name), where_sql)
+                data_dict = {field_name: [] for field_name in fields}
+                columns = [data_dict[field_name] for field_name in fields]
+                connection = connect_sqlite(self.file_name)
+                try:
+                        for row in connection.execute(query, parameters):
+                                for column, val in zip(columns, row):
+                                        column.append(val)
+                finally:
+                        connection.close()
+                return data_dict
+
+        def push_data(self, data_dict):
+                assert (not self.read_only)
+                fields = list(data_dict.keys())
+                table = quote_identifier(self.table_name)
+                connection = connect_sqlite(self.file_name)
+                try:
+                        with connection:
+                                connection.execute("DROP TABLE IF EXISTS {}".format(table))
+                                connection.execute("CREATE TABLE {} ({})".format(table, ", ".join(quote_identifier(field) for field in fields)))
+                                connection.executemany("INSERT INTO {} VALUES ({})".format(table, ", ".join("?" for field in fields)),
+                                                       zip(*[data_dict[field] for field in fields]))
+                finally:
+                        connection.close()
+
+        def name(self):
+                return "{} ({})".format(self.file_name.split("/")[-1], self.table_name)
+
+        def get_source_str(self):
+                return "{}:{}".format(self.file_name, self.table_name)
+
+def parse_member(file_name):
+        """Runs in a worker process: pulls every field of one member file of a MultiFileDataSource.
+        """
+        return file_data_source(file_name).pull_data()
+
+class MultiFileDataSource(data.DataSource):
+        """Read-only data source concatenating many csv/excel files into one table, for data split across files.
+
+                Member files are parsed in parallel worker processes, and only files whose fingerprint changed are parsed
+                	again on refresh. The header is the union of the members' headers, in file order; fields a member lacks
+                	are left empty.
+
+                pattern (str): a directory (all its csv, xls and xlsx files) or a glob pattern, of which only the
+                	csv, xls and xlsx files are read
+                file_field (str): if set, an extra field holding each row's file name
+                workers (int): size of the process pool, defaulting to the number of CPUs
+                members (dictionary): [file name]: (fingerprint, data table) of the files parsed so far. Not saved.
+        """
+        parses_in_parallel = True
+        MEMBER_EXTENSIONS = ["csv", "xls", "xlsx"]
+
+        def __init__(self, pattern, file_field=None, workers=None):
+                super().__init__(True)
+                self.pattern = pattern
+                self.file_field = file_field
+                self.workers = workers
+                self.members = {}
+
+        def file_names(self):
+                if os.path.isdir(self.pattern):
+                        file_names = []
+                        for extension in self.MEMBER_EXTENSIONS:
+                                file_names += glob.glob(os.path.join(glob.escape(self.pattern), "*." + extension))
+                else:
+                        # a pattern may also match other files, such as the journal and history next to a save
+                        file_names = [file_name for file_name in glob.glob(self.pattern)
+                                      if file_name.split(".")[-1].lower() in self.MEMBER_EXTENSIONS]
+                return sorted(file_name for file_name in file_names if os.path.isfile(file_name))
+
+        def fingerprint(self):
+                return tuple((file_name, file_fingerprint(file_name)) for file_name in self.file_names())
+
+        def header(self):
+                headers = [file_data_source(file_name).header() for file_name in self.file_names()]
+                return self.unified_header(headers)
+
+        def unified_header(self, headers):
+                header = list(dict.fromkeys(field_name for member_header in headers for field_name in member_header))
+                if self.file_field is not None:
+                        header.append(self.file_field)
+                return header
+
+        def refresh_members(self):
+                """Parses the member files that are new or changed since the last pull, dropping removed ones.
+                	Returns the current members' (file name, data table) pairs, in file order.
+                """
+                fingerprints = dict(self.fingerprint())
+                self.members = {file_name: member for file_name, member in self.members.items() if file_name in fingerprints}
+                pending = [file_name for file_name, fingerprint in fingerprints.items()
+                           if self.members.get(file_name, (None,))[0] != fingerprint]
+
+                workers = self.workers or os.cpu_count() or 1
+                if (workers <= 1) or (len(pending) <= 1):
+                        tables = [parse_member(file_name) for file_name in pending]
+                else:
+                        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+                                tables = list(pool.map(parse_member, pending))
+                for file_name, data_table in zip(pending, tables):
+                        self.members[file_name] = (fingerprints[file_name], data_table)
+                return [(file_name, self.members[file_name][1]) for file_name in fingerprints]
+
+        def pull_data(self, fields=None):
+                members = self.refresh_members()
+                header = self.unified_header([list(data_table.keys()) for file_name, data_table in members])
+                if fields is None:
+                        fields = header
+                for field_name in fields:
+                        if field_name not in header:
+                                raise Exception("Field {} not found in {}.".format(field_name, self.pattern))
+
+                data_dict = {field_name: [] for field_name in fields}
+                for file_name, data_table in members:
+                        num_rows = len(next(iter(data_table.values()), []))
+                        for field_name, column in data_dict.items():
+                                if field_name == self.file_field:
+                                        column.extend([os.path.basename(file_name)]*num_rows)
+                                elif field_name in data_table:
+                                        column.extend(data_table[field_name])
+                                else:
+                                        column.extend([""]*num_rows)
+                return data_dict
+
+        def push_data(self, data_dict):
+                raise Exception("Pushing data not supported with multiple files.")
+
+        def name(self):
+                return os.path.basename(self.pattern.rstrip("/\\")) or self.pattern
+
+        def get_source_str(self):
+                return self.pattern
+
+        def __getstate__(self):
+                state = dict(self.__dict__)
+                state["members"] = {}
+                return state
+
+class ReviewJournal:
+        """ReviewJournal -
+                Append-only log of card state changes, kept next to a save_data checkpoint.
+
+                Each line is a JSON list: [deck id, front side, status, status timestamp], with the front side in the
+                	form of data.encode_cell, so fronts of any type can be journaled. Entries are flushed as they
+                	are written, so reviews survive a crash without rewriting the checkpoint.
+
+                num_entries (int): entries written since the last checkpoint
+                manifest: collection_manifest() of the collection at the last checkpoint
+                listener: if set, a function called with the number of entries after each append
+        """
+        def __init__(self, file_name):
+                self.file_name = file_name
+                self.handle = None
+                self.num_entries = 0
+                self.manifest = None
+                self.listener = None
+                self.lock = threading.Lock()
+
+        def append(self, deck, card):
+                self.append_many(deck, [card])
+
+        def append_many(self, deck, cards):
+                """Appends an entry for each card with a single write and flush.
+                """
+                lines = [json.dumps([deck.deck_id, data.encode_cell(card.front_side), int(card.status), card.status_dt.timestamp()]) + "\n"
+                         for card in cards]
+                with self.lock:
+                        if self.handle is None:
+                                self.handle = open(self.file_name, "a")
+                        self.handle.write("".join(lines))
+                        self.handle.flush()
+                        self.num_entries += len(lines)
+                if self.listener is not None:
+                        self.listener(len(lines))
+
+        def flush(self):
+                with self.lock:
+                        if self.handle is not None:
+                                self.handle.flush()
+                                os.fsync(self.handle.fileno())
+
+        def mark(self):
+                """Returns the journal's current size in bytes, for truncate() after a checkpoint taken from this point.
+                """
+                with self.lock:
+                        if self.handle is not None:
+                                self.handle.flush()
+                        return os.path.getsize(self.file_name) if os.path.isfile(self.file_name) else 0
+
+        def entries(self):
+                """Yields each entry in the journal. A partially written final line (from a crash) is ignored.
+                """
+                if not os.path.isfile(self.file_name):
+                        return
+                with open(self.file_name) as journal_file:
+                        for line in journal_file:
+                                if not line.endswith("\n"):
+                                        break
+                                deck_id, front_side, status, timestamp = json.loads(line)
+                                yield [deck_id, data.decode_cell(front_side), status, timestamp]
+
+        def truncate(self, offset=None):
+                """Drops the entries before offset (a mark()), or all of them. Entries appended since the mark are kept,
+                	as a checkpoint written concurrently with them may not include them.
+                """
+                with self.lock:
+                        if self.handle is not None:
+                                self.handle.close()
+                                self.handle = None
+                        tail = b""
+                        if (offset is not None) and os.path.isfile(self.file_name):
+                                with open(self.file_name, "rb") as journal_file:
+                                        journal_file.seek(offset)
+                                        tail = journal_file.read()
+                        temp_file_name = self.file_name + ".tmp"
+                        with open(temp_file_name, "wb") as journal_file:
+                                journal_file.write(tail)
+                                journal_file.flush()
+                                os.fsync(journal_file.fileno())
+                        os.replace(temp_file_name, self.file_name)
+                        self.num_entries = tail.count(b"\n")
+
+        def __getstate__(self):
+                return {"file_name": self.file_name}
+
+        def __setstate__(self, state):
+                self.__init__(state["file_name"])
+
+JOURNAL_COMPACT_ENTRIES = 10000
+
+_journals = {}
+
+def get_journal(file_location):
+        """Returns the ReviewJournal that accompanies the save file at file_location.
+        """
+        if file_location not in _journals:
+                _journals[file_location] = ReviewJournal(file_location + ".journal")
+        return _journals[file_location]
+
+_histories = {}
+
+def get_history(file_location):
+        """Returns the ReviewHistory that accompanies the save file at file_location.
+        """
+        if file_location not in _histories:
+                _histories[file_location] = review_history.ReviewHistory(file_location + ".history")
+        return _histories[file_location]
+
+def collection_manifest(data_sets, decks):
+        """Summarizes the structure of a collection (everything besides card states), to detect when a checkpoint is stale.
+        """
+        return (tuple((id(data_set), data_set.revision) for data_set in data_sets),
+                tuple((deck.deck_id, id(deck.parent), deck.num_cards()) for deck in decks))
+
+def snapshot_checkpoint(data_sets, decks):
+        """Pickles every relevant object to bytes, holding deck.review_lock so that reviews on other threads
+        	can't change the collection while it is pickled.
+        """
+        with deck.review_lock:
+                full_dict = {
+                        "data_sources": list(set([data_set.data_source for data_set in data_sets])),
+                        "data_set": data_sets,
+                        "decks": decks,
+                        "cards": [list(set([card for card in collection_deck.cards])) for collection_deck in decks],
+                        "review_schemes": list(set([collection_deck.review_scheme for collection_deck in decks]))
+                }
+                return dill.dumps(full_dict)
+
+def write_checkpoint(data_sets, decks, output_file_location):
+        """Writes every relevant object to output_file_location, replacing the file atomically.
+        	Only the snapshot holds up reviews; the file is written, synced and renamed afterwards.
+        """
+        snapshot = snapshot_checkpoint(data_sets, decks)
+        temp_file_location = output_file_location + ".tmp"
+        with open(temp_file_location, "wb") as output_file:
+                output_file.write(snapshot)
+                output_file.flush()
+                os.fsync(output_file.fileno())
+        os.replace(temp_file_location, output_file_location)
+        fsync_directory(output_file_location)
+
+def fsync_directory(file_location):
+        """Makes a rename of file_location durable, where the platform allows opening directories.
+        """
+        try:
+                directory = os.open(os.path.dirname(os.path.abspath(file_location)), os.O_RDONLY)
+        except OSError:
+                return
+        try:
+                os.fsync(directory)
+        except OSError:
+                pass
+        finally:
+                os.close(directory)
+
+@diagnostics.timed("save_data")
+def save_data(data_sets, decks, output_file_location, compact=False):
+        """Saves all relevant objects to output_file_location.
+
+                Reviews are appended to a ReviewJournal as they happen, so when nothing else changed a save only flushes
+                the journal. Each answer is also appended to the save's ReviewHistory, which checkpoints leave alone.
+                A full checkpoint is written, and the journal emptied, when there is no checkpoint yet, the
+                data sets or decks changed, the journal holds JOURNAL_COMPACT_ENTRIES entries, or compact is set.
+
+                Safe to call from a BackgroundSaver thread while reviews continue: reviews made during the checkpoint
+                stay in the journal, and replaying them over the checkpoint is harmless.
         """
-        data_sources = list(set([data_set.data_source for data_set in data_sets]))
-        cards = []
+        journal = get_journal(output_file_location)
+        history = get_history(output_file_location)
+        manifest = collection_manifest(data_sets, decks)
+        if ((not compact) and os.path.isfile(output_file_location) and (journal.manifest == manifest)
+                and (journal.num_entries < JOURNAL_COMPACT_ENTRIES)):
+                journal.flush()
+                history.flush()
+                return
+
         for deck in decks:
-        	cards.append(list(set([card for card in deck.cards])))
-        review_schemes = list(set([deck.review_scheme for deck in decks]))
-        
-        full_dict = {
-                "data_sources": data_sources,
-                "data_set": data_sets,
-                "decks": decks,
-                "cards": cards,
-                "review_schemes": review_schemes
-        }
+                deck.journal = journal
+                deck.history = history
+        offset = journal.mark()
+        write_checkpoint(data_sets, decks, output_file_location)
+        journal.truncate(offset)
+        journal.manifest = manifest
 
-        dill.dump(full_dict, open(output_file_location, "wb"))
+def replay_journal(journal, decks):
+        """Applies the journal's entries to the cards of decks, matched by deck id and front side.
+        	The decks should not have a journal attached while replaying.
+        """
+        decks_by_id = {deck.deck_id: deck for deck in decks}
+        journal.num_entries = 0
+        for deck_id, front_side, status, timestamp in journal.entries():
+                journal.num_entries += 1
+                deck = decks_by_id.get(deck_id)
+                card = None if deck is None else deck.get_card(front_side)
+                if card is None:
+                        continue
+                card.status = status
+                card.status_dt = datetime.datetime.fromtimestamp(timestamp)
+                deck.record_review(card)
+
+# attributes added to pickled classes since the first saves, with the value older objects behave as
+MIGRATED_DEFAULTS = {
+        data.DataSet: {"lazy": False, "where": None, "cache": False, "revision": 0, "fingerprint": None},
+        CsvDataSource: {"hash_content": False},
+        ExcelDataSource: {"sheet": 0, "hash_content": False}
+}
 
+def migrate_collection(c_data):
+        """Brings a collection unpickled from an older save up to date, in place: fills in attributes added since,
+        	and rebuilds the indices that decks now keep over their cards. Returns whether anything was migrated.
+        """
+        migrated = False
+        for obj in c_data["data_set"] + [data_set.data_source for data_set in c_data["data_set"]]:
+                for cls, defaults in MIGRATED_DEFAULTS.items():
+                        if isinstance(obj, cls):
+                                for name, value in defaults.items():
+                                        if not hasattr(obj, name):
+                                                setattr(obj, name, value)
+                                                migrated = True
+        for old_deck in c_data["decks"]:
+                if hasattr(old_deck, "due_queue"):
+                        continue
+                old_deck.deck_id = uuid.uuid4().hex
+                old_deck.journal = None
+                old_deck.history = None
+                old_deck.card_store = None
+                old_deck.card_index = {card.front_side: card for card in old_deck.cards}
+                old_deck.due_queue = deck.DueQueue(old_deck)
+                old_deck.distractor_pool = deck.DistractorPool()
+                old_deck.answer_index = answers.AnswerIndex()
+                # reconciling against the rebuilt card index keeps each card's status, and collects the alternates
+                old_deck.load_data_from_source()
+                old_deck.due_queue.rebuild(old_deck.cards)
+                old_deck.distractor_pool.rebuild(card.back_side for card in old_deck.cards)
+                migrated = True
+        return migrated
+
+@diagnostics.timed("load_from_file")
 def load_from_file(input_file_location):
-        """Recalls the JSON file from save_data() and creates objects from the existing data.
+        """Recalls the checkpoint from save_data(), replays the journal on top of it, and creates objects from the existing data.
+        """
+        with open(input_file_location, "rb") as input_file:
+                c_data = dill.load(input_file)
+        migrated = migrate_collection(c_data)
+
+        journal = get_journal(input_file_location)
+        for deck in c_data["decks"]:
+                deck.journal = None
+                deck.history = None
+        # data sets whose column cache was deleted since the save are reloaded from their sources
+        for data_set in c_data["data_set"]:
+                if column_cache.has_missing(data_set.data_table):
+                        data_set.update(force=True)
+        replay_journal(journal, c_data["decks"])
+        # a migrated collection is checkpointed on the next save, so the new deck ids are kept
+        journal.manifest = None if migrated else collection_manifest(c_data["data_set"], c_data["decks"])
+        history = get_history(input_file_location)
+        for deck in c_data["decks"]:
+                deck.journal = journal
+                deck.history = history
+        return c_data
+
+class BackgroundSaver:
+        """BackgroundSaver -
+                Runs save_data() on a background thread, so large collections don't block the caller. Reviews wait only
+                	while a checkpoint is pickled (see snapshot_checkpoint), not while it is written to disk.
+
+                Save requests are coalesced: requests made while a save is running result in one more save, and
+                	requests made before a save starts are merged into it. Autosaves happen after every_reviews
+                	journaled reviews, or every_seconds when anything changed.
+
+                last_error (Exception): the error of the last failed save, or None. Failed saves are retried on the next autosave.
+                saves (int): number of completed saves
+        """
+        def __init__(self, data_sets, decks, output_file_location, every_reviews=100, every_seconds=60):
+                self.data_sets = data_sets
+                self.decks = decks
+                self.output_file_location = output_file_location
+                self.every_reviews = every_reviews
+                self.every_seconds = every_seconds
+                self.condition = threading.Condition()
+                self.requested = None
+                self.saving = False
+                self.closed = False
+                self.reviews = 0
+                self.last_error = None
+                self.saves = 0
+                get_journal(output_file_location).listener = self.note_reviews
+                self.thread = threading.Thread(target=self.run, name="carta-saver", daemon=True)
+                self.thread.start()
+
+        def note_reviews(self, num_reviews):
+                """Called by the journal as reviews are appended.
+                """
+                with self.condition:
+                        self.reviews += num_reviews
+                        if (self.reviews >= self.every_reviews) and (self.requested is None):
+                                self.requested = False
+                                self.condition.notify_all()
+
+        def request(self, compact=False):
+                """Asks for a save, without waiting for it.
+                """
+                with self.condition:
+                        self.requested = compact or bool(self.requested)
+                        self.condition.notify_all()
+
+        def changed(self):
+                journal = get_journal(self.output_file_location)
+                return (self.reviews > 0) or (journal.manifest != collection_manifest(self.data_sets, self.decks))
+
+        def run(self):
+                while True:
+                        with self.condition:
+                                if (self.requested is None) and not self.closed:
+                                        self.condition.wait(self.every_seconds)
+                                if self.requested is None:
+                                        if self.closed:
+                                                return
+                                        if not self.changed():
+                                                continue
+                                        self.requested = False
+                                compact, self.requested = self.requested, None
+                                self.saving = True
+                                self.reviews = 0
+                        try:
+                                save_data(self.data_sets, self.decks, self.output_file_location, compact)
+                                self.last_error = None
+                                self.saves += 1
+                        except Exception as e:
+                                self.last_error = e
+                                with self.condition:
+                                        self.reviews = max(self.reviews, 1)
+                        finally:
+                                with self.condition:
+                                        self.saving = False
+                                        self.condition.notify_all()
+
+        def wait(self, timeout=None):
+                """Waits until no save is pending or running. Returns whether that happened within timeout.
+                """
+                with self.condition:
+                        return self.condition.wait_for(lambda: (self.requested is None) and not self.saving, timeout)
+
+        def close(self):
+                """Finishes any requested save, then stops the thread.
+                """
+                with self.condition:
+                        self.closed = True
+                        self.condition.notify_all()
+                self.thread.join()
+                get_journal(self.output_file_location).listener = None
+
+class SqliteStore:
+        """SqliteStore -
+                SQLite persistence backend, as an alternative to the dill file written by save_data.
+
+                Data sources, data set options, views, review schemes and filters are stored as dill blobs; card states
+                	live in an indexed cards table with a precomputed due_at, so due cards can be found with an index
+                	scan. Attached to each deck as its journal, so every review is written through as it happens.
         """
+        def __init__(self, file_name):
+                self.file_name = file_name
+                self.connection = connect_sqlite(file_name)
+                self.manifest = None
+                with self.connection:
+                        self.connection.execute("""CREATE TABLE IF NOT EXISTS data_sets (
+                                data_set_id INTEGER PRIMARY KEY, data_source BLOB, lazy INTEGER, options BLOB)""")
+                        self.connection.execute("""CREATE TABLE IF NOT EXISTS views (
+                                view_id INTEGER PRIMARY KEY, data_set_id INTEGER, parent_view_id INTEGER, fields BLOB,
+                                row_filter BLOB, row_indices BLOB)""")
+                        self.connection.execute("""CREATE TABLE IF NOT EXISTS decks (
+                                deck_id TEXT PRIMARY KEY, position INTEGER, data_set_id INTEGER, front_field TEXT,
+                                back_field TEXT, review_scheme BLOB, filter_fn BLOB, columnar INTEGER, view_id INTEGER)""")
+                        self.connection.execute("""CREATE TABLE IF NOT EXISTS cards (
+                                deck_id TEXT, front_side, back_side, status INTEGER, status_dt REAL, due_at REAL,
+                                PRIMARY KEY (deck_id, front_side))""")
+                        self.connection.execute("CREATE INDEX IF NOT EXISTS cards_due ON cards (deck_id, due_at)")
+                        self.add_columns("data_sets", {"options": "BLOB"})
+                        self.add_columns("decks", {"view_id": "INTEGER"})
+
+        def add_columns(self, table, columns):
+                """Adds the columns, [NAME]: type, that a database created by an earlier version lacks.
+                """
+                existing = set(row[1] for row in self.connection.execute("PRAGMA table_info({})".format(table)))
+                for name, column_type in columns.items():
+                        if name not in existing:
+                                self.connection.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, name, column_type))
+
+        def card_row(self, deck, card):
+                due_at = None
+                if card.status != deck.review_scheme.default_status:
+                        due_at = deck.review_scheme.due_time(card)
+                return (deck.deck_id, card.front_side, card.back_side, card.status, card.status_dt.timestamp(), due_at)
+
+        def append(self, deck, card):
+                """Writes a single card state through to the database.
+                """
+                with self.connection:
+                        self.connection.execute("INSERT OR REPLACE INTO cards VALUES (?, ?, ?, ?, ?, ?)", self.card_row(deck, card))
+
+        def append_many(self, deck, cards):
+                """Writes a batch of card states in a single transaction.
+                """
+                with self.connection:
+                        self.connection.executemany("INSERT OR REPLACE INTO cards VALUES (?, ?, ?, ?, ?, ?)",
+                                                    [self.card_row(deck, card) for card in cards])
+
+        def parent_ids(self, parent, stored_sets, views):
+                """Returns (data set id, view id or None) of a deck's parent, adding the parent to stored_sets or
+                	views (a list of view rows, parents first) if it isn't there yet.
+                """
+                if isinstance(parent, data.DataSetView):
+                        for view_id, row in enumerate(views):
+                                if row[0] is parent:
+                                        return row[1], view_id
+                        data_set_id, parent_view_id = self.parent_ids(parent.parent, stored_sets, views)
+                        views.append((parent, data_set_id, parent_view_id))
+                        return data_set_id, len(views) - 1
+                for data_set_id, data_set in enumerate(stored_sets):
+                        if data_set is parent:
+                                return data_set_id, None
+                # a data set only reachable through the collection's decks is stored along with them
+                stored_sets.append(parent)
+                return len(stored_sets) - 1, None
+
+        def save(self, data_sets, decks):
+                """Writes the collection. Card states are already written by append(), so unless the data sets or
+                	decks changed since the last save this is a no-op.
+
+                	Decks on a DataSetView are saved with the view, and the views it is built on.
+                """
+                manifest = collection_manifest(data_sets, decks)
+                if manifest == self.manifest:
+                        return
+                stored_sets = list(data_sets)
+                views = []
+                deck_parents = [self.parent_ids(deck.parent, stored_sets, views) for deck in decks]
+                with self.connection:
+                        self.connection.execute("DELETE FROM data_sets")
+                        self.connection.execute("DELETE FROM views")
+                        self.connection.execute("DELETE FROM decks")
+                        self.connection.execute("DELETE FROM cards")
+                        for i, data_set in enumerate(stored_sets):
+                                options = {"lazy": data_set.lazy, "where": data_set.where, "cache": data_set.cache}
+                                self.connection.execute("INSERT INTO data_sets VALUES (?, ?, ?, ?)",
+                                                        (i, dill.dumps(data_set.data_source), int(data_set.lazy), dill.dumps(options)))
+                        for view_id, (view, data_set_id, parent_view_id) in enumerate(views):
+                                # filtered views select their rows again when loaded
+                                row_indices = view.row_indices if view.row_filter is None else None
+                                self.connection.execute("INSERT INTO views VALUES (?, ?, ?, ?, ?, ?)",
+                                                        (view_id, data_set_id, parent_view_id, dill.dumps(view.fields),
+                                                         dill.dumps(view.row_filter), dill.dumps(row_indices)))
+                        for position, (deck, (data_set_id, view_id)) in enumerate(zip(decks, deck_parents)):
+                                self.connection.execute("INSERT INTO decks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                                        (deck.deck_id, position, data_set_id, deck.front_side,
+                                                         deck.back_side, dill.dumps(deck.review_scheme), dill.dumps(deck.filter_fn),
+                                                         int(deck.card_store is not None), view_id))
+                                self.connection.executemany("INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?)",
+                                                            (self.card_row(deck, card) for card in deck.cards))
+                self.manifest = manifest
+                for deck in decks:
+                        deck.journal = self
+
+        def load(self):
+                """Recreates the data sets and decks, pulling fresh data from each source and restoring card states.
+
+                        Returns a dictionary in the same format as load_from_file().
+                """
+                data_sets = []
+                for data_source, lazy, options in self.connection.execute(
+                                "SELECT data_source, lazy, options FROM data_sets ORDER BY data_set_id"):
+                        options = {"lazy": bool(lazy)} if options is None else dill.loads(options)
+                        data_sets.append(data.DataSet(dill.loads(data_source), **options))
+
+                views = []
+                for data_set_id, parent_view_id, fields, row_filter, row_indices in self.connection.execute(
+                                "SELECT data_set_id, parent_view_id, fields, row_filter, row_indices FROM views ORDER BY view_id"):
+                        parent = data_sets[data_set_id] if parent_view_id is None else views[parent_view_id]
+                        views.append(data.DataSetView(parent, dill.loads(fields), dill.loads(row_filter), dill.loads(row_indices)))
+
+                decks = []
+                deck_rows = self.connection.execute("""SELECT deck_id, data_set_id, front_field, back_field, review_scheme,
+                        filter_fn, columnar, view_id FROM decks ORDER BY position""").fetchall()
+                for deck_id, data_set_id, front_field, back_field, scheme, filter_fn, columnar, view_id in deck_rows:
+                        parent = data_sets[data_set_id] if view_id is None else views[view_id]
+                        new_deck = deck.Deck(parent, front_field, back_field, dill.loads(scheme),
+                                             dill.loads(filter_fn), columnar=bool(columnar))
+                        new_deck.deck_id = deck_id
+                        card_rows = self.connection.execute("SELECT front_side, status, status_dt FROM cards WHERE deck_id = ?", (deck_id,))
+                        for front_side, status, status_dt in card_rows:
+                                card = new_deck.get_card(front_side)
+                                if card is not None:
+                                        card.status = status
+                                        card.status_dt = datetime.datetime.fromtimestamp(status_dt)
+                        if new_deck.due_queue is not None:
+                                new_deck.due_queue.rebuild(new_deck.cards)
+                        decks.append(new_deck)
+
+                self.manifest = collection_manifest(data_sets, decks)
+                for loaded_deck in decks:
+                        loaded_deck.journal = self
+                return {
+                        "data_sources": [data_set.data_source for data_set in data_sets],
+                        "data_set": data_sets,
+                        "decks": decks,
+                        "review_schemes": list(set([loaded_deck.review_scheme for loaded_deck in decks]))
+                }
+
+        def due_cards(self, deck, now=None):
+                """Returns the front sides of the deck's cards that are due at time now, in due order, using the due_at index.
+                """
+                if now is None:
+                        now = datetime.datetime.now().timestamp()
+                rows = self.connection.execute("SELECT front_side FROM cards WHERE deck_id = ? AND due_at <= ? ORDER BY due_at",
+                                               (deck.deck_id, now))
+                return [row[0] for row in rows]
+
+        def due_count(self, deck, now=None):
+                """Returns the number of the deck's cards that are due at time now, counted on the due_at index.
+                """
+                if now is None:
+                        now = datetime.datetime.now().timestamp()
+                return self.connection.execute("SELECT COUNT(*) FROM cards WHERE deck_id = ? AND due_at <= ?",
+                                               (deck.deck_id, now)).fetchone()[0]
+
+        def close(self):
+                self.connection.close()
 
-        return dill.load(open(input_file_location, "rb"))
+def create_data_source(file_location, table_name=None):
+    """Returns the data source for a file, a directory, or a glob pattern. An existing file is always read on its own,
+    	even if its name contains glob characters, such as vocab[1].csv.
+    """
+    if (not os.path.isfile(file_location)) and (os.path.isdir(file_location) or any(character in file_location for character in "*?[")):
+        return MultiFileDataSource(file_location)
+    return file_data_source(file_location, table_name)
 
-def create_data_source(file_location):
+def file_data_source(file_location, table_name=None):
+    """Returns the data source for a single file, by its extension.
+    """
     extention = file_location.split(".")[-1]
     if (extention == "csv"):
         return CsvDataSource(file_location)
-    elif (extention == "xlsx"):
+    elif (extention in ["xls", "xlsx"]):
         return ExcelDataSource(file_location)
+    elif (extention in ["db", "sqlite", "sqlite3"]):
+        return SqliteDataSource(file_location, table_name)
     else:
         raise Exception("Invalid extention {}".format(extention))
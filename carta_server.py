@@ -0,0 +1,215 @@
+# local multi-user review server for carta
+#
+# usage: python carta_server.py --collection carta_data.p [--port 8765 | --socket /tmp/carta.sock] [--state-dir carta_users]
+#        python carta_server.py --csv words.csv --front word --back translation
+#
+# Serves JSON over HTTP/1.1 (with keep-alive), on TCP or a Unix socket:
+#     GET  /decks                                   -> {"decks": [{"deck_id", "name"}]}
+#     GET  /review?user=U&deck=D[&limit=N&options=K] -> {"items": [{"key", "front_side", "options"}]}
+#     POST /answer  {"user", "deck", "key", "response"}              -> {"correct", "back_side"}
+#     POST /answers {"user", "deck", "results": [[key, success, timestamp], ...]} -> {"applied", "unknown"}
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import re
+import urllib.parse
+
+import carta_local
+import data
+import deck
+import review_history
+import review_scheme
+import review_session
+
+USER_ID_PATTERN = re.compile(r"[A-Za-z0-9_.-]+")
+MAX_BODY_SIZE = 1 << 20
+
+class RequestError(Exception):
+	def __init__(self, status, message):
+		super().__init__(message)
+		self.status = status
+
+class UserState:
+	"""UserState -
+		One user's decks, created on demand from the server's template decks over the shared DataSets.
+
+		decks (dictionary): [template deck id]: the user's Deck
+		lock (asyncio.Lock): serializes the user's writes
+		journal (ReviewJournal): the user's reviews, replayed when the server restarts (None if not persisted)
+		history (ReviewHistory): every answered review of the user, for statistics (None if not persisted)
+	"""
+	def __init__(self, journal, history=None):
+		self.decks   = {}
+		self.lock    = asyncio.Lock()
+		self.journal = journal
+		self.history = history
+
+class CartaServer:
+	"""CartaServer -
+		Serves reviews for many users from a single process. DataSets are loaded once and shared; each
+			user gets their own card state.
+
+		templates (dictionary): [deck id]: Deck whose data set, sides and review scheme user decks copy
+		users (dictionary): [user id]: UserState
+		state_dir (str): directory for per-user review journals and histories, or None to keep state in memory only
+	"""
+	def __init__(self, template_decks, state_dir=None):
+		self.templates = {template.deck_id: template for template in template_decks}
+		self.users     = {}
+		self.state_dir = state_dir
+		if state_dir is not None:
+			os.makedirs(state_dir, exist_ok=True)
+
+	def get_user(self, user_id):
+		if not USER_ID_PATTERN.fullmatch(user_id or ""):
+			raise RequestError(400, "Invalid user id.")
+		if user_id not in self.users:
+			journal = history = None
+			if self.state_dir is not None:
+				journal = carta_local.ReviewJournal(os.path.join(self.state_dir, user_id + ".journal"))
+				history = review_history.ReviewHistory(os.path.join(self.state_dir, user_id + ".history"))
+			self.users[user_id] = UserState(journal, history)
+		return self.users[user_id]
+
+	def get_deck(self, user, deck_id):
+		"""Returns the user's copy of a template deck, replaying their journal when it is first created.
+		"""
+		if deck_id not in user.decks:
+			template = self.templates.get(deck_id)
+			if template is None:
+				raise RequestError(404, "Deck {} not found.".format(deck_id))
+			user_deck = deck.Deck(template.parent, template.front_side, template.back_side,
+			                      copy.copy(template.review_scheme), template.filter_fn,
+			                      columnar=(template.card_store is not None))
+			user_deck.deck_id = deck_id
+			if user.journal is not None:
+				carta_local.replay_journal(user.journal, [user_deck])
+				user_deck.journal = user.journal
+			user_deck.history = user.history
+			user.decks[deck_id] = user_deck
+		return user.decks[deck_id]
+
+	def list_decks(self):
+		return {"decks": [{"deck_id": deck_id, "name": template.name()} for deck_id, template in self.templates.items()]}
+
+	def review(self, params):
+		user_deck = self.get_deck(self.get_user(params.get("user")), params.get("deck"))
+		limit = int(params["limit"]) if "limit" in params else None
+		with review_session.ReviewSession(user_deck, limit, num_options=int(params.get("options", 0))) as session:
+			items = list(session)
+		return {"items": [{"key": item.key, "front_side": item.front_side, "options": item.options} for item in items]}
+
+	async def answer(self, body):
+		user = self.get_user(body.get("user"))
+		async with user.lock:
+			user_deck = self.get_deck(user, body.get("deck"))
+			card = user_deck.get_card(body.get("key"))
+			if card is None:
+				raise RequestError(404, "Card {} not found.".format(body.get("key")))
+			correct = user_deck.check_answer(card, str(body.get("response", "")))
+			card.update_card(correct)
+		return {"correct": correct, "back_side": card.back_side}
+
+	async def answers(self, body):
+		user = self.get_user(body.get("user"))
+		async with user.lock:
+			user_deck = self.get_deck(user, body.get("deck"))
+			return review_session.apply_results(user_deck, body.get("results", []))
+
+	async def dispatch(self, method, target, body):
+		url = urllib.parse.urlsplit(target)
+		params = dict(urllib.parse.parse_qsl(url.query))
+		if (method, url.path) == ("GET", "/decks"):
+			return self.list_decks()
+		elif (method, url.path) == ("GET", "/review"):
+			return self.review(params)
+		elif (method, url.path) == ("POST", "/answer"):
+			return await self.answer(body)
+		elif (method, url.path) == ("POST", "/answers"):
+			return await self.answers(body)
+		raise RequestError(404, "No route for {} {}.".format(method, url.path))
+
+	async def handle_connection(self, reader, writer):
+		"""Serves HTTP/1.1 requests on one connection until the client closes it.
+		"""
+		try:
+			while True:
+				request_line = await reader.readline()
+				if not request_line:
+					break
+				method, target, version = request_line.decode("latin-1").split()
+				headers = {}
+				while True:
+					line = await reader.readline()
+					if line in (b"\r\n", b"\n", b""):
+						break
+					name, value = line.decode("latin-1").split(":", 1)
+					headers[name.strip().lower()] = value.strip()
+
+				status, response = 200, None
+				try:
+					body = {}
+					length = int(headers.get("content-length", 0))
+					if length > MAX_BODY_SIZE:
+						raise RequestError(413, "Request body too large.")
+					if length > 0:
+						body = json.loads(await reader.readexactly(length))
+					response = await self.dispatch(method, target, body)
+				except RequestError as e:
+					status, response = e.status, {"error": str(e)}
+				except (ValueError, KeyError, TypeError) as e:
+					status, response = 400, {"error": str(e)}
+
+				payload = json.dumps(response).encode()
+				keep_alive = headers.get("connection", "").lower() != "close"
+				writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+					status, "OK" if status == 200 else "Error", len(payload), "keep-alive" if keep_alive else "close").encode() + payload)
+				await writer.drain()
+				if not keep_alive:
+					break
+		except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+			pass
+		finally:
+			writer.close()
+
+async def serve(server, host, port, socket_path):
+	if socket_path is not None:
+		listener = await asyncio.start_unix_server(server.handle_connection, path=socket_path)
+		print ("Serving on {}".format(socket_path), flush=True)
+	else:
+		listener = await asyncio.start_server(server.handle_connection, host, port)
+		print ("Serving on http://{}:{}".format(host, port), flush=True)
+	async with listener:
+		await listener.serve_forever()
+
+def load_templates(args):
+	if args.collection is not None:
+		return carta_local.load_from_file(args.collection)["decks"]
+	data_set = data.DataSet(carta_local.CsvDataSource(args.csv))
+	return [deck.Deck(data_set, args.front, args.back, review_scheme.LeitnerReviewScheme())]
+
+def main():
+	parser = argparse.ArgumentParser(description="Serve carta reviews to many users.")
+	parser.add_argument("--collection", help="save file from carta_cli to take the decks from")
+	parser.add_argument("--csv", help="serve a single Leitner deck over this csv file instead")
+	parser.add_argument("--front")
+	parser.add_argument("--back")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8765)
+	parser.add_argument("--socket", help="listen on this Unix socket instead of TCP")
+	parser.add_argument("--state-dir", help="directory for per-user review journals and histories")
+	args = parser.parse_args()
+	if (args.collection is None) == (args.csv is None):
+		parser.error("exactly one of --collection and --csv is required")
+
+	server = CartaServer(load_templates(args), args.state_dir)
+	try:
+		asyncio.run(serve(server, args.host, args.port, args.socket))
+	except KeyboardInterrupt:
+		pass
+
+if __name__=="__main__":
+	main()
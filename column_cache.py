@@ -0,0 +1,177 @@
+import itertools
+import json
+import mmap
+import os
+import pickle
+import uuid
+
+# Sidecar cache of a DataSource's columns, so a DataSet can reopen them without parsing the source.
+#
+# A cache directory holds manifest.json and one set of files per column. String columns are an offsets file
+#     (n+1 native int64s) and a blob of the utf-8 values, both memory-mapped on load; other columns are pickled.
+# The manifest records the source fingerprint, and is replaced atomically after the column files are written,
+#     so a cache is either complete and current or ignored. The directory can be deleted at any time.
+
+MANIFEST_FILE = "manifest.json"
+VERSION = 1
+
+def fingerprint_key(fingerprint):
+	return json.dumps(fingerprint)
+
+def map_file(file_name):
+	with open(file_name, "rb") as input_file:
+		if os.fstat(input_file.fileno()).st_size == 0:
+			return b""
+		return mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+class MappedColumn:
+	"""MappedColumn -
+		Read-only sequence of strings over a memory-mapped column, decoding values as they are accessed.
+			Pickles as a reference to its files rather than its values.
+	"""
+	def __init__(self, directory, stem, length):
+		self.directory = directory
+		self.stem      = stem
+		self.length    = length
+		self.blob      = map_file(os.path.join(directory, stem + ".blob"))
+		self.offsets   = memoryview(map_file(os.path.join(directory, stem + ".offsets"))).cast("q")
+		if len(self.offsets) != length + 1:
+			raise OSError("Truncated column cache {}.".format(os.path.join(directory, stem)))
+
+	def __len__(self):
+		return self.length
+
+	def __getitem__(self, key):
+		if type(key) == slice:
+			return [self[i] for i in range(*key.indices(self.length))]
+		if key < 0:
+			key += self.length
+		if not (0 <= key < self.length):
+			raise IndexError("column index out of range")
+		return self.blob[self.offsets[key]:self.offsets[key + 1]].decode("utf-8")
+
+	def __iter__(self):
+		blob, offsets = self.blob, self.offsets
+		for i in range(self.length):
+			yield blob[offsets[i]:offsets[i + 1]].decode("utf-8")
+
+	def __reduce__(self):
+		return (reopen, (self.directory, self.stem, self.length))
+
+class MissingColumn:
+	"""MissingColumn -
+		Stands in for a MappedColumn whose cache was deleted, in an unpickled DataSet. Every value is None,
+			and the DataSet should be reloaded from its source (see has_missing).
+	"""
+	def __init__(self, length):
+		self.length = length
+
+	def __len__(self):
+		return self.length
+
+	def __getitem__(self, key):
+		if type(key) == slice:
+			return [None]*len(range(*key.indices(self.length)))
+		return None
+
+	def __iter__(self):
+		return itertools.repeat(None, self.length)
+
+def reopen(directory, stem, length):
+	try:
+		return MappedColumn(directory, stem, length)
+	except (OSError, ValueError):
+		return MissingColumn(length)
+
+def has_missing(data_table):
+	return any(isinstance(column, MissingColumn) for column in data_table.values())
+
+def read_manifest(directory):
+	try:
+		with open(os.path.join(directory, MANIFEST_FILE)) as manifest_file:
+			manifest = json.load(manifest_file)
+	except (OSError, ValueError):
+		return None
+	if manifest.get("version") != VERSION:
+		return None
+	return manifest
+
+def load(directory, fingerprint, fields=None):
+	"""Returns the cached data table for fields (all the source's fields if None), or None if the cache is
+		missing, incomplete or for a different fingerprint.
+	"""
+	manifest = read_manifest(directory)
+	if (manifest is None) or (manifest["fingerprint"] != fingerprint_key(fingerprint)):
+		return None
+	columns = {field_name: (kind, stem) for field_name, kind, stem in manifest["columns"]}
+	if fields is None:
+		if not manifest["complete"]:
+			return None
+		fields = [field_name for field_name, kind, stem in manifest["columns"]]
+	if any(field_name not in columns for field_name in fields):
+		return None
+
+	data_table = {}
+	try:
+		for field_name in fields:
+			kind, stem = columns[field_name]
+			if kind == "str":
+				data_table[field_name] = MappedColumn(directory, stem, manifest["rows"])
+			else:
+				with open(os.path.join(directory, stem + ".pickle"), "rb") as column_file:
+					data_table[field_name] = pickle.load(column_file)
+	except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+		return None
+	return data_table
+
+def write_column(directory, stem, values):
+	"""Writes a column, returning its kind: "str" for a mappable column of strings, "pickle" otherwise.
+	"""
+	if all(type(value) == str for value in values):
+		encoded = [value.encode("utf-8") for value in values]
+		offsets = memoryview(bytearray(8*(len(encoded) + 1))).cast("q")
+		for i, offset in enumerate(itertools.accumulate(map(len, encoded), initial=0)):
+			offsets[i] = offset
+		with open(os.path.join(directory, stem + ".offsets"), "wb") as offsets_file:
+			offsets_file.write(offsets)
+		with open(os.path.join(directory, stem + ".blob"), "wb") as blob_file:
+			blob_file.write(b"".join(encoded))
+		return "str"
+	with open(os.path.join(directory, stem + ".pickle"), "wb") as column_file:
+		pickle.dump(list(values), column_file, protocol=pickle.HIGHEST_PROTOCOL)
+	return "pickle"
+
+def store(directory, fingerprint, data_table, complete=True):
+	"""Writes data_table to the cache for fingerprint. complete says whether it holds all of the source's fields.
+		Columns already cached for the same fingerprint are kept, so a lazy DataSet's cache grows field by field.
+	"""
+	os.makedirs(directory, exist_ok=True)
+	key = fingerprint_key(fingerprint)
+	previous = read_manifest(directory)
+	columns = []
+	if (previous is not None) and (previous["fingerprint"] == key):
+		columns = [column for column in previous["columns"] if column[0] not in data_table]
+		complete = complete or previous["complete"]
+
+	token = uuid.uuid4().hex[:12]
+	for i, (field_name, values) in enumerate(data_table.items()):
+		stem = "{}.{}".format(token, i)
+		columns.append([field_name, write_column(directory, stem, values), stem])
+
+	rows = len(next(iter(data_table.values()), []))
+	manifest = {"version": VERSION, "fingerprint": key, "complete": complete, "rows": rows, "columns": columns}
+	temp_file_name = os.path.join(directory, MANIFEST_FILE + ".tmp")
+	with open(temp_file_name, "w") as manifest_file:
+		json.dump(manifest, manifest_file)
+		manifest_file.flush()
+		os.fsync(manifest_file.fileno())
+	os.replace(temp_file_name, os.path.join(directory, MANIFEST_FILE))
+
+	# files of replaced caches stay readable through existing maps until they are closed
+	stems = {stem for field_name, kind, stem in columns}
+	for file_name in os.listdir(directory):
+		if (file_name != MANIFEST_FILE) and (file_name.rsplit(".", 1)[0] not in stems):
+			try:
+				os.remove(os.path.join(directory, file_name))
+			except OSError:
+				pass
@@ -1,29 +1,143 @@
+import base64
 import csv
+import pickle
 import random
 import json
 import os
 import datetime
 import re
+import threading
+
+import column_cache
+import diagnostics
+import filters
+
+# held while the collection changes: data installs, deck reconciliation and card states, so a checkpoint can
+#     snapshot the collection from another thread
+review_lock = threading.RLock()
+
+# types of cell values, such as the dates of an Excel column, that encode_cell tags by their ISO format
+CELL_TYPES = {"datetime": datetime.datetime, "date": datetime.date, "time": datetime.time}
+
+def encode_cell(value):
+        """Returns a JSON serializable form of a cell value, which decode_cell turns back into an equal value.
+        	Strings, numbers, booleans and None are kept as they are; other values become a one-key object tagging their type.
+        """
+        if (value is None) or isinstance(value, (str, int, float)):
+                return value
+        for tag, cell_type in CELL_TYPES.items():
+                if type(value) is cell_type:
+                        return {tag: value.isoformat()}
+        return {"pickle": base64.b64encode(pickle.dumps(value)).decode("ascii")}
+
+def decode_cell(encoded):
+        if not isinstance(encoded, dict):
+                return encoded
+        (tag, value), = encoded.items()
+        if tag == "pickle":
+                return pickle.loads(base64.b64decode(value))
+        return CELL_TYPES[tag].fromisoformat(value)
 
 class DataSource:
         """DataSource -
                 Generic prototype for a data source. Allows for pushing and pulling data.
+
+                supports_where (bool): whether pull_data accepts a where filters.Expression, skipping
+                	non-matching rows itself
+                parses_in_parallel (bool): whether pull_data runs its own worker processes, in which case
+                	refresh.refresh_all pulls it in this process
         """
+        supports_where = False
+        parses_in_parallel = False
+
         def __init__(self, read_only=True):
                 self.read_only = read_only
 
-        def pull_data(self):
+        def pull_data(self, fields=None, where=None):
+                """Returns a dictionary [FIELD NAME]: [list of values]. Sources that support projection
+                	only read the given fields (all fields if None).
+                """
                 pass
 
         def push_data(self):
                 pass
 
+        def header(self):
+                """Returns the field names without pulling any data, for sources that support projection.
+                """
+                pass
+
+        def fingerprint(self):
+                """Returns a cheap value that changes whenever the underlying data changes, or None if the
+                	source can't tell (in which case it is always pulled).
+                """
+                return None
+
+        def cache_path(self):
+                """Returns the directory for a sidecar column cache (see column_cache), or None if the source can't be cached.
+                """
+                return None
+
         def name(self):
                 pass
 
         def get_source_str(self):
                 pass
 
+class ChangeSet:
+        """ChangeSet -
+                Rows to change in a writable DataSource, identified by the value of key_field, for pushing a delta
+                	instead of the whole data set.
+
+                inserted (list): new rows, as dictionaries [FIELD NAME]: value. Missing fields are left empty.
+                updated (list): rows as dictionaries holding key_field and the fields to change
+                deleted (list): key values of the rows to delete
+        """
+        def __init__(self, key_field, inserted=None, updated=None, deleted=None):
+                self.key_field = key_field
+                self.inserted = inserted or []
+                self.updated = updated or []
+                self.deleted = deleted or []
+
+        def __len__(self):
+                return len(self.inserted) + len(self.updated) + len(self.deleted)
+
+@diagnostics.timed("DataSource.pull_data")
+def pull_from_source(data_source, fields=None, where=None):
+        """Pulls fields (all fields if None) from data_source, keeping only the rows matching where (a filters.Expression).
+        	The filter is pushed down to sources that support it, and applied after the pull otherwise.
+        """
+        if where is not None:
+                if data_source.supports_where:
+                        return data_source.pull_data(fields, where)
+                pull_fields = None if fields is None else list(dict.fromkeys(list(fields) + list(where.fields())))
+                data_table = data_source.pull_data() if pull_fields is None else data_source.pull_data(pull_fields)
+                data_table = filters.filter_table(data_table, where)
+                if fields is not None:
+                        data_table = {field_name: data_table[field_name] for field_name in fields}
+                return data_table
+        if fields is None:
+                return data_source.pull_data()
+        return data_source.pull_data(fields)
+
+def pull_cached(data_source, fields=None, where=None, fingerprint=None, cache=False):
+        """pull_from_source, going through the source's column cache when cache is set. The cache is keyed by
+        	fingerprint, so it is bypassed for sources without one, and for filtered pulls.
+        """
+        cache_path = data_source.cache_path() if cache else None
+        if (cache_path is None) or (fingerprint is None) or (where is not None):
+                return pull_from_source(data_source, fields, where)
+        data_table = column_cache.load(cache_path, fingerprint, fields)
+        if data_table is None:
+                data_table = pull_from_source(data_source, fields)
+                try:
+                        column_cache.store(cache_path, fingerprint, data_table, complete=(fields is None))
+                except OSError:
+                        return data_table
+                # switch to the mapped columns, so saves refer to the cache rather than copying the values
+                data_table = column_cache.load(cache_path, fingerprint, list(data_table.keys())) or data_table
+        return data_table
+
 class DataSet:
         """DataSet -
                 Manages a data set, including pulling/pushing from a DataSource object.
@@ -33,11 +147,23 @@ class DataSet:
                 data_source (DataSource): DataSource object to communicate with the actual storage of the data
                 data_table (dictionary): dictionary for caching the underlying data. [FIELD NAME]: [list of values]
                 children (list): decks tied to DataSet
+                revision (int): incremented each time data_table is reloaded
+                fingerprint: the DataSource fingerprint when data_table was last loaded
+                lazy (bool): only pull fields as they are accessed, and only refresh those fields. Requires a
+                	DataSource that supports projection.
+                where (filters.Expression): only keep matching rows, filtering in the DataSource where possible
+                cache (bool): keep the pulled columns in a memory-mapped sidecar cache, reused while the source's
+                	fingerprint is unchanged
         """
-        def __init__(self, data_source = None):
+        def __init__(self, data_source = None, lazy=False, where=None, cache=False):
                 self.data_source = data_source
+                self.lazy = lazy
+                self.where = where
+                self.cache = cache
                 self.data_table = {}
                 self.children = []
+                self.revision = 0
+                self.fingerprint = None
                 
                 self.update()
 
@@ -45,39 +171,248 @@ class DataSet:
                 """Adds an object (with an update() method), usually a Deck, 
                 		that depends on this object
                 """
-                self.children.append(child)
+                with review_lock:
+                        self.children.append(child)
 
-        def load_data_from_source(self):
-                self.data_table = self.data_source.pull_data()
-                for child in self.children:
-                        child.update()
+        def load_data_from_source(self, force=False):
+                """Pulls the data and updates the children, unless the source's fingerprint shows it is unchanged.
+
+                        Returns whether the data was reloaded.
+                """
+                if self.data_source is None:
+                        return False
+                fingerprint = self.data_source.fingerprint()
+                if not self.needs_pull(fingerprint, force):
+                        return False
+                self.set_data(pull_cached(self.data_source, self.pull_fields(), self.where, fingerprint, self.cache), fingerprint)
+                return True
+
+        def needs_pull(self, fingerprint, force=False):
+                return force or (fingerprint is None) or (fingerprint != self.fingerprint)
+
+        def pull_fields(self):
+                """The fields to pull on reload: None for all of them, or the fields already loaded for a lazy DataSet.
+                """
+                if self.lazy:
+                        return list(self.data_table.keys())
+                return None
+
+        def set_data(self, data_table, fingerprint=None):
+                """Installs freshly pulled data and updates the children. Returns the children's update() results.
+                """
+                with review_lock:
+                        self.data_table = data_table
+                        self.revision += 1
+                        self.fingerprint = fingerprint
+                        return [child.update() for child in self.children]
 
-        def update(self):
+        @diagnostics.timed("DataSet.update")
+        def update(self, force=False):
                 """Either update the data from the DataSource, or update the DataSource from the data based on the depends_on_deck member.
+
+                        force (bool): reload even if the DataSource is unchanged
                 """
-                self.load_data_from_source()
+                return self.load_data_from_source(force)
 
         def get_data(self):
                 return self.data_table
 
         def project(self, fields):
-                """Returns a new DataSet with a subset of fields.
+                """Returns a view with a subset of fields, sharing this DataSet's columns.
                 """
-                new_data_set = DataSet()
-                new_data_table = {}
-                for field in fields:
-                        new_data_table[field] = self.data_table[field]
-                new_data_set.data_table = new_data_table
-                return new_data_set
+                return DataSetView(self, fields=fields)
+
+        def filter(self, row_filter):
+                """Returns a view of the rows for which row_filter(row) is true, where row is a dictionary [FIELD NAME]: value.
+                	The filter is re-applied whenever this DataSet updates.
+                """
+                return DataSetView(self, row_filter=row_filter)
+
+        def mask(self, row_mask):
+                """Returns a view of the rows whose entry in row_mask (a list of booleans) is true.
+                """
+                return DataSetView(self, row_indices=[i for i, keep in enumerate(row_mask) if keep])
 
         def  __getitem__(self, key):
                 if type(key) == str:
+                        if self.lazy and (key not in self.data_table):
+                                self.data_table.update(pull_cached(self.data_source, [key], self.where, self.fingerprint, self.cache))
                         return self.data_table[key]
                 else:
-                        return [ self.data_table[field_name][key] for field_name in self.data_table ]
+                        return [ column[key] for column in self.data_table.values() ]
+
+        def __len__(self):
+                for column in self.data_table.values():
+                        return len(column)
+                return 0
+
+        def rows(self, fields=None):
+                """Iterates over the rows as tuples of the values of fields (default: the header), without building each row by index.
+                """
+                if fields is None:
+                        fields = self.header()
+                return zip(*[self[field_name] for field_name in fields])
 
         def header(self):
+                if self.lazy:
+                        return self.data_source.header()
                 return [key for key in self.data_table.keys()]
 
         def name(self):
                 return self.data_source.name()
+
+class ColumnView:
+        """ColumnView -
+                Read-only sequence over selected rows of a column, without copying the column.
+        """
+        def __init__(self, column, rows):
+                self.column = column
+                self.rows = rows
+
+        def __len__(self):
+                return len(self.rows)
+
+        def __getitem__(self, key):
+                if type(key) == slice:
+                        return ColumnView(self.column, self.rows[key])
+                return self.column[self.rows[key]]
+
+        def __iter__(self):
+                return map(self.column.__getitem__, self.rows)
+
+        def __eq__(self, other):
+                return list(self) == list(other)
+
+        def materialize(self):
+                return list(self)
+
+class DataSetView:
+        """DataSetView -
+                Lazy view over a DataSet (or another view): a subset of its fields and/or rows.
+
+                The view shares the parent's column storage and only copies data in materialize(). A view registers as
+                	a child of its parent only once something (a Deck or another view) is added to it, so throwaway
+                	projections aren't kept alive, re-filtered on every refresh and pickled by the parent. An unregistered
+                	view catches up with its parent's revision when it is next read. detach() unregisters a view.
+
+                parent (DataSet or DataSetView): the data being viewed
+                fields (list): visible fields, or None for all of the parent's fields
+                row_filter (function): row dictionary -> bool, re-applied on each update, or None
+                row_indices (list): indices of the visible rows in the parent, or None for every row. Rows given as a mask
+                	are kept across updates, minus any that no longer exist.
+                children (list): decks tied to the view
+                attached (bool): whether the view is registered as a child of its parent
+        """
+        def __init__(self, parent, fields=None, row_filter=None, row_indices=None):
+                self.parent = parent
+                self.fields = fields
+                self.row_filter = row_filter
+                self.row_indices = row_indices
+                self.children = []
+                self.attached = False
+                self.view_revision = 0
+                self.parent_revision = parent.revision
+                if row_filter is not None:
+                        self.apply_filter()
+
+        def apply_filter(self):
+                header = self.parent.header()
+                self.row_indices = [i for i, row in enumerate(self.parent.rows(header)) if self.row_filter(dict(zip(header, row)))]
+
+        def add_child(self, child):
+                with review_lock:
+                        if not self.attached:
+                                self.sync()
+                                self.parent.add_child(self)
+                                self.attached = True
+                        self.children.append(child)
+
+        def detach(self):
+                """Stops following the parent's updates eagerly. The view still catches up when it is read.
+                """
+                with review_lock:
+                        if self.attached:
+                                self.parent.children.remove(self)
+                                self.attached = False
+
+        @property
+        def revision(self):
+                self.sync()
+                return self.view_revision
+
+        def sync(self):
+                """Re-applies the row selection if the parent changed since it was last applied.
+                """
+                parent_revision = self.parent.revision
+                if parent_revision == self.parent_revision:
+                        return False
+                with review_lock:
+                        self.parent_revision = parent_revision
+                        self.view_revision += 1
+                        if self.row_filter is not None:
+                                self.apply_filter()
+                        elif self.row_indices is not None:
+                                num_rows = len(self.parent)
+                                self.row_indices = [i for i in self.row_indices if i < num_rows]
+                return True
+
+        def update(self, force=False):
+                self.sync()
+                for child in self.children:
+                        child.update()
+                return True
+
+        def header(self):
+                if self.fields is None:
+                        return self.parent.header()
+                return list(self.fields)
+
+        @property
+        def data_table(self):
+                return {field_name: self[field_name] for field_name in self.header()}
+
+        def get_data(self):
+                return self.data_table
+
+        def project(self, fields):
+                return DataSetView(self, fields=fields)
+
+        def filter(self, row_filter):
+                return DataSetView(self, row_filter=row_filter)
+
+        def mask(self, row_mask):
+                return DataSetView(self, row_indices=[i for i, keep in enumerate(row_mask) if keep])
+
+        def __getitem__(self, key):
+                self.sync()
+                if type(key) == str:
+                        if (self.fields is not None) and (key not in self.fields):
+                                raise KeyError(key)
+                        column = self.parent[key]
+                        if self.row_indices is None:
+                                return column
+                        return ColumnView(column, self.row_indices)
+                else:
+                        row = key if self.row_indices is None else self.row_indices[key]
+                        return [self.parent[field_name][row] for field_name in self.header()]
+
+        def __len__(self):
+                self.sync()
+                if self.row_indices is None:
+                        return len(self.parent)
+                return len(self.row_indices)
+
+        def rows(self, fields=None):
+                if fields is None:
+                        fields = self.header()
+                return zip(*[self[field_name] for field_name in fields])
+
+        def materialize(self):
+                """Copies the view into a standalone DataSet.
+                """
+                new_data_set = DataSet()
+                new_data_set.data_table = {field_name: list(self[field_name]) for field_name in self.header()}
+                return new_data_set
+
+        def name(self):
+                return "{} (view)".format(self.parent.name())
@@ -4,6 +4,20 @@ import json
 import os
 import datetime
 import re
+import heapq
+import itertools
+import collections
+import time
+import uuid
+
+import answers
+import card_store
+import data
+import diagnostics
+import filters
+
+# held while card states change, or cards are reconciled with the data set (see data.review_lock)
+review_lock = data.review_lock
 
 class ReviewScheme:
 	"""ReviewScheme -
@@ -22,15 +36,269 @@ class ReviewScheme:
 	def status_update(self, card):
 		return card.status
 	
+	def status_updates(self, successes, statuses):
+		"""Vectorized status_update, given numpy arrays of outcomes and of the cards' current statuses.
+		"""
+		return statuses
+	
+	def due_time(self, card):
+		"""Returns the time (seconds since the epoch) at which the card is next due for review.
+		"""
+		return card.status_dt.timestamp()
+	
+	def due_times(self, store):
+		"""Vectorized due_time over every card in a CardStore.
+		"""
+		return store.status_ts
+	
 	def get_options(self, n, correct_answer, deck):
-		output = [correct_answer]
-		while len(output) < n:
-			temp = deck.get_random_card().back_side
-			if temp not in output:
-				output.append(temp)
+		"""Returns correct_answer and up to n-1 distinct distractors, shuffled. Fewer than n options are
+			returned when the deck doesn't have enough unique back sides.
+		"""
+		output = [correct_answer] + deck.distractor_pool.sample(n - 1, correct_answer)
 		random.shuffle(output)
 		return output
 
+class DistractorPool:
+	"""DistractorPool -
+		The unique back-side values of a deck, for drawing multiple choice distractors without rejection sampling.
+		
+		values (list): each unique back side, in no particular order
+		positions (dictionary): [value]: index of the value in values
+		counts (dictionary): [value]: number of cards with that back side
+	"""
+	def __init__(self):
+		self.values    = []
+		self.positions = {}
+		self.counts    = {}
+	
+	def rebuild(self, back_sides):
+		self.__init__()
+		for value in back_sides:
+			self.add(value)
+	
+	def add(self, value):
+		count = self.counts.get(value, 0)
+		self.counts[value] = count + 1
+		if count == 0:
+			self.positions[value] = len(self.values)
+			self.values.append(value)
+	
+	def discard(self, value):
+		"""Removes one card's reference to value, dropping the value once no card uses it. O(1), by
+			moving the last value into the freed slot.
+		"""
+		count = self.counts.get(value, 0)
+		if count > 1:
+			self.counts[value] = count - 1
+		elif count == 1:
+			del self.counts[value]
+			position = self.positions.pop(value)
+			last_value = self.values.pop()
+			if position < len(self.values):
+				self.values[position] = last_value
+				self.positions[last_value] = position
+	
+	def sample(self, k, exclude=None):
+		"""Returns up to k distinct values other than exclude, drawn without replacement in O(k).
+		"""
+		num_draws = min(k + 1, len(self.values))
+		drawn = [self.values[i] for i in random.sample(range(len(self.values)), num_draws)]
+		return [value for value in drawn if value != exclude][:k]
+	
+	def __len__(self):
+		return len(self.values)
+
+class DueQueue:
+	"""DueQueue -
+		Per-deck index of the cards to review, ordered by the time each card is next due.
+		
+		Reviewed cards sit in a min-heap keyed on ReviewScheme.due_time, while new cards (those with the
+			review scheme's default status) sit in their own FIFO queue. Each card has at most one live
+			entry; superseded entries are marked dead and discarded lazily.
+		
+		heap (list): [due_time, sequence, card, live] entries
+		new_cards (deque): [None, sequence, card, live] entries, in insertion order
+		entries (dictionary): [card]: live entry
+		num_dead (int): number of dead heap entries. The heap is compacted when they outnumber the live ones,
+			so repeated reviews don't grow it.
+		num_new (int): number of live new card entries
+		num_due (int): number of live heap entries due at time counted_until, or None until first counted.
+		pending (list): min-heap of the entries not yet due at counted_until. As the clock passes them, they are
+			popped into num_due, so counting is O(log n) per card that becomes due rather than a walk of the heap.
+	"""
+	def __init__(self, deck):
+		self.deck      = deck
+		self.heap      = []
+		self.new_cards = collections.deque()
+		self.entries   = {}
+		self.sequence  = itertools.count()
+		self.num_new   = 0
+		self.num_dead  = 0
+		self.num_due   = None
+		self.counted_until = 0
+		self.pending   = []
+		self.num_pending_dead = 0
+	
+	def rebuild(self, cards):
+		"""Rebuilds the queue from scratch in O(n).
+		"""
+		self.heap      = []
+		self.new_cards = collections.deque()
+		self.entries   = {}
+		for card in cards:
+			entry = self._make_entry(card)
+			if entry[0] is None:
+				self.new_cards.append(entry)
+			else:
+				self.heap.append(entry)
+		heapq.heapify(self.heap)
+		self.num_new = len(self.new_cards)
+		self.num_dead = 0
+		self.num_due = None
+	
+	def push(self, card):
+		"""Adds a card, or reschedules it after its status has changed.
+		"""
+		self.remove(card)
+		entry = self._make_entry(card)
+		if entry[0] is None:
+			self.new_cards.append(entry)
+			self.num_new += 1
+		else:
+			heapq.heappush(self.heap, entry)
+			if self.num_due is not None:
+				if entry[0] <= self.counted_until:
+					self.num_due += 1
+				else:
+					heapq.heappush(self.pending, entry)
+	
+	def remove(self, card):
+		entry = self.entries.pop(card, None)
+		if entry is not None:
+			entry[3] = False
+			if entry[0] is None:
+				self.num_new -= 1
+				self._drop_dead_new()
+			else:
+				if self.num_due is not None:
+					if entry[0] <= self.counted_until:
+						self.num_due -= 1
+					else:
+						self.num_pending_dead += 1
+						if 2*self.num_pending_dead > len(self.pending):
+							self.pending = [entry for entry in self.pending if entry[3]]
+							heapq.heapify(self.pending)
+							self.num_pending_dead = 0
+				self.num_dead += 1
+				if 2*self.num_dead > len(self.heap):
+					self.compact()
+	
+	def compact(self):
+		"""Drops the dead entries from the heap, in O(n). Called when they outnumber the live ones, so O(1) amortized.
+		"""
+		self.heap = [entry for entry in self.heap if entry[3]]
+		heapq.heapify(self.heap)
+		self.num_dead = 0
+	
+	def _drop_dead_new(self):
+		while self.new_cards and not self.new_cards[0][3]:
+			self.new_cards.popleft()
+	
+	def due_count(self, now=None):
+		"""Returns the number of reviewed cards due at time now. Amortized O(1): entries are moved from pending to
+			num_due as they become due. Counting for a time earlier than the last count starts over, in O(n).
+		"""
+		if now is None:
+			now = time.time()
+		if (self.num_due is None) or (now < self.counted_until):
+			self._count_due(now)
+		pending = self.pending
+		while pending and (pending[0][0] <= now):
+			entry = heapq.heappop(pending)
+			if entry[3]:
+				self.num_due += 1
+			else:
+				self.num_pending_dead -= 1
+		self.counted_until = now
+		return self.num_due
+	
+	def _count_due(self, now):
+		live = [entry for entry in self.heap if entry[3]]
+		self.pending = [entry for entry in live if entry[0] > now]
+		heapq.heapify(self.pending)
+		self.num_pending_dead = 0
+		self.num_due, self.counted_until = len(live) - len(self.pending), now
+	
+	def get_cards(self, new_limit, now=None, due_limit=None):
+		"""Returns the cards due at time now (in due order, at most due_limit), followed by up to new_limit new cards.
+		
+			Costs O(k log n) for k due cards, as due entries are popped and then pushed back.
+		"""
+		if now is None:
+			now = time.time()
+		out_cards = []
+		popped = []
+		while self.heap and (self.heap[0][0] <= now):
+			if (due_limit is not None) and (len(popped) >= due_limit):
+				break
+			entry = heapq.heappop(self.heap)
+			if entry[3]:
+				popped.append(entry)
+				out_cards.append(entry[2])
+			else:
+				self.num_dead -= 1
+		for entry in popped:
+			heapq.heappush(self.heap, entry)
+		
+		self._drop_dead_new()
+		new_count = 0
+		for entry in self.new_cards:
+			if new_count >= new_limit:
+				break
+			if entry[3]:
+				out_cards.append(entry[2])
+				new_count += 1
+		return out_cards
+	
+	def iter_cards(self, new_limit, now=None, due_limit=None):
+		"""Lazy get_cards: yields the same cards, taking each due card only as it is needed, in O(log n).
+		
+			The queue itself is never changed: due entries are walked in order through a private heap of positions
+			in a copy of self.heap, so a checkpoint taken during a session still has every card queued. Cards
+			rescheduled after they were taken are not yielded again.
+		"""
+		if now is None:
+			now = time.time()
+		heap = list(self.heap)
+		cursor = [(heap[0][0], heap[0][1], 0)] if heap and (heap[0][0] <= now) else []
+		taken = 0
+		while cursor and ((due_limit is None) or (taken < due_limit)):
+			due, sequence, i = heapq.heappop(cursor)
+			for child in (2*i + 1, 2*i + 2):
+				if (child < len(heap)) and (heap[child][0] <= now):
+					heapq.heappush(cursor, (heap[child][0], heap[child][1], child))
+			entry = heap[i]
+			if entry[3]:
+				taken += 1
+				yield entry[2]
+		
+		self._drop_dead_new()
+		new_entries = list(itertools.islice((entry for entry in self.new_cards if entry[3]), new_limit))
+		for entry in new_entries:
+			if entry[3]:
+				yield entry[2]
+	
+	def _make_entry(self, card):
+		scheme = self.deck.review_scheme
+		if card.status == scheme.default_status:
+			due = None
+		else:
+			due = scheme.due_time(card)
+		entry = [due, next(self.sequence), card, True]
+		self.entries[card] = entry
+		return entry
+
 class Card:
         """Card -
                 The basic unit of review. Contains exactly two fields: front and back.
@@ -43,6 +311,8 @@ class Card:
                 status_dt: datetime that the status was last updated.
 
         """
+        __slots__ = ("front_side", "back_side", "status", "status_dt", "parent")
+
         def __init__(self, front_side, back_side, status, parent, status_dt="now"):
                 self.front_side = front_side
                 self.back_side  = back_side
@@ -55,80 +325,244 @@ class Card:
 		                
                 self.parent = parent
 
+        def __setstate__(self, state):
+                # cards pickled before __slots__ have a plain attribute dictionary as their state
+                if isinstance(state, tuple):
+                        state = state[1]
+                for name in self.__slots__:
+                        if name in state:
+                                setattr(self, name, state[name])
+
         def flipped_card(self):
                 return Card(self.back_side, self.front_side)
         
-        def update_card(self, success):
-        	self.status = self.parent.review_scheme.status_update(success, self)
-        	self.status_dt = datetime.datetime.now()
+        @diagnostics.timed("Card.update_card")
+        def update_card(self, success, status_dt=None):
+        	with review_lock:
+        		prior_status, prior_status_dt = self.status, self.status_dt
+        		self.status = self.parent.review_scheme.status_update(success, self)
+        		self.status_dt = datetime.datetime.now() if status_dt is None else status_dt
+        		try:
+        			self.parent.record_review(self, success, prior_status)
+        		except BaseException:
+        			# the review wasn't journaled, so it must not be kept in memory either
+        			self.status, self.status_dt = prior_status, prior_status_dt
+        			raise
         	
                 
 class Deck:
         """Basic deck object deriving cards from a data set
+
+                columnar (bool): keep cards in a numpy-backed CardStore instead of a list of Card objects.
+                	cards then holds the store, which yields CardView objects.
+                deck_id (str): identifier for the deck that is stable across saves
+                journal: if set, an object with an append(deck, card) method, called on each review
+                history: if set, an object with an append(deck, card, success, prior_status) method, called on each
+                	answered review (a review_history.ReviewHistory)
+                answer_index (AnswerIndex): accepted answers for typed responses, including alternates from rows with
+                	a duplicate front side
+                filter_fn: function(card) -> bool, or a filters.Expression over the fields of the DataSet. Expressions
+                	are evaluated over the DataSet's columns, so no card is created for rows that don't match.
+                review_lock (RLock): the module's review_lock, to hold while changing card states or cards
         """
-        def __init__(self, parent, front_side, back_side, review_scheme_obj, filter_fn="none", initialize=True):
+        review_lock = review_lock
+
+        def __init__(self, parent, front_side, back_side, review_scheme_obj, filter_fn="none", initialize=True, columnar=False):
                 self.parent = parent
-                self.parent.add_child(self)
+                self.deck_id = uuid.uuid4().hex
+                self.journal = None
+                self.history = None
                 self.review_scheme = review_scheme_obj
                 self.front_side = front_side
                 self.back_side  = back_side
                 self.filter_fn = filter_fn
                 self.cards = []
+                self.card_index = {}
+                self.due_queue = DueQueue(self)
+                self.distractor_pool = DistractorPool()
+                self.answer_index = answers.AnswerIndex()
+                self.card_store = None
+                if columnar:
+                        self.card_store = card_store.CardStore(self)
+                        self.cards = self.card_store
+                        self.due_queue = None
                 if type(filter_fn) == str:
                         self.filter_fn = (lambda x: True)
-                if initialize:
-	                self.refresh_data()
+                # the deck only joins its parent's children once loaded, so a checkpoint never sees it half built
+                with review_lock:
+                        if initialize:
+                                self.refresh_data()
+                        self.parent.add_child(self)
 
+        @diagnostics.timed("Deck.load_data_from_source")
         def load_data_from_source(self):
                 """Pull from the DataSet object. For refreshing data or initializaing independent decks.
+
+                        Cards are reconciled in a single pass against card_index, keyed by front side. Rows with a
+                        front side that was already seen don't create cards, as cards are identified by their front side,
+                        but their back sides are accepted as alternate answers.
+
+                        Returns a dictionary summarizing the change: {"added": int, "updated": int, "removed": int}
                 """
-                underlying_data = []
-                for front, back in zip(self.parent[self.front_side], self.parent[self.back_side]):
-                	underlying_data.append([front,back,False])
-
-                new_cards = []
-
-                # update and delete any cards
-                for card in self.cards:
-                        for subarray in underlying_data:
-                                if subarray[0] == card.front_side:
-                                        card.back = subarray[1]
-                                        if self.filter_fn(card):
-                                                new_cards.append(card)
-                                        subarray[2] = True
-
-                self.cards = new_cards
-
-                # add new cards
-                for subarray in underlying_data:
-                        if not subarray[2]:
-                                self.add_card(subarray[0], subarray[1])
-                                
+                with review_lock:
+                        card_filter = self.filter_fn
+                        row_indices = None
+                        if isinstance(card_filter, filters.Expression):
+                                row_indices = filters.matching_rows(card_filter, self.parent, vectorized=(self.card_store is not None))
+                                card_filter = None
+
+                        alternates = {}
+                        if self.card_store is not None:
+                                summary = self.card_store.reconcile(self.parent[self.front_side], self.parent[self.back_side], card_filter,
+                                                                    row_indices, alternates)
+                                self.answer_index.reset(alternates)
+                                if summary["added"] or summary["updated"] or summary["removed"]:
+                                        self.distractor_pool.rebuild(card.back_side for card in self.cards)
+                                return summary
+
+                        old_index = self.card_index
+                        pool = self.distractor_pool
+                        new_index = {}
+                        new_cards = []
+                        seen = set()
+                        summary = {"added": 0, "updated": 0, "removed": 0}
+
+                        fronts, backs = self.parent[self.front_side], self.parent[self.back_side]
+                        if row_indices is not None:
+                                fronts, backs = [fronts[i] for i in row_indices], [backs[i] for i in row_indices]
+                        for front, back in zip(fronts, backs):
+                                if front in seen:
+                                        alternates.setdefault(front, []).append(back)
+                                        continue
+                                seen.add(front)
+
+                                card = old_index.get(front)
+                                if card is None:
+                                        card = Card(front, back, self.review_scheme.default_status, self)
+                                        if (card_filter is not None) and not card_filter(card):
+                                                continue
+                                        summary["added"] += 1
+                                        pool.add(back)
+                                else:
+                                        if card.back_side != back:
+                                                pool.discard(card.back_side)
+                                                pool.add(back)
+                                                card.back_side = back
+                                                summary["updated"] += 1
+                                        if (card_filter is not None) and not card_filter(card):
+                                                continue
+                                new_index[front] = card
+                                new_cards.append(card)
+
+                        # every card in the new index is either newly added or kept from the old index
+                        summary["removed"] = len(old_index) - (len(new_index) - summary["added"])
+                        if summary["removed"]:
+                                for front, card in old_index.items():
+                                        if front not in new_index:
+                                                pool.discard(card.back_side)
+
+                        self.cards = new_cards
+                        self.card_index = new_index
+                        self.answer_index.reset(alternates)
+                        if summary["added"] or summary["removed"]:
+                                self.due_queue.rebuild(self.cards)
+                        return summary
+
         def add_card(self, front_side, back_side):
-        	self.cards.append(Card(front_side, back_side, self.review_scheme.default_status, self))
+                if self.card_store is not None:
+                        self.distractor_pool.add(back_side)
+                        return self.card_store.append(front_side, back_side, self.review_scheme.default_status)
+                card = Card(front_side, back_side, self.review_scheme.default_status, self)
+                self.distractor_pool.add(back_side)
+                self.cards.append(card)
+                self.card_index[front_side] = card
+                self.due_queue.push(card)
+                return card
+
+        def record_review(self, card, success=None, prior_status=None):
+                """Called by a card after its status changes, to keep the deck's indices up to date.
+                	success and prior_status are given when the change is the result of an answer, to record it in the history.
+
+                	The review is written before the indices are updated, so if writing fails the card can be restored.
+                """
+                if (self.history is not None) and (success is not None):
+                        self.history.append(self, card, success, prior_status)
+                if self.journal is not None:
+                        self.journal.append(self, card)
+                if self.due_queue is not None:
+                        self.due_queue.push(card)
+                else:
+                        self.card_store.note_review(card.position)
+
+        def record_reviews(self, cards, outcomes=None):
+                """Batch version of record_review, for cards whose status was updated directly.
+                	outcomes, if given, is a list of (success, prior status) for each card.
+                """
+                diagnostics.count("batched reviews", len(cards))
+                if (self.history is not None) and (outcomes is not None):
+                        self.history.append_many(self, cards, outcomes)
+                if self.journal is not None:
+                        self.journal.append_many(self, cards)
+                if self.due_queue is not None:
+                        for card in cards:
+                                self.due_queue.push(card)
+                else:
+                        for card in cards:
+                                self.card_store.note_review(card.position)
 
         def refresh_data(self):
                 """Either update the data in each card, or update the parent data set.
                 """
-                self.load_data_from_source()
+                return self.load_data_from_source()
+
+        def get_card(self, front_side):
+                """Find the card object with the given front value, or None.
+                """
+                if self.card_store is not None:
+                        return self.card_store.get(front_side)
+                return self.card_index.get(front_side)
 
         def find_card_by_side(self, front_side, back_side):
                 """Find the card object that matches the given front and back values.
                     Note that these are non-rendered values.
                 """
-                for card in self.cards:
-                        if (card.front_side == front_side and card.back_side == back_side):
-                                return card
+                card = self.get_card(front_side)
+                if (card is not None) and (card.back_side == back_side):
+                        return card
                 return None
+
+        def check_answer(self, card, response):
+                """Returns whether a typed response is accepted for card, ignoring case, accents, whitespace and small typos.
+                """
+                return self.answer_index.check(card.front_side, card.back_side, response)
                 
-        def get_cards_to_review(self):
-        	return self.review_scheme.get_cards_to_review(self)
+        @diagnostics.timed("Deck.get_cards_to_review")
+        def get_cards_to_review(self, limit=None):
+        	return self.review_scheme.get_cards_to_review(self, limit)
+
+        def due_counts(self, now=None):
+                """Returns (number of cards due now, number of new cards for the next session), cheaply enough for menus.
+                """
+                new_limit = self.review_scheme.new_cards_per_session
+                if self.card_store is not None:
+                        num_due, num_new = self.card_store.due_counts(self.review_scheme, now)
+                else:
+                        num_due, num_new = self.due_queue.due_count(now), self.due_queue.num_new
+                return num_due, min(num_new, new_limit)
+
+        def iter_cards_to_review(self, limit=None):
+                """Generator version of get_cards_to_review, which only does work as cards are taken.
+                """
+                return self.review_scheme.iter_cards_to_review(self, limit)
 
         def num_cards(self):
                 return len(self.cards)
 
         def shuffle(self):
-                random.shuffle(self.cards)
+                if self.card_store is not None:
+                        self.card_store.shuffle()
+                else:
+                        random.shuffle(self.cards)
 
         def get_random_card(self):
                 return random.choice(self.cards)
@@ -136,7 +570,7 @@ class Deck:
         def update(self):
                 """Update upon a material change. At the moment this only changes the data of the cards.
                 """
-                self.refresh_data()
+                return self.refresh_data()
 
         def __getitem__(self, key):
                 return self.cards[key]
@@ -0,0 +1,91 @@
+import cProfile
+import functools
+import json
+import time
+
+# opt-in instrumentation of carta's hot paths. Disabled by default, when a timed call costs one flag check.
+enabled   = False
+timers    = {}
+counters  = {}
+_profiler = None
+_profile_file = None
+
+def timed(name):
+	"""Decorator timing each call of the function under name, while instrumentation is enabled.
+	"""
+	def decorate(fn):
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			if not enabled:
+				return fn(*args, **kwargs)
+			start = time.perf_counter()
+			try:
+				return fn(*args, **kwargs)
+			finally:
+				record(name, time.perf_counter() - start)
+		return wrapper
+	return decorate
+
+def record(name, seconds):
+	timer = timers.get(name)
+	if timer is None:
+		timers[name] = [1, seconds, seconds]
+	else:
+		timer[0] += 1
+		timer[1] += seconds
+		if seconds > timer[2]:
+			timer[2] = seconds
+
+def count(name, n=1):
+	if enabled:
+		counters[name] = counters.get(name, 0) + n
+
+def enable(profile_file=None):
+	"""Starts collecting timers and counters. With profile_file, the whole session is also run under cProfile,
+		and the profile is written to profile_file by disable().
+	"""
+	global enabled, _profiler, _profile_file
+	enabled = True
+	if (profile_file is not None) and (_profiler is None):
+		_profiler = cProfile.Profile()
+		_profile_file = profile_file
+		_profiler.enable()
+
+def disable():
+	global enabled, _profiler, _profile_file
+	enabled = False
+	if _profiler is not None:
+		_profiler.disable()
+		_profiler.dump_stats(_profile_file)
+		_profiler, _profile_file = None, None
+
+def reset():
+	timers.clear()
+	counters.clear()
+
+def stats():
+	"""Returns {"timers": {name: {"calls", "total", "mean", "max"}}, "counters": {name: int}}, with times in seconds.
+	"""
+	return {
+		"timers": {name: {"calls": calls, "total": total, "mean": total/calls, "max": longest}
+		           for name, (calls, total, longest) in sorted(timers.items())},
+		"counters": dict(sorted(counters.items()))
+	}
+
+def report():
+	"""Formats stats() as a table, slowest total first.
+	"""
+	current = stats()
+	lines = ["{:<32} {:>8} {:>11} {:>11} {:>11}".format("timer", "calls", "total ms", "mean ms", "max ms")]
+	for name, timer in sorted(current["timers"].items(), key=lambda item: -item[1]["total"]):
+		lines.append("{:<32} {:>8} {:>11.2f} {:>11.3f} {:>11.3f}".format(
+			name, timer["calls"], timer["total"]*1000, timer["mean"]*1000, timer["max"]*1000))
+	for name, value in current["counters"].items():
+		lines.append("{:<32} {:>8}".format(name, value))
+	return "\n".join(lines)
+
+def dump(file_name):
+	"""Writes stats() to file_name as JSON.
+	"""
+	with open(file_name, "w") as output_file:
+		json.dump(stats(), output_file, indent=2)
@@ -0,0 +1,305 @@
+import operator
+import re
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+class Expression:
+	"""Expression -
+		Declarative filter over the named fields of a row. Unlike an opaque filter_fn, an expression can be
+			evaluated by DataSources while parsing, translated to SQL, or applied as a vectorized mask.
+
+		Build expressions from Field objects, and combine them with &, | and ~:
+			(Field("continent") == "Europe") & ~Field("name").matches("^United")
+	"""
+	def fields(self):
+		"""Returns the set of field names the expression reads.
+		"""
+		raise NotImplementedError
+
+	def compile(self, positions):
+		"""Returns a function(row) -> bool, where row is a sequence and positions maps each field name to its index in row.
+		"""
+		raise NotImplementedError
+
+	def to_sql(self, quote):
+		"""Returns (sql, parameters) for a WHERE clause. quote(name) quotes a column name.
+		"""
+		raise NotImplementedError
+
+	def mask(self, columns):
+		"""Returns a numpy boolean array, given a dictionary [FIELD NAME]: numpy array.
+		"""
+		raise NotImplementedError
+
+	def evaluate(self, row):
+		"""Evaluates the expression on a dictionary [FIELD NAME]: value.
+		"""
+		names = list(self.fields())
+		return self.compile({name: i for i, name in enumerate(names)})([row[name] for name in names])
+
+	def __and__(self, other):
+		return And(self, other)
+
+	def __or__(self, other):
+		return Or(self, other)
+
+	def __invert__(self):
+		return Not(self)
+
+class Field:
+	"""Field -
+		A named field, used to build expressions: ==, !=, <, <=, >, >=, isin(), between() and matches().
+
+		Values read from CSV and Excel files are strings, which compare as text ("10" < "9"). Give a type to convert
+			the field, and the compared values, before comparing: Field("population", type=float).between(1e6, 5e6).
+			Values that can't be converted (such as empty cells) match no comparison. In SQL the field is CAST to
+			the type (see SQL_TYPES), which follows SQLite's rules instead: text that isn't a number casts to 0.
+			Without a type, cells that can't be ordered against the value (None, or a number against a string)
+			don't match.
+
+		name (str): the field name
+		type: a function value -> converted value, such as int, float or str, or None to compare values as they are
+	"""
+	def __init__(self, name, type=None):
+		self.name = name
+		self.type = type
+
+	def __eq__(self, value):
+		return Compare(self.name, "==", value, self.type)
+
+	def __ne__(self, value):
+		return Compare(self.name, "!=", value, self.type)
+
+	def __lt__(self, value):
+		return Compare(self.name, "<", value, self.type)
+
+	def __le__(self, value):
+		return Compare(self.name, "<=", value, self.type)
+
+	def __gt__(self, value):
+		return Compare(self.name, ">", value, self.type)
+
+	def __ge__(self, value):
+		return Compare(self.name, ">=", value, self.type)
+
+	def isin(self, values):
+		return In(self.name, values, self.type)
+
+	def between(self, low, high):
+		"""Inclusive range, as in SQL.
+		"""
+		return Compare(self.name, ">=", low, self.type) & Compare(self.name, "<=", high, self.type)
+
+	def matches(self, pattern):
+		"""Regular expression search on the value's string form.
+		"""
+		return Matches(self.name, pattern)
+
+	__hash__ = object.__hash__
+
+COMPARISONS = {
+	"==": (operator.eq, "="),
+	"!=": (operator.ne, "!="),
+	"<":  (operator.lt, "<"),
+	"<=": (operator.le, "<="),
+	">":  (operator.gt, ">"),
+	">=": (operator.ge, ">=")
+}
+
+# SQL types that a Field's type is cast to
+SQL_TYPES = {int: "INTEGER", float: "REAL", str: "TEXT"}
+
+def cast(value_type, value):
+	"""Returns value_type(value), or None when the value can't be converted.
+	"""
+	try:
+		return value_type(value)
+	except (TypeError, ValueError):
+		return None
+
+def comparable(compare, left, right):
+	"""Returns compare(left, right), or False when the values can't be compared, such as None and a string.
+	"""
+	try:
+		return compare(left, right)
+	except TypeError:
+		return False
+
+def cast_sql(field_sql, value_type):
+	if value_type is None:
+		return field_sql
+	if value_type not in SQL_TYPES:
+		raise Exception("No SQL type for {}.".format(value_type))
+	return "CAST({} AS {})".format(field_sql, SQL_TYPES[value_type])
+
+def cast_mask(column, value_type, test):
+	"""Returns test(converted column) as a numpy boolean array, False where a value can't be converted.
+	"""
+	if value_type is float:
+		try:
+			values = np.asarray(column, dtype=float)
+		except (TypeError, ValueError):
+			values = np.fromiter((cast(float, value) for value in column), dtype=float, count=len(column))
+		return test(values) & ~np.isnan(values)
+	values = [cast(value_type, value) for value in column]
+	return np.fromiter(((value is not None) and bool(test(value)) for value in values), dtype=bool, count=len(values))
+
+class Compare(Expression):
+	def __init__(self, field_name, op, value, value_type=None):
+		self.field_name = field_name
+		self.op = op
+		self.value = value if value_type is None else value_type(value)
+		self.value_type = value_type
+
+	def fields(self):
+		return {self.field_name}
+
+	def compile(self, positions):
+		position, compare, value, value_type = positions[self.field_name], COMPARISONS[self.op][0], self.value, self.value_type
+		if value_type is None:
+			return lambda row: comparable(compare, row[position], value)
+		def predicate(row):
+			converted = cast(value_type, row[position])
+			return (converted is not None) and compare(converted, value)
+		return predicate
+
+	def to_sql(self, quote):
+		return "{} {} ?".format(cast_sql(quote(self.field_name), self.value_type), COMPARISONS[self.op][1]), [self.value]
+
+	def mask(self, columns):
+		compare, value = COMPARISONS[self.op][0], self.value
+		if self.value_type is None:
+			column = columns[self.field_name]
+			try:
+				return np.asarray(compare(column, value), dtype=bool)
+			except TypeError:
+				return np.fromiter((comparable(compare, cell, value) for cell in column), dtype=bool, count=len(column))
+		return cast_mask(columns[self.field_name], self.value_type, lambda values: compare(values, value))
+
+class In(Expression):
+	def __init__(self, field_name, values, value_type=None):
+		self.field_name = field_name
+		self.values = frozenset(values if value_type is None else (value_type(value) for value in values))
+		self.value_type = value_type
+
+	def fields(self):
+		return {self.field_name}
+
+	def compile(self, positions):
+		position, values, value_type = positions[self.field_name], self.values, self.value_type
+		if value_type is None:
+			return lambda row: row[position] in values
+		return lambda row: cast(value_type, row[position]) in values
+
+	def to_sql(self, quote):
+		values = list(self.values)
+		return "{} IN ({})".format(cast_sql(quote(self.field_name), self.value_type), ", ".join("?" for value in values)), values
+
+	def mask(self, columns):
+		if self.value_type is None:
+			return np.isin(columns[self.field_name], list(self.values))
+		values = self.values
+		if self.value_type is float:
+			return cast_mask(columns[self.field_name], float, lambda converted: np.isin(converted, list(values)))
+		return cast_mask(columns[self.field_name], self.value_type, lambda converted: converted in values)
+
+class Matches(Expression):
+	def __init__(self, field_name, pattern):
+		self.field_name = field_name
+		self.pattern = re.compile(pattern)
+
+	def fields(self):
+		return {self.field_name}
+
+	def compile(self, positions):
+		position, search = positions[self.field_name], self.pattern.search
+		return lambda row: search(str(row[position])) is not None
+
+	def to_sql(self, quote):
+		return "{} REGEXP ?".format(quote(self.field_name)), [self.pattern.pattern]
+
+	def mask(self, columns):
+		search = self.pattern.search
+		column = columns[self.field_name]
+		return np.fromiter((search(str(value)) is not None for value in column), dtype=bool, count=len(column))
+
+class And(Expression):
+	def __init__(self, left, right):
+		self.left = left
+		self.right = right
+
+	def fields(self):
+		return self.left.fields() | self.right.fields()
+
+	def compile(self, positions):
+		left, right = self.left.compile(positions), self.right.compile(positions)
+		return lambda row: left(row) and right(row)
+
+	def to_sql(self, quote):
+		left_sql, left_params = self.left.to_sql(quote)
+		right_sql, right_params = self.right.to_sql(quote)
+		return "({}) AND ({})".format(left_sql, right_sql), left_params + right_params
+
+	def mask(self, columns):
+		return self.left.mask(columns) & self.right.mask(columns)
+
+class Or(And):
+	def compile(self, positions):
+		left, right = self.left.compile(positions), self.right.compile(positions)
+		return lambda row: left(row) or right(row)
+
+	def to_sql(self, quote):
+		left_sql, left_params = self.left.to_sql(quote)
+		right_sql, right_params = self.right.to_sql(quote)
+		return "({}) OR ({})".format(left_sql, right_sql), left_params + right_params
+
+	def mask(self, columns):
+		return self.left.mask(columns) | self.right.mask(columns)
+
+class Not(Expression):
+	def __init__(self, inner):
+		self.inner = inner
+
+	def fields(self):
+		return self.inner.fields()
+
+	def compile(self, positions):
+		inner = self.inner.compile(positions)
+		return lambda row: not inner(row)
+
+	def to_sql(self, quote):
+		sql, params = self.inner.to_sql(quote)
+		return "NOT ({})".format(sql), params
+
+	def mask(self, columns):
+		return ~self.inner.mask(columns)
+
+def compile_for_header(expression, header):
+	"""Compiles expression for rows laid out as header (a list of field names).
+	"""
+	missing = expression.fields() - set(header)
+	if missing:
+		raise Exception("Filter fields {} not found.".format(", ".join(sorted(missing))))
+	return expression.compile({name: header.index(name) for name in expression.fields()})
+
+def matching_rows(expression, data_set, vectorized=False):
+	"""Returns the indices of the rows of data_set (a DataSet or view) that match expression.
+
+		vectorized (bool): evaluate with numpy masks over the columns, when numpy is available
+	"""
+	names = list(expression.fields())
+	if vectorized and (np is not None):
+		return np.flatnonzero(expression.mask({name: np.asarray(data_set[name]) for name in names})).tolist()
+	predicate = expression.compile({name: i for i, name in enumerate(names)})
+	return [i for i, row in enumerate(data_set.rows(names)) if predicate(row)]
+
+def filter_table(data_table, expression):
+	"""Applies expression to a pulled data table ([FIELD NAME]: [list of values]), for sources that can't filter while parsing.
+	"""
+	names = list(expression.fields())
+	predicate = expression.compile({name: i for i, name in enumerate(names)})
+	keep = [predicate(row) for row in zip(*[data_table[name] for name in names])]
+	return {field_name: [value for value, kept in zip(column, keep) if kept] for field_name, column in data_table.items()}
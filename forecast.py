@@ -0,0 +1,129 @@
+import time
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+import review_scheme
+
+# Workload forecasts: how many reviews a deck will produce each day under a review scheme.
+#
+# The simulation keeps every card's status and status time in arrays, in the layout of a CardStore, and
+#     advances them one daily session at a time with ReviewScheme.status_updates and due_times, so its
+#     cost per day is a handful of array operations over the deck rather than a call per card.
+
+SECONDS_PER_DAY = 24*60*60
+
+class CardArrays:
+	"""CardArrays -
+		Statuses and status times of a set of cards, with the same attributes as a CardStore, so
+			ReviewScheme.due_times applies to it.
+
+		statuses (int16 array), status_ts (int64 array): as in CardStore
+	"""
+	__slots__ = ("statuses", "status_ts")
+
+	def __init__(self, statuses, status_ts):
+		self.statuses  = statuses
+		self.status_ts = status_ts
+
+	@classmethod
+	def from_deck(cls, deck):
+		"""Copies the deck's card states, in the order the deck introduces new cards.
+		"""
+		if np is None:
+			raise ImportError("numpy is required for forecasts.")
+		if deck.card_store is not None:
+			return cls(deck.card_store.statuses.copy(), deck.card_store.status_ts.copy())
+		cards = list(deck.cards)
+		return cls(np.fromiter((card.status for card in cards), dtype=np.int16, count=len(cards)),
+		           np.fromiter((int(card.status_dt.timestamp()) for card in cards), dtype=np.int64, count=len(cards)))
+
+	def take(self, positions):
+		return CardArrays(self.statuses[positions], self.status_ts[positions])
+
+def simulate(deck, scheme=None, days=90, success_probability=0.9, start=None, seed=None):
+	"""Projects the deck's daily reviews, starting from its current card states.
+
+		Each day has one session at the same time as start: every due card is reviewed, along with the scheme's
+			new_cards_per_session new cards, and each review succeeds at random with success_probability.
+			The deck itself is not changed.
+
+		scheme (ReviewScheme): the scheme to simulate, defaulting to the deck's. It should implement status_updates.
+		days (int): number of daily sessions
+		success_probability: a probability, or a function(statuses) -> array of probabilities, by the cards' prior status
+		start (float): time of the first session, in seconds since the epoch, defaulting to now
+		seed: for numpy.random.default_rng, for reproducible forecasts
+
+		Returns a dictionary of arrays, one entry per day:
+			"day" (numpy datetime64[D]), "due" (reviews of cards seen before), "new" (new cards), "passed"
+	"""
+	if scheme is None:
+		scheme = deck.review_scheme
+	if start is None:
+		start = time.time()
+	start = int(start)
+	rng = np.random.default_rng(seed)
+
+	cards = CardArrays.from_deck(deck)
+	new_positions = np.flatnonzero(cards.statuses == scheme.default_status)
+	seen = cards.statuses != scheme.default_status
+	due_ts = np.full(len(cards.statuses), np.iinfo(np.int64).max, dtype=np.int64)
+	due_ts[seen] = scheme.due_times(cards)[seen]
+	next_new = 0
+
+	due_counts = np.zeros(days, dtype=np.int64)
+	new_counts = np.zeros(days, dtype=np.int64)
+	passed = np.zeros(days, dtype=np.int64)
+	for day in range(days):
+		now = start + day*SECONDS_PER_DAY
+		due = np.flatnonzero(due_ts <= now)
+		introduced = new_positions[next_new:next_new + scheme.new_cards_per_session]
+		next_new += len(introduced)
+		reviewed = np.concatenate((due, introduced))
+		due_counts[day], new_counts[day] = len(due), len(introduced)
+		if len(reviewed) == 0:
+			continue
+
+		statuses = cards.statuses[reviewed]
+		probability = success_probability(statuses) if callable(success_probability) else success_probability
+		successes = rng.random(len(reviewed)) < probability
+		passed[day] = np.count_nonzero(successes)
+
+		cards.statuses[reviewed] = scheme.status_updates(successes, statuses)
+		cards.status_ts[reviewed] = now
+		due_ts[reviewed] = scheme.due_times(cards.take(reviewed))
+
+	first_day = (start + time.localtime(start).tm_gmtoff)//SECONDS_PER_DAY
+	return {"day": np.arange(first_day, first_day + days).astype("datetime64[D]"),
+	        "due": due_counts, "new": new_counts, "passed": passed}
+
+def compare(deck, schemes=None, days=90, success_probability=0.9, start=None, seed=0):
+	"""Runs simulate() for several schemes from the same deck state and random seed.
+
+		schemes (dictionary): [name]: ReviewScheme, defaulting to a Leitner and a Streak scheme with the
+			parameters of the deck's scheme
+
+		Returns a dictionary [name]: simulate() result
+	"""
+	if schemes is None:
+		current = deck.review_scheme
+		parameters = {"days_per_status": current.days_per_status, "new_cards_per_session": current.new_cards_per_session,
+		              "max_status": current.max_status}
+		schemes = {"Leitner": review_scheme.LeitnerReviewScheme(**parameters),
+		           "Streak": review_scheme.StreakReviewScheme(**parameters)}
+	if start is None:
+		start = time.time()
+	return {name: simulate(deck, scheme, days, success_probability, start, seed) for name, scheme in schemes.items()}
+
+def report(forecasts, period=7):
+	"""Formats compare() results as a table of total reviews (due + new) per period of days.
+	"""
+	names = list(forecasts)
+	first = forecasts[names[0]]
+	lines = ["{:<12}".format("from") + "".join("{:>12}".format(name) for name in names)]
+	for i in range(0, len(first["day"]), period):
+		totals = [int(forecast["due"][i:i + period].sum() + forecast["new"][i:i + period].sum()) for forecast in forecasts.values()]
+		lines.append("{:<12}".format(str(first["day"][i])) + "".join("{:>12}".format(total) for total in totals))
+	return "\n".join(lines)
@@ -0,0 +1,55 @@
+import concurrent.futures
+import os
+
+import data
+
+def pull_job(data_source, fields, where, fingerprint, cache):
+	"""Runs in a worker process: pulls from the source, returning the new data table.
+	"""
+	return data.pull_cached(data_source, fields, where, fingerprint, cache)
+
+def refresh_all(data_sets, workers=None, force=False):
+	"""Refreshes many DataSets at once.
+
+		Sources whose fingerprint changed are parsed in parallel in a process pool. Each new data table is
+			then installed on the calling thread, in order, by DataSet.set_data, which reconciles the child decks
+			under review_lock, so checkpoints and reviews on other threads never see a half reconciled deck.
+			Sources that parse in parallel themselves (DataSource.parses_in_parallel) are pulled on a thread of
+			this process instead, so they keep their per-file state.
+
+		workers (int): size of the pools, defaulting to the number of CPUs. With workers=1 everything runs
+			serially in this process.
+		force (bool): reload every DataSet, even if its source is unchanged
+
+		Returns a list, in the order of data_sets, of dictionaries:
+			{"name": str, "reloaded": bool, "children": [the children's update() results]}
+	"""
+	if workers is None:
+		workers = os.cpu_count() or 1
+
+	results = [{"name": data_set.name(), "reloaded": False, "children": []} for data_set in data_sets]
+	pending = []
+	for i, data_set in enumerate(data_sets):
+		if data_set.data_source is None:
+			continue
+		fingerprint = data_set.data_source.fingerprint()
+		if data_set.needs_pull(fingerprint, force):
+			pending.append((i, data_set, fingerprint))
+
+	if workers <= 1 or len(pending) <= 1:
+		for i, data_set, fingerprint in pending:
+			data_table = pull_job(data_set.data_source, data_set.pull_fields(), data_set.where, fingerprint, data_set.cache)
+			results[i]["children"] = data_set.set_data(data_table, fingerprint)
+			results[i]["reloaded"] = True
+		return results
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as process_pool, \
+	     concurrent.futures.ThreadPoolExecutor(max_workers=workers) as thread_pool:
+		pulls = []
+		for i, data_set, fingerprint in pending:
+			pool = thread_pool if data_set.data_source.parses_in_parallel else process_pool
+			pulls.append(pool.submit(pull_job, data_set.data_source, data_set.pull_fields(), data_set.where, fingerprint, data_set.cache))
+		for (i, data_set, fingerprint), pull in zip(pending, pulls):
+			results[i]["children"] = data_set.set_data(pull.result(), fingerprint)
+			results[i]["reloaded"] = True
+	return results
@@ -0,0 +1,141 @@
+import json
+import os
+import struct
+import threading
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+import data
+
+# Append-only log of every review, kept next to a save_data checkpoint.
+#
+# The log is a file of fixed-width little-endian records (see RECORD and DTYPE_FIELDS), so it can be appended to with
+#     one small write per review and read back as a numpy structured array without parsing. Cards are stored
+#     as integer indices into a companion file of [deck id, front side] JSON lines, one per card, in the order
+#     the cards were first reviewed. Front sides are written in the form of data.encode_cell, as in a ReviewJournal.
+
+RECORD = struct.Struct("<IqBh")
+DTYPE_FIELDS = [("card", "<u4"), ("timestamp", "<i8"), ("success", "u1"), ("prior_status", "<i2")]
+
+def record_dtype():
+	if np is None:
+		raise ImportError("numpy is required to read a review history.")
+	return np.dtype(DTYPE_FIELDS)
+
+class ReviewHistory:
+	"""ReviewHistory -
+		Fixed-width binary log of reviews: card index, timestamp (whole seconds), outcome and the card's status
+			before the review. Unlike a ReviewJournal it is never truncated by checkpoints.
+
+		A record or card line partially written by a crash is dropped the next time the history is opened.
+
+		file_name (str): the log of records. The card index is kept in file_name + ".cards".
+	"""
+	def __init__(self, file_name):
+		self.file_name  = file_name
+		self.cards_file = file_name + ".cards"
+		self.handle     = None
+		self.card_ids   = None
+		self.new_cards  = []
+		self.lock       = threading.Lock()
+
+	def load_cards(self):
+		"""Returns the list of [deck id, front side] keys, by card index, dropping a partially written last line.
+		"""
+		keys = []
+		if os.path.isfile(self.cards_file):
+			with open(self.cards_file, "rb") as cards_file:
+				contents = cards_file.read()
+			complete = contents.rfind(b"\n") + 1
+			if complete < len(contents):
+				with open(self.cards_file, "r+b") as cards_file:
+					cards_file.truncate(complete)
+			for line in contents[:complete].decode("utf-8").splitlines():
+				deck_id, front_side = json.loads(line)
+				keys.append([deck_id, data.decode_cell(front_side)])
+		return keys
+
+	def open(self):
+		if self.card_ids is None:
+			self.card_ids = {(deck_id, front_side): i for i, (deck_id, front_side) in enumerate(self.load_cards())}
+		if self.handle is None:
+			self.handle = open(self.file_name, "ab")
+			extra = self.handle.tell() % RECORD.size
+			if extra:
+				self.handle.truncate(self.handle.tell() - extra)
+				self.handle.seek(0, os.SEEK_END)
+
+	def card_id(self, deck, card):
+		key = (deck.deck_id, card.front_side)
+		card_id = self.card_ids.get(key)
+		if card_id is None:
+			card_id = len(self.card_ids)
+			self.card_ids[key] = card_id
+			self.new_cards.append(json.dumps([deck.deck_id, data.encode_cell(card.front_side)]) + "\n")
+		return card_id
+
+	def append(self, deck, card, success, prior_status):
+		self.append_many(deck, [card], [(success, prior_status)])
+
+	def append_many(self, deck, cards, outcomes):
+		"""Appends a record for each card, given the (success, prior status) of each review, with a single write.
+			New cards are written to the card index first, so every record refers to a saved card.
+		"""
+		with self.lock:
+			self.open()
+			self.new_cards = []
+			records = b"".join(RECORD.pack(self.card_id(deck, card), int(card.status_dt.timestamp()), bool(success), prior_status)
+			                   for card, (success, prior_status) in zip(cards, outcomes))
+			if self.new_cards:
+				with open(self.cards_file, "a", encoding="utf-8") as cards_file:
+					cards_file.write("".join(self.new_cards))
+			self.handle.write(records)
+			self.handle.flush()
+
+	def flush(self):
+		with self.lock:
+			if self.handle is not None:
+				self.handle.flush()
+				os.fsync(self.handle.fileno())
+
+	def close(self):
+		with self.lock:
+			if self.handle is not None:
+				self.handle.close()
+				self.handle = None
+
+	def cards(self):
+		"""Returns the list of (deck id, front side) keys, by card index.
+		"""
+		with self.lock:
+			return [tuple(key) for key in self.load_cards()]
+
+	def records(self, deck_id=None):
+		"""Returns the records as a numpy structured array (see DTYPE_FIELDS), optionally only those of one deck.
+		"""
+		dtype = record_dtype()
+		with self.lock:
+			if self.handle is not None:
+				self.handle.flush()
+			if not os.path.isfile(self.file_name):
+				return np.zeros(0, dtype=dtype)
+			count = os.path.getsize(self.file_name)//dtype.itemsize
+			records = np.fromfile(self.file_name, dtype=dtype, count=count)
+		if deck_id is not None:
+			in_deck = np.array([key[0] == deck_id for key in self.cards()], dtype=bool)
+			records = records[in_deck[records["card"]]]
+		return records
+
+	def __len__(self):
+		if not os.path.isfile(self.file_name):
+			return 0
+		return os.path.getsize(self.file_name)//RECORD.size
+
+	def __getstate__(self):
+		return {"file_name": self.file_name}
+
+	def __setstate__(self, state):
+		self.__init__(state["file_name"])
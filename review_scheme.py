@@ -5,9 +5,16 @@ import os
 import datetime
 import re
 
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
 import data
 import deck
 
+SECONDS_PER_DAY = 24*60*60
+
 class LeitnerReviewScheme(deck.ReviewScheme):
 	def __init__(self, days_per_status=1, new_cards_per_session=5, max_status=5):
 		super().__init__(-1)
@@ -25,21 +32,35 @@ class LeitnerReviewScheme(deck.ReviewScheme):
 		else:
 			return (update_dt <= datetime.datetime.now()) and (status != -1)
 	
-	def get_cards_to_review(self, deck):
-		out_cards = []
-		new_cards = 0	
-		for card in deck.cards:
-			if (card.status == -1) and (new_cards < self.new_cards_per_session):
-				out_cards.append(card)
-				new_cards += 1
-			elif self.card_filter(card):
-				out_cards.append(card)
-		return out_cards
+	def due_time(self, card):
+		return card.status_dt.timestamp() + (card.status*self.days_per_status*SECONDS_PER_DAY)
+	
+	def due_times(self, store):
+		return store.status_ts + store.statuses.astype(store.status_ts.dtype)*(self.days_per_status*SECONDS_PER_DAY)
+	
+	def get_cards_to_review(self, deck, limit=None):
+		"""Returns up to limit due cards (all of them by default) in due order, followed by the new cards for the session.
+		"""
+		if deck.card_store is not None:
+			return deck.card_store.select(self.due_times(deck.card_store), self.new_cards_per_session, due_limit=limit)
+		return deck.due_queue.get_cards(self.new_cards_per_session, due_limit=limit)
+	
+	def iter_cards_to_review(self, deck, limit=None):
+		"""Generator version of get_cards_to_review.
+		"""
+		if deck.card_store is not None:
+			return deck.card_store.iter_select(self.due_times(deck.card_store), self.new_cards_per_session, due_limit=limit)
+		return deck.due_queue.iter_cards(self.new_cards_per_session, due_limit=limit)
 	
 	def status_update(self, success, card):
 		if card.status in [-1, 0]:
 			return 1 if success else 0
 		return card.status + (1 if success else -1)
+	
+	def status_updates(self, successes, statuses):
+		"""Vectorized status_update.
+		"""
+		return np.where(statuses <= 0, successes, statuses + np.where(successes, 1, -1)).astype(statuses.dtype)
 
 
 class StreakReviewScheme(deck.ReviewScheme):
@@ -59,16 +80,30 @@ class StreakReviewScheme(deck.ReviewScheme):
 		else:
 			return (update_dt <= datetime.datetime.now()) and (status != -1)
 	
-	def get_cards_to_review(self, deck):
-		out_cards = []
-		new_cards = 0
-		for card in deck.cards:
-			if (card.status == -1) and (new_cards < self.new_cards_per_session):
-				out_cards.append(card)
-				new_cards += 1
-			elif self.card_filter(card):
-				out_cards.append(card)
-		return out_cards
+	def due_time(self, card):
+		return card.status_dt.timestamp() + (card.status*self.days_per_status*SECONDS_PER_DAY)
+	
+	def due_times(self, store):
+		return store.status_ts + store.statuses.astype(store.status_ts.dtype)*(self.days_per_status*SECONDS_PER_DAY)
+	
+	def get_cards_to_review(self, deck, limit=None):
+		"""Returns up to limit due cards (all of them by default) in due order, followed by the new cards for the session.
+		"""
+		if deck.card_store is not None:
+			return deck.card_store.select(self.due_times(deck.card_store), self.new_cards_per_session, due_limit=limit)
+		return deck.due_queue.get_cards(self.new_cards_per_session, due_limit=limit)
+	
+	def iter_cards_to_review(self, deck, limit=None):
+		"""Generator version of get_cards_to_review.
+		"""
+		if deck.card_store is not None:
+			return deck.card_store.iter_select(self.due_times(deck.card_store), self.new_cards_per_session, due_limit=limit)
+		return deck.due_queue.iter_cards(self.new_cards_per_session, due_limit=limit)
 	
 	def status_update(self, success, card):
 		return (card.status + 1 if success else 0)
+	
+	def status_updates(self, successes, statuses):
+		"""Vectorized status_update.
+		"""
+		return np.where(successes, statuses + 1, 0).astype(statuses.dtype)
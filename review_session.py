@@ -0,0 +1,311 @@
+import collections
+import datetime
+import heapq
+import queue
+import threading
+
+ReviewItem = collections.namedtuple("ReviewItem", ["key", "front_side", "back_side", "options"])
+
+def apply_results(deck, results, clock=datetime.datetime.now):
+	"""Applies a batch of answers to a deck in one pass.
+
+		results: iterable of (card_key, success, timestamp). timestamp may be a datetime, seconds since
+			the epoch, or None for the current time from clock, which is called at most once.
+
+		Nothing is applied if a row's timestamp is invalid. Cards updated before a failing status update are still
+			recorded with the deck, so its queue and journal stay in step with the cards.
+
+		Returns a dictionary {"applied": int, "unknown": [keys of cards not in the deck]}
+	"""
+	now = None
+	scheme = deck.review_scheme
+	planned = []
+	unknown = []
+	# every row is resolved and its timestamp converted before any card changes, so a bad row fails the whole batch
+	for card_key, success, timestamp in results:
+		card = deck.get_card(card_key)
+		if card is None:
+			unknown.append(card_key)
+			continue
+		if timestamp is None:
+			if now is None:
+				now = clock()
+			timestamp = now
+		elif not isinstance(timestamp, datetime.datetime):
+			timestamp = datetime.datetime.fromtimestamp(timestamp)
+		planned.append((card, success, timestamp))
+
+	updated = []
+	outcomes = []
+	with deck.review_lock:
+		try:
+			for card, success, timestamp in planned:
+				status = scheme.status_update(success, card)
+				outcomes.append((success, card.status))
+				card.status = status
+				card.status_dt = timestamp
+				updated.append(card)
+		finally:
+			if updated:
+				deck.record_reviews(updated, outcomes)
+	return {"applied": len(updated), "unknown": unknown}
+
+class ReviewSession:
+	"""ReviewSession -
+		Headless review engine for a deck. Hands out review items and applies answers in batches,
+			so reviews can be driven by the CLI, by scripts, or replayed from other tools' logs.
+
+		Cards are taken from the deck lazily, in due order, so the first item is ready without ordering the
+			whole deck. With prefetch, a background thread prepares the next items (and their options) while
+			the current one is being answered. Call close(), or use the session as a context manager, to
+			abandon it early; cards that weren't taken go back to the deck untouched.
+
+		deck (Deck): the deck under review
+		cards (generator): the cards due for this session, from the review scheme
+		num_options (int): number of multiple choice options per item, or 0 for none
+		clock (function): returns the datetime used for answers submitted without a timestamp.
+			Called once per batch.
+		prefetch (int): number of items to prepare ahead on a background thread, or 0 to prepare them on demand
+	"""
+	def __init__(self, deck, limit=None, num_options=0, clock=datetime.datetime.now, prefetch=0):
+		self.deck        = deck
+		self.cards       = self.card_stream(limit)
+		self.num_options = num_options
+		self.clock       = clock
+		self.prefetch    = prefetch
+		self.buffer      = collections.deque()
+		self.lock        = threading.Lock()
+		self.exhausted   = False
+		self.closed      = False
+		self.items       = None
+		self.thread      = None
+		if prefetch > 0:
+			self.items  = queue.Queue(maxsize=prefetch)
+			self.thread = threading.Thread(target=self.prepare_items, name="carta-prefetch", daemon=True)
+			self.thread.start()
+
+	def card_stream(self, limit):
+		return self.deck.iter_cards_to_review(limit)
+
+	def lookup(self, key):
+		"""Returns (deck, card) for an item key. card is None if the deck has no such card.
+		"""
+		return self.deck, self.deck.get_card(key)
+
+	def make_item(self, card):
+		options = None
+		if self.num_options > 0:
+			options = self.deck.review_scheme.get_options(self.num_options, card.back_side, self.deck)
+		return ReviewItem(card.front_side, card.front_side, card.back_side, options)
+
+	def take_item(self):
+		"""Builds the next item from the deck, or returns None at the end of the session.
+		"""
+		with self.lock:
+			card = next(self.cards, None)
+			return None if card is None else self.make_item(card)
+
+	def prepare_items(self):
+		"""Runs on the prefetch thread, keeping up to prefetch items ready.
+		"""
+		try:
+			while not self.closed:
+				item = self.take_item()
+				self.items.put(item)
+				if item is None:
+					return
+		except Exception as e:
+			self.items.put(e)
+
+	def next_item(self):
+		if self.buffer:
+			return self.buffer.popleft()
+		return self.fetch_item()
+
+	def fetch_item(self):
+		"""Returns the next prepared item, or None at the end of the session.
+		"""
+		if self.exhausted:
+			return None
+		if self.items is not None:
+			item = self.items.get()
+			if isinstance(item, Exception):
+				self.exhausted = True
+				raise item
+		else:
+			item = self.take_item()
+		if item is None:
+			self.exhausted = True
+		return item
+
+	def next_items(self, n=1):
+		"""Hands out the next n review items (fewer at the end of the session).
+		"""
+		items = []
+		while len(items) < n:
+			item = self.next_item()
+			if item is None:
+				break
+			items.append(item)
+		return items
+
+	def remaining(self):
+		"""Returns the number of items left. This prepares all of them, so it costs as much as an eager session.
+		"""
+		while True:
+			item = self.fetch_item()
+			if item is None:
+				break
+			self.buffer.append(item)
+		return len(self.buffer)
+
+	def submit(self, results):
+		"""Applies a batch of answers with apply_results(), using the session clock.
+		"""
+		with self.lock:
+			return apply_results(self.deck, results, self.clock)
+
+	def answer(self, item, response):
+		"""Checks a single response against the item, submits the result, and returns whether it was correct.
+			A chosen option must be the back side exactly, while typed responses are checked with Deck.check_answer.
+		"""
+		if item.options is not None:
+			success = (response == item.back_side)
+		else:
+			deck, card = self.lookup(item.key)
+			success = (card is not None) and deck.check_answer(card, response)
+		self.submit([(item.key, success, None)])
+		return success
+
+	def close(self):
+		"""Abandons the rest of the session: stops prefetching, and returns the cards not yet taken to the deck.
+		"""
+		if self.closed:
+			return
+		self.closed = True
+		if self.thread is not None:
+			while self.thread.is_alive():
+				try:
+					while True:
+						self.items.get_nowait()
+				except queue.Empty:
+					pass
+				self.thread.join(0.01)
+		with self.lock:
+			self.cards.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+		return False
+
+	def __iter__(self):
+		while True:
+			item = self.next_item()
+			if item is None:
+				return
+			yield item
+
+def merge_due_cards(decks, limit=None):
+	"""Yields (deck, card) for everything due across decks. The due cards of all decks come first, in due order,
+		from a k-way merge of the decks' lazy queues. Each deck's new cards for the session follow, one deck at a
+		time in turn, so every deck's new card limit is honored.
+
+		limit (int): at most this many due cards in total
+	"""
+	streams = [keyed_cards(deck, i) for i, deck in enumerate(decks)]
+	num_due = 0
+	try:
+		for key, deck, card in heapq.merge(*streams, key=lambda keyed: keyed[0]):
+			if key[0] == 0:
+				if (limit is not None) and (num_due >= limit):
+					continue
+				num_due += 1
+			yield deck, card
+	finally:
+		for stream in streams:
+			stream.close()
+
+def keyed_cards(deck, deck_order):
+	"""Yields (merge key, deck, card) for a deck's cards to review, in the deck's order.
+	"""
+	scheme = deck.review_scheme
+	new_order = 0
+	cards = deck.iter_cards_to_review()
+	try:
+		for card in cards:
+			if card.status == scheme.default_status:
+				yield (1, new_order, deck_order), deck, card
+				new_order += 1
+			else:
+				yield (0, scheme.due_time(card), deck_order), deck, card
+	finally:
+		cards.close()
+
+def due_summary(decks, now=None, store=None):
+	"""Returns {"decks": [(deck, due, new)], "due": total due, "new": total new}, from each deck's due counters.
+
+		store (SqliteStore): if set, due cards of the decks it journals are counted by the store's due_at index instead.
+			New cards, which the store only holds once saved, are still counted by the deck.
+	"""
+	counts = []
+	for deck in decks:
+		num_due, num_new = deck.due_counts(now)
+		if (store is not None) and (deck.journal is store):
+			num_due = store.due_count(deck, now)
+		counts.append((deck, num_due, num_new))
+	return {"decks": counts, "due": sum(count[1] for count in counts), "new": sum(count[2] for count in counts)}
+
+class CollectionReviewSession(ReviewSession):
+	"""CollectionReviewSession -
+		ReviewSession over every deck of a collection, reviewing whatever is due across all of them (see merge_due_cards).
+			Item keys are (deck id, front side) pairs.
+	"""
+	def __init__(self, decks, limit=None, num_options=0, clock=datetime.datetime.now, prefetch=0):
+		self.decks = {deck.deck_id: deck for deck in decks}
+		super().__init__(None, limit, num_options, clock, prefetch)
+
+	def card_stream(self, limit):
+		return merge_due_cards(list(self.decks.values()), limit)
+
+	def lookup(self, key):
+		deck = self.decks.get(key[0])
+		return deck, (None if deck is None else deck.get_card(key[1]))
+
+	def make_item(self, deck_card):
+		deck, card = deck_card
+		options = None
+		if self.num_options > 0:
+			options = deck.review_scheme.get_options(self.num_options, card.back_side, deck)
+		return ReviewItem((deck.deck_id, card.front_side), card.front_side, card.back_side, options)
+
+	def submit(self, results):
+		"""Applies results keyed by (deck id, front side), one batch per deck, reading the clock at most once.
+		"""
+		stamp = None
+		def clock():
+			nonlocal stamp
+			if stamp is None:
+				stamp = self.clock()
+			return stamp
+
+		by_deck = collections.defaultdict(list)
+		unknown = []
+		for key, success, timestamp in results:
+			deck = self.decks.get(key[0])
+			if deck is None:
+				unknown.append(key)
+				continue
+			# converted up front, so an invalid timestamp fails the batch before any deck changes
+			if (timestamp is not None) and not isinstance(timestamp, datetime.datetime):
+				timestamp = datetime.datetime.fromtimestamp(timestamp)
+			by_deck[deck].append((key[1], success, timestamp))
+		applied = 0
+		with self.lock:
+			for deck, deck_results in by_deck.items():
+				summary = apply_results(deck, deck_results, clock)
+				applied += summary["applied"]
+				unknown += [(deck.deck_id, front_side) for front_side in summary["unknown"]]
+		return {"applied": applied, "unknown": unknown}
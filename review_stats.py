@@ -0,0 +1,111 @@
+import time
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+import review_history
+
+# Vectorized statistics over the records of a ReviewHistory (a numpy structured array, see review_history.DTYPE_FIELDS).
+# Every function makes a fixed number of passes over the arrays, so millions of records take well under a second.
+
+SECONDS_PER_DAY = 24*60*60
+
+# upper bounds, in days since the card's previous review, of the retention curve's bins
+DEFAULT_BIN_DAYS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+def as_records(history):
+	"""Accepts a ReviewHistory, or records already read from one.
+	"""
+	if isinstance(history, review_history.ReviewHistory):
+		return history.records()
+	if np is None:
+		raise ImportError("numpy is required for review statistics.")
+	return history
+
+def rates(passed, reviews):
+	"""Returns passed/reviews, with nan where there were no reviews.
+	"""
+	with np.errstate(invalid="ignore", divide="ignore"):
+		return np.where(reviews > 0, passed/np.maximum(reviews, 1), np.nan)
+
+def repeat_reviews(history):
+	"""Returns the reviews of cards that had been reviewed before, as a dictionary of equal length arrays:
+		"elapsed_days" (float): time since the card's previous review
+		"success" (bool): of this review
+	"""
+	records = as_records(history)
+	if len(records) == 0:
+		return {"elapsed_days": np.zeros(0), "success": np.zeros(0, dtype=bool)}
+	cards = records["card"].astype(np.int64)
+	timestamps = records["timestamp"] - records["timestamp"].min()
+	span = int(timestamps.max()) + 1
+	if (int(cards.max()) + 1)*span*2 < 2**62:
+		# card, time and outcome packed into one key, so a single sort of the keys groups each card's reviews in
+		#     time order, without an argsort and gathers over the packed records
+		keys = np.sort((cards*span + timestamps)*2 + records["success"])
+		success = (keys & 1).astype(bool)
+		keys >>= 1
+		cards, timestamps = np.divmod(keys, span)
+	else:
+		order = np.lexsort((timestamps, cards))
+		cards, timestamps, success = cards[order], timestamps[order], records["success"][order].astype(bool)
+	repeat = np.flatnonzero(cards[1:] == cards[:-1]) + 1
+	return {"elapsed_days": (timestamps[repeat] - timestamps[repeat - 1])/SECONDS_PER_DAY, "success": success[repeat]}
+
+def retention_curve(history, bin_days=DEFAULT_BIN_DAYS):
+	"""Returns the pass rate of reviews by the time since the card's previous review.
+
+		bin_days: increasing upper bounds of the bins, in days. Reviews later than the last bound are in a final bin.
+
+		Returns a dictionary of arrays, one entry per bin:
+			"bin_days": the bins' upper bounds, with inf for the final bin
+			"reviews": number of reviews, "passed": number of successful reviews, "retention": passed/reviews
+	"""
+	repeats = repeat_reviews(history)
+	bounds = np.asarray(bin_days, dtype=float)
+	bins = np.searchsorted(bounds, repeats["elapsed_days"], side="left")
+	reviews = np.bincount(bins, minlength=len(bounds) + 1)
+	passed = np.bincount(bins, weights=repeats["success"], minlength=len(bounds) + 1)
+	return {"bin_days": np.append(bounds, np.inf), "reviews": reviews, "passed": passed.astype(np.int64),
+	        "retention": rates(passed, reviews)}
+
+def pass_rates(history):
+	"""Returns the pass rate of reviews by the card's status before the review, for tuning a scheme's max_status.
+
+		Returns a dictionary of arrays, one entry per status that was reviewed, in increasing order:
+			"status", "reviews", "passed", "pass_rate"
+	"""
+	records = as_records(history)
+	statuses = records["prior_status"].astype(np.int64)
+	if len(statuses) == 0:
+		empty = np.zeros(0, dtype=np.int64)
+		return {"status": empty, "reviews": empty, "passed": empty, "pass_rate": np.zeros(0)}
+	lowest = statuses.min()
+	reviews = np.bincount(statuses - lowest)
+	passed = np.bincount(statuses - lowest, weights=records["success"], minlength=len(reviews))
+	seen = np.flatnonzero(reviews)
+	return {"status": seen + lowest, "reviews": reviews[seen], "passed": passed[seen].astype(np.int64),
+	        "pass_rate": rates(passed[seen], reviews[seen])}
+
+def daily_load(history, utc_offset=None):
+	"""Returns the number of reviews on each day with reviews.
+
+		utc_offset (int): seconds east of UTC of the days' midnight, defaulting to the local time zone's current offset
+
+		Returns a dictionary of arrays, one entry per day, in order:
+			"day" (numpy datetime64[D]), "reviews", "passed"
+	"""
+	records = as_records(history)
+	if utc_offset is None:
+		utc_offset = time.localtime().tm_gmtoff
+	days = (records["timestamp"] + utc_offset)//SECONDS_PER_DAY
+	if len(days) == 0:
+		empty = np.zeros(0, dtype=np.int64)
+		return {"day": empty.astype("datetime64[D]"), "reviews": empty, "passed": empty}
+	first = days.min()
+	reviews = np.bincount(days - first)
+	passed = np.bincount(days - first, weights=records["success"], minlength=len(reviews))
+	seen = np.flatnonzero(reviews)
+	return {"day": (seen + first).astype("datetime64[D]"), "reviews": reviews[seen], "passed": passed[seen].astype(np.int64)}
@@ -1,7 +1,47 @@
 # testing script for carta
 
 import unittest
+import asyncio
+import datetime
+import os
+import tempfile
+import time
+import threading
+import json
 import carta_local
+import openpyxl
+import data
+import deck
+import review_scheme
+import card_store
+import review_session
+import carta_server
+import refresh
+import filters
+import diagnostics
+import answers
+import column_cache
+import shutil
+import dill
+import review_history
+import review_stats
+import forecast
+
+class StaticDataSource(data.DataSource):
+    """In-memory data source for tests. Mutate data_dict to simulate changes to the source.
+    """
+    def __init__(self, data_dict):
+        super().__init__(True)
+        self.data_dict = data_dict
+
+    def pull_data(self):
+        return {field_name: list(values) for field_name, values in self.data_dict.items()}
+
+    def name(self):
+        return "static"
+
+    def get_source_str(self):
+        return "static"
 
 class TestCsvDataSource(unittest.TestCase):
     def setUp(self):
@@ -38,7 +78,7 @@ class TestCsvDataSource(unittest.TestCase):
 class TestDataSet(unittest.TestCase):
     def setUp(self):
         test_data_source = carta_local.CsvDataSource("Testing/csv_test.csv")
-        self.primary_data_set = carta.DataSet(data_source=test_data_source)
+        self.primary_data_set = data.DataSet(data_source=test_data_source)
         
     # a data set object should be able to:
     #     - pull data from any kind of data source
@@ -66,3 +106,1139 @@ class TestDataSet(unittest.TestCase):
         self.assertTrue("11" in first_row)
         self.assertTrue("12" in first_row)
         self.assertTrue(len(first_row) == 2)
+
+class TestDeck(unittest.TestCase):
+    def setUp(self):
+        self.source = StaticDataSource({"front": ["a", "b", "c"], "back": ["1", "2", "3"]})
+        self.data_set = data.DataSet(self.source)
+        self.deck = deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme())
+
+    # a deck object should be able to:
+    #     - create one card per row
+    def test_initial_load(self):
+        self.assertEqual(self.deck.num_cards(), 3)
+        self.assertEqual([card.front_side for card in self.deck.cards], ["a", "b", "c"])
+
+    #     - reconcile adds, updates and deletes on refresh, keeping card state
+    def test_refresh_summary(self):
+        card_a = self.deck.find_card_by_side("a", "1")
+        card_a.status = 3
+        self.source.data_dict = {"front": ["a", "c", "d"], "back": ["9", "3", "4"]}
+        self.data_set.update()
+        self.assertEqual([card.front_side for card in self.deck.cards], ["a", "c", "d"])
+        self.assertIs(self.deck.find_card_by_side("a", "9"), card_a)
+        self.assertEqual(card_a.status, 3)
+        self.assertIsNone(self.deck.find_card_by_side("b", "2"))
+
+    def test_refresh_counts(self):
+        self.source.data_dict = {"front": ["a", "c", "d"], "back": ["9", "3", "4"]}
+        self.data_set.data_table = self.source.pull_data()
+        summary = self.deck.refresh_data()
+        self.assertEqual(summary, {"added": 1, "updated": 1, "removed": 1})
+
+    #     - identify cards by their front side
+    def test_duplicate_fronts(self):
+        self.source.data_dict = {"front": ["a", "a", "b"], "back": ["1", "2", "3"]}
+        self.data_set.update()
+        self.assertEqual(self.deck.num_cards(), 2)
+        self.assertEqual(self.deck.find_card_by_side("a", "1").back_side, "1")
+
+class TestDueQueue(unittest.TestCase):
+    def setUp(self):
+        source = StaticDataSource({"front": ["a", "b", "c", "d"], "back": ["1", "2", "3", "4"]})
+        self.data_set = data.DataSet(source)
+        self.scheme = review_scheme.LeitnerReviewScheme(new_cards_per_session=2)
+        self.deck = deck.Deck(self.data_set, "front", "back", self.scheme)
+
+    # a due queue should be able to:
+    #     - limit new cards per session, in FIFO order
+    def test_new_cards(self):
+        cards = self.deck.get_cards_to_review()
+        self.assertEqual([card.front_side for card in cards], ["a", "b"])
+
+    #     - hold reviewed cards back until they are due, then return them in due order
+    def test_due_order(self):
+        card_a, card_b = self.deck.cards[0], self.deck.cards[1]
+        card_a.update_card(True)
+        card_b.update_card(True)
+        self.assertEqual([card.front_side for card in self.deck.get_cards_to_review()], ["c", "d"])
+
+        now = datetime.datetime.now()
+        card_a.status_dt = now - datetime.timedelta(days=2)
+        card_b.status_dt = now - datetime.timedelta(days=3)
+        self.deck.record_review(card_a)
+        self.deck.record_review(card_b)
+        cards = self.deck.get_cards_to_review()
+        self.assertEqual([card.front_side for card in cards], ["b", "a", "c", "d"])
+        self.assertEqual([card.front_side for card in self.deck.get_cards_to_review(limit=1)], ["b", "c", "d"])
+
+    #     - drop cards removed on refresh
+    def test_refresh(self):
+        self.data_set.data_source.data_dict = {"front": ["b", "c"], "back": ["2", "3"]}
+        self.data_set.update()
+        self.assertEqual([card.front_side for card in self.deck.get_cards_to_review()], ["b", "c"])
+
+    #     - keep its size bounded by the number of cards across repeated reviews
+    def test_compaction(self):
+        queue = self.deck.due_queue
+        for i in range(1000):
+            self.deck.get_card("a").update_card(i % 2 == 0, datetime.datetime(2020, 1, 1))
+        self.assertLessEqual(len(queue.heap), 2)
+        self.deck.get_card("b").update_card(True)
+        self.assertEqual(len(queue.new_cards), 2)
+        self.assertEqual([card.front_side for card in self.deck.iter_cards_to_review()], ["a", "c", "d"])
+
+@unittest.skipIf(card_store.np is None, "numpy is not installed")
+class TestCardStore(unittest.TestCase):
+    def setUp(self):
+        self.source = StaticDataSource({"front": ["a", "b", "c", "d"], "back": ["1", "2", "3", "4"]})
+        self.data_set = data.DataSet(self.source)
+        self.scheme = review_scheme.LeitnerReviewScheme(new_cards_per_session=2)
+        self.deck = deck.Deck(self.data_set, "front", "back", self.scheme, columnar=True)
+
+    # a columnar deck should be able to:
+    #     - expose its cards as views over the data set columns
+    def test_views(self):
+        self.assertEqual(self.deck.num_cards(), 4)
+        self.assertEqual([(card.front_side, card.back_side) for card in self.deck.cards][1], ("b", "2"))
+        self.assertEqual(self.deck.find_card_by_side("c", "3"), self.deck[2])
+        self.assertIsNone(self.deck.find_card_by_side("c", "4"))
+
+    #     - select due and new cards with the vectorized filter
+    def test_review(self):
+        self.assertEqual([card.front_side for card in self.deck.get_cards_to_review()], ["a", "b"])
+        for card in self.deck.get_cards_to_review():
+            card.update_card(True)
+        self.assertEqual([card.front_side for card in self.deck.get_cards_to_review()], ["c", "d"])
+        self.deck[1].status_dt = datetime.datetime.now() - datetime.timedelta(days=2)
+        self.assertEqual([card.front_side for card in self.deck.get_cards_to_review()], ["b", "c", "d"])
+
+    #     - keep card state through a refresh
+    def test_refresh(self):
+        self.deck[0].update_card(True)
+        self.source.data_dict = {"front": ["d", "a", "e"], "back": ["4", "9", "5"]}
+        self.data_set.data_table = self.source.pull_data()
+        summary = self.deck.update()
+        self.assertEqual(summary, {"added": 1, "updated": 1, "removed": 2})
+        self.assertEqual(self.deck.find_card_by_side("a", "9").status, 1)
+        self.assertEqual(self.deck.find_card_by_side("e", "5").status, -1)
+
+class TestReviewJournal(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.save_file = os.path.join(self.temp_dir.name, "carta_data.p")
+        source = StaticDataSource({"front": ["a", "b", "c"], "back": ["1", "2", "3"]})
+        self.data_set = data.DataSet(source)
+        self.deck = deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme())
+
+    def tearDown(self):
+        carta_local.get_journal(self.save_file).truncate()
+        carta_local._journals.pop(self.save_file)
+        carta_local._histories.pop(self.save_file).close()
+        self.temp_dir.cleanup()
+
+    # saving should:
+    #     - only append reviews to the journal when the collection is otherwise unchanged
+    def test_journal_save(self):
+        carta_local.save_data([self.data_set], [self.deck], self.save_file)
+        checkpoint_mtime = os.stat(self.save_file).st_mtime_ns
+        self.deck.get_card("b").update_card(True)
+        carta_local.save_data([self.data_set], [self.deck], self.save_file)
+        self.assertEqual(os.stat(self.save_file).st_mtime_ns, checkpoint_mtime)
+        self.assertEqual(len(list(carta_local.get_journal(self.save_file).entries())), 1)
+
+    #     - replay the journal on top of the checkpoint when loading
+    def test_journal_replay(self):
+        carta_local.save_data([self.data_set], [self.deck], self.save_file)
+        self.deck.get_card("b").update_card(True)
+        self.deck.get_card("b").update_card(True)
+        c_data = carta_local.load_from_file(self.save_file)
+        loaded_deck = c_data["decks"][0]
+        self.assertEqual(loaded_deck.get_card("b").status, 2)
+        self.assertEqual(loaded_deck.get_card("a").status, -1)
+        self.assertNotIn(loaded_deck.get_card("b"), loaded_deck.get_cards_to_review())
+
+    #     - journal and replay fronts of any type, and keep a card unchanged when its review can't be journaled
+    def test_journal_cell_types(self):
+        fronts = [datetime.datetime(2024, 5, 1, 12, 30), datetime.date(2024, 5, 2), 3, None]
+        for columnar in [False, True]:
+            typed_set = data.DataSet(StaticDataSource({"front": fronts, "back": ["1", "2", "3", "4"]}))
+            typed_deck = deck.Deck(typed_set, "front", "back", review_scheme.LeitnerReviewScheme(), columnar=columnar)
+            carta_local.save_data([typed_set], [typed_deck], self.save_file, compact=True)
+            for front in fronts:
+                typed_deck.get_card(front).update_card(True)
+            self.assertEqual([entry[1] for entry in carta_local.get_journal(self.save_file).entries()], fronts)
+            loaded_deck = carta_local.load_from_file(self.save_file)["decks"][0]
+            self.assertEqual([loaded_deck.get_card(front).status for front in fronts], [1, 1, 1, 1])
+
+            journal = typed_deck.journal
+            journal.handle.close()
+            card = typed_deck.get_card(3)
+            status_dt = card.status_dt
+            with self.assertRaises(ValueError):
+                card.update_card(True)
+            self.assertEqual((card.status, card.status_dt), (1, status_dt))
+            journal.handle = None
+
+    #     - write a new checkpoint when asked to compact
+    def test_compact(self):
+        carta_local.save_data([self.data_set], [self.deck], self.save_file)
+        self.deck.get_card("b").update_card(True)
+        carta_local.save_data([self.data_set], [self.deck], self.save_file, compact=True)
+        self.assertEqual(len(list(carta_local.get_journal(self.save_file).entries())), 0)
+        self.assertEqual(carta_local.load_from_file(self.save_file)["decks"][0].get_card("b").status, 1)
+
+    #     - keep the reviews journaled after a checkpoint started
+    def test_truncate_to_mark(self):
+        carta_local.save_data([self.data_set], [self.deck], self.save_file)
+        journal = carta_local.get_journal(self.save_file)
+        self.deck.get_card("a").update_card(True)
+        offset = journal.mark()
+        self.deck.get_card("b").update_card(True)
+        journal.truncate(offset)
+        self.assertEqual([entry[1] for entry in journal.entries()], ["b"])
+        self.assertEqual(journal.num_entries, 1)
+
+    #     - run in the background, coalescing requests and autosaving after reviews
+    def test_background_saver(self):
+        saver = carta_local.BackgroundSaver([self.data_set], [self.deck], self.save_file, every_reviews=2)
+        try:
+            for i in range(10):
+                saver.request()
+            self.assertTrue(saver.wait(10))
+            self.assertTrue(os.path.isfile(self.save_file))
+            self.assertLessEqual(saver.saves, 2)
+            saves = saver.saves
+            self.deck.get_card("a").update_card(True)
+            self.deck.get_card("b").update_card(True)
+            self.assertTrue(saver.wait(10))
+            self.assertEqual(saver.saves, saves + 1)
+            self.assertIsNone(saver.last_error)
+        finally:
+            saver.close()
+        self.assertEqual(carta_local.load_from_file(self.save_file)["decks"][0].get_card("b").status, 1)
+
+    #     - load saves written before decks kept indices, upgrading them in place
+    def test_migrate_old_save(self):
+        self.deck.get_card("b").update_card(True)
+        for name in ["deck_id", "journal", "history", "card_index", "due_queue", "distractor_pool", "answer_index", "card_store"]:
+            delattr(self.deck, name)
+        for name in ["lazy", "where", "cache", "revision", "fingerprint"]:
+            delattr(self.data_set, name)
+        with open(self.save_file, "wb") as output_file:
+            dill.dump({"data_sources": [], "data_set": [self.data_set], "decks": [self.deck], "cards": [], "review_schemes": []},
+                      output_file)
+        loaded_deck = carta_local.load_from_file(self.save_file)["decks"][0]
+        self.assertEqual(loaded_deck.get_card("b").status, 1)
+        self.assertEqual([card.front_side for card in loaded_deck.get_cards_to_review()], ["a", "c"])
+        self.assertTrue(loaded_deck.check_answer(loaded_deck.get_card("a"), "1"))
+        loaded_deck.get_card("a").update_card(True)
+        carta_local.save_data([loaded_deck.parent], [loaded_deck], self.save_file)
+        self.assertEqual(carta_local.load_from_file(self.save_file)["decks"][0].deck_id, loaded_deck.deck_id)
+
+        old_card = deck.Card.__new__(deck.Card)
+        old_card.__setstate__({"front_side": "a", "back_side": "1", "status": 2, "status_dt": None, "parent": None, "back": "1"})
+        self.assertEqual((old_card.front_side, old_card.status), ("a", 2))
+
+    #     - keep cards handed out by an unfinished session in the checkpoint
+    def test_checkpoint_during_session(self):
+        source = StaticDataSource({"front": ["a", "b", "c", "d"], "back": ["1", "2", "3", "4"]})
+        session_set = data.DataSet(source)
+        session_deck = deck.Deck(session_set, "front", "back", review_scheme.LeitnerReviewScheme())
+        for i, front in enumerate(["a", "b", "c", "d"]):
+            session_deck.get_card(front).update_card(False, datetime.datetime(2020, 1, 1, i))
+        with review_session.ReviewSession(session_deck) as session:
+            self.assertEqual([item.front_side for item in session.next_items(2)], ["a", "b"])
+            carta_local.save_data([session_set], [session_deck], self.save_file)
+            loaded_deck = carta_local.load_from_file(self.save_file)["decks"][0]
+            self.assertEqual([card.front_side for card in loaded_deck.get_cards_to_review()], ["a", "b", "c", "d"])
+            self.assertEqual([item.front_side for item in session.next_items(3)], ["c", "d"])
+
+    #     - snapshot the collection consistently while another thread reviews
+    def test_checkpoint_during_reviews(self):
+        fronts = [str(i) for i in range(3000)]
+        big_set = data.DataSet(StaticDataSource({"front": fronts, "back": fronts}))
+        big_deck = deck.Deck(big_set, "front", "back", review_scheme.LeitnerReviewScheme())
+        stop = threading.Event()
+        def review():
+            i = 0
+            while not stop.is_set():
+                big_deck.get_card(fronts[i % len(fronts)]).update_card(i % 3 != 0)
+                i += 1
+        reviewer = threading.Thread(target=review)
+        reviewer.start()
+        try:
+            for i in range(5):
+                carta_local.save_data([big_set], [big_deck], self.save_file, compact=True)
+        finally:
+            stop.set()
+            reviewer.join()
+        loaded_deck = carta_local.load_from_file(self.save_file)["decks"][0]
+        self.assertEqual([card.status for card in loaded_deck.cards], [card.status for card in big_deck.cards])
+
+    #     - snapshot the collection consistently while its data sets are refreshed
+    def test_checkpoint_during_update(self):
+        source = StaticDataSource({"front": [str(i) for i in range(1000)], "back": [str(i) for i in range(1000)]})
+        big_set = data.DataSet(source)
+        big_deck = deck.Deck(big_set, "front", "back", review_scheme.LeitnerReviewScheme())
+        stop = threading.Event()
+        def refresh():
+            i = 0
+            while not stop.is_set():
+                fronts = [str(j) for j in range(i % 2, 1000 + 200*(i % 3))]
+                source.data_dict = {"front": fronts, "back": fronts}
+                big_set.update(force=True)
+                if i < 5:
+                    deck.Deck(big_set, "front", "back", review_scheme.LeitnerReviewScheme())
+                i += 1
+                time.sleep(0.001)
+        refresher = threading.Thread(target=refresh)
+        refresher.start()
+        try:
+            for i in range(5):
+                carta_local.save_data([big_set], [big_deck], self.save_file, compact=True)
+        finally:
+            stop.set()
+            refresher.join()
+        loaded_deck = carta_local.load_from_file(self.save_file)["decks"][0]
+        self.assertEqual(len(loaded_deck.card_index), loaded_deck.num_cards())
+
+class TestSqlite(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, "vocab.db")
+        source = carta_local.SqliteDataSource(self.db_file, "words", read_only=False)
+        source.push_data({"front": ["a", "b", "c"], "back": ["1", "2", "3"], "notes": ["x", "y", "z"]})
+        self.data_set = data.DataSet(carta_local.SqliteDataSource(self.db_file, "words"), lazy=True)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    # a sqlite data source should be able to:
+    #     - report its header and pull only the fields a deck uses
+    def test_projection(self):
+        self.assertEqual(self.data_set.header(), ["front", "back", "notes"])
+        deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme())
+        self.assertEqual(sorted(self.data_set.data_table.keys()), ["back", "front"])
+        self.assertEqual(self.data_set["back"], ["1", "2", "3"])
+
+    # the sqlite store should be able to:
+    #     - write reviews through, find due cards by index, and reload the collection
+    def test_store(self):
+        store_file = os.path.join(self.temp_dir.name, "carta_data.db")
+        store = carta_local.SqliteStore(store_file)
+        test_deck = deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme())
+        store.save([self.data_set], [test_deck])
+        test_deck.get_card("b").update_card(True)
+        self.assertEqual(store.due_cards(test_deck), [])
+        self.assertEqual(store.due_cards(test_deck, now=time.time() + 2*24*60*60), ["b"])
+        store.close()
+
+        store = carta_local.SqliteStore(store_file)
+        c_data = store.load()
+        loaded_deck = c_data["decks"][0]
+        self.assertEqual(loaded_deck.deck_id, test_deck.deck_id)
+        self.assertEqual(loaded_deck.get_card("b").status, 1)
+        self.assertNotIn(loaded_deck.get_card("b"), loaded_deck.get_cards_to_review())
+        store.close()
+
+    #     - save decks on views, with the data sets' load options
+    def test_store_views(self):
+        store_file = os.path.join(self.temp_dir.name, "carta_data.db")
+        csv_file = os.path.join(self.temp_dir.name, "words.csv")
+        with open(csv_file, "w") as csv_output:
+            csv_output.write("front,back,group\na,1,x\nb,2,y\nc,3,x\nd,4,z\n")
+        csv_set = data.DataSet(carta_local.CsvDataSource(csv_file), where=filters.Field("group") != "z")
+        filtered = csv_set.filter(lambda row: row["group"] == "x").project(["front", "back"])
+        masked = csv_set.mask([True, True, False])
+        decks = [deck.Deck(filtered, "front", "back", review_scheme.LeitnerReviewScheme()),
+                 deck.Deck(masked, "front", "back", review_scheme.LeitnerReviewScheme(), columnar=True)]
+        decks[0].get_card("c").update_card(True)
+        store = carta_local.SqliteStore(store_file)
+        store.save([csv_set], decks)
+        store.close()
+
+        store = carta_local.SqliteStore(store_file)
+        c_data = store.load()
+        loaded_set = c_data["data_set"][0]
+        self.assertEqual(loaded_set["front"], ["a", "b", "c"])
+        self.assertIsInstance(loaded_set.where, filters.Compare)
+        self.assertEqual([[card.front_side for card in loaded_deck.cards] for loaded_deck in c_data["decks"]],
+                         [["a", "c"], ["a", "b"]])
+        self.assertEqual(c_data["decks"][0].parent.header(), ["front", "back"])
+        self.assertEqual(c_data["decks"][0].get_card("c").status, 1)
+        store.close()
+
+    #     - count the due cards of the decks it journals for the due summary
+    def test_due_summary(self):
+        store = carta_local.SqliteStore(os.path.join(self.temp_dir.name, "carta_data.db"))
+        saved_deck = deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme())
+        store.save([self.data_set], [saved_deck])
+        unsaved_deck = deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme())
+        for test_deck in [saved_deck, unsaved_deck]:
+            test_deck.get_card("a").update_card(True)
+        later = time.time() + 2*24*60*60
+        summary = review_session.due_summary([saved_deck, unsaved_deck], now=later, store=store)
+        self.assertEqual([count[1:] for count in summary["decks"]], [(1, 2), (1, 2)])
+        store.connection.execute("UPDATE cards SET due_at = NULL")
+        summary = review_session.due_summary([saved_deck, unsaved_deck], now=later, store=store)
+        self.assertEqual(summary["due"], 1)
+        store.close()
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.csv_file = os.path.join(self.temp_dir.name, "words.csv")
+        self.write_csv("front,back\na,1\nb,2\n")
+        self.data_set = data.DataSet(carta_local.CsvDataSource(self.csv_file, hash_content=True))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_csv(self, contents):
+        with open(self.csv_file, "w") as csv_file:
+            csv_file.write(contents)
+
+    # a data set should:
+    #     - skip the pull when its source is unchanged, unless forced
+    def test_unchanged(self):
+        self.assertFalse(self.data_set.update())
+        self.assertEqual(self.data_set.revision, 1)
+        self.assertTrue(self.data_set.update(force=True))
+        self.assertEqual(self.data_set.revision, 2)
+
+    #     - pull again when the source changes
+    def test_changed(self):
+        self.write_csv("front,back\na,1\nc,3\n")
+        self.assertTrue(self.data_set.update())
+        self.assertEqual(self.data_set["front"], ["a", "c"])
+
+class TestCsvStreaming(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.csv_file = os.path.join(self.temp_dir.name, "words.csv")
+        with open(self.csv_file, "w") as csv_file:
+            csv_file.write('front,back,notes\na,1,x\nb,2,"multi\nline"\nc,3,z\n')
+        self.csv_source = carta_local.CsvDataSource(self.csv_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    # a csv data source should be able to:
+    #     - pull only the requested fields
+    def test_projection(self):
+        self.assertEqual(self.csv_source.pull_data(["back", "front"]), {"back": ["1", "2", "3"], "front": ["a", "b", "c"]})
+        self.assertEqual(self.csv_source.pull_data()["notes"], ["x", "multi\nline", "z"])
+
+    #     - stream rows in chunks
+    def test_iter_rows(self):
+        chunks = list(self.csv_source.iter_rows(chunk_size=2, fields=["front"]))
+        self.assertEqual(chunks, [[["a"], ["b"]], [["c"]]])
+
+    #     - report the line of a ragged row
+    def test_ragged_line(self):
+        with open(self.csv_file, "a") as csv_file:
+            csv_file.write("d,4\n")
+        with self.assertRaisesRegex(Exception, "line 6"):
+            self.csv_source.pull_data()
+
+class TestExcelDataSource(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.xlsx_file = os.path.join(self.temp_dir.name, "words.xlsx")
+        workbook = openpyxl.Workbook()
+        workbook.active.append(["front", "back", "notes"])
+        workbook.active.append(["a", 1, "x"])
+        workbook.active.append(["b", 2, "y"])
+        second_sheet = workbook.create_sheet("second")
+        second_sheet.append(["front", "back"])
+        second_sheet.append(["c", 3])
+        workbook.save(self.xlsx_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    # an excel data source should be able to:
+    #     - read .xlsx files, optionally only some fields
+    def test_xlsx(self):
+        excel_source = carta_local.create_data_source(self.xlsx_file)
+        self.assertEqual(excel_source.header(), ["front", "back", "notes"])
+        self.assertEqual(excel_source.pull_data(), {"front": ["a", "b"], "back": [1, 2], "notes": ["x", "y"]})
+        self.assertEqual(excel_source.pull_data(["notes"]), {"notes": ["x", "y"]})
+
+    #     - select a sheet by name
+    def test_sheet(self):
+        excel_source = carta_local.ExcelDataSource(self.xlsx_file, sheet="second")
+        self.assertEqual(excel_source.pull_data(), {"front": ["c"], "back": [3]})
+
+class TestDistractorPool(unittest.TestCase):
+    def setUp(self):
+        self.source = StaticDataSource({"front": ["a", "b", "c", "d", "e"], "back": ["x", "y", "x", "z", "x"]})
+        self.data_set = data.DataSet(self.source)
+        self.deck = deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme())
+
+    # multiple choice options should:
+    #     - contain the answer and distinct distractors
+    def test_options(self):
+        options = self.deck.review_scheme.get_options(3, "x", self.deck)
+        self.assertEqual(sorted(options), ["x", "y", "z"])
+
+    #     - degrade gracefully when there are too few unique answers
+    def test_too_few_answers(self):
+        options = self.deck.review_scheme.get_options(4, "y", self.deck)
+        self.assertEqual(sorted(options), ["x", "y", "z"])
+
+    #     - follow the deck on refresh
+    def test_refresh(self):
+        self.source.data_dict = {"front": ["a", "b", "c"], "back": ["x", "w", "x"]}
+        self.data_set.update()
+        self.assertEqual(sorted(self.deck.distractor_pool.values), ["w", "x"])
+        self.assertEqual(self.deck.distractor_pool.counts, {"x": 2, "w": 1})
+
+class TestReviewSession(unittest.TestCase):
+    def setUp(self):
+        source = StaticDataSource({"front": ["a", "b", "c"], "back": ["1", "2", "3"]})
+        self.data_set = data.DataSet(source)
+        self.deck = deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme())
+        self.clock_calls = 0
+        self.session = review_session.ReviewSession(self.deck, num_options=2, clock=self.clock)
+
+    def clock(self):
+        self.clock_calls += 1
+        return datetime.datetime(2020, 1, 1)
+
+    # a review session should be able to:
+    #     - hand out items with options
+    def test_items(self):
+        items = self.session.next_items(2)
+        self.assertEqual([item.key for item in items], ["a", "b"])
+        self.assertIn("1", items[0].options)
+        self.assertEqual(self.session.remaining(), 1)
+
+    #     - apply a batch of results with a single clock read
+    def test_submit(self):
+        summary = self.session.submit([("a", True, None), ("b", False, None), ("c", True, 1000.0), ("z", True, None)])
+        self.assertEqual(summary, {"applied": 3, "unknown": ["z"]})
+        self.assertEqual(self.clock_calls, 1)
+        self.assertEqual(self.deck.get_card("a").status, 1)
+        self.assertEqual(self.deck.get_card("b").status, 0)
+        self.assertEqual(self.deck.get_card("a").status_dt, datetime.datetime(2020, 1, 1))
+        self.assertEqual(self.deck.get_card("c").status_dt, datetime.datetime.fromtimestamp(1000.0))
+
+    #     - reject a batch with an invalid timestamp without changing any card
+    def test_submit_invalid(self):
+        with self.assertRaises(TypeError):
+            self.session.submit([("a", True, None), ("b", True, "yesterday")])
+        self.assertEqual(self.deck.get_card("a").status, -1)
+        self.assertEqual(self.deck.get_cards_to_review(), [self.deck.get_card(front) for front in ["a", "b", "c"]])
+
+    #     - check single answers
+    def test_answer(self):
+        item = self.session.next_items(1)[0]
+        self.assertTrue(self.session.answer(item, "1"))
+        self.assertEqual(self.deck.get_card("a").status, 1)
+
+    #     - take due cards lazily, in the same order as get_cards_to_review
+    def test_lazy_order(self):
+        fronts = [str(i) for i in range(200)]
+        data_set = data.DataSet(StaticDataSource({"front": fronts, "back": fronts}))
+        past = datetime.datetime(2020, 1, 1)
+        for columnar in [False, True]:
+            lazy_deck = deck.Deck(data_set, "front", "back", review_scheme.LeitnerReviewScheme(), columnar=columnar)
+            for i, card in enumerate(lazy_deck.cards):
+                if i % 3:
+                    card.update_card(False, past + datetime.timedelta(seconds=(i*7919) % 1000))
+            expected = [card.front_side for card in lazy_deck.get_cards_to_review()]
+            self.assertEqual([card.front_side for card in lazy_deck.iter_cards_to_review()], expected)
+            self.assertEqual([card.front_side for card in lazy_deck.iter_cards_to_review(10)],
+                             [card.front_side for card in lazy_deck.get_cards_to_review(10)])
+
+    #     - be abandoned, returning untaken cards to the deck
+    def test_abandon(self):
+        past = datetime.datetime(2020, 1, 1)
+        for card in self.deck.cards:
+            card.update_card(False, past)
+        with review_session.ReviewSession(self.deck, prefetch=2) as session:
+            item = session.next_items(1)[0]
+            session.answer(item, "wrong")
+        self.assertEqual([card.front_side for card in self.deck.get_cards_to_review()], ["b", "c", "a"])
+
+    #     - prefetch items on a background thread
+    def test_prefetch(self):
+        with review_session.ReviewSession(self.deck, num_options=2, prefetch=2) as session:
+            items = list(session)
+        self.assertEqual([item.key for item in items], ["a", "b", "c"])
+        self.assertEqual(len(items[2].options), 2)
+
+class TestCartaServer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        source = StaticDataSource({"front": ["a", "b", "c"], "back": ["1", "2", "3"]})
+        self.template = deck.Deck(data.DataSet(source), "front", "back", review_scheme.LeitnerReviewScheme())
+        self.server = carta_server.CartaServer([self.template], self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def request(self, server, method, target, body=None):
+        return asyncio.run(server.dispatch(method, target, body or {}))
+
+    # the review server should:
+    #     - keep card state per user
+    def test_per_user_state(self):
+        target = "/review?user=alice&deck={}".format(self.template.deck_id)
+        self.assertEqual(len(self.request(self.server, "GET", target)["items"]), 3)
+        response = self.request(self.server, "POST", "/answer", {"user": "alice", "deck": self.template.deck_id, "key": "a", "response": "1"})
+        self.assertEqual(response, {"correct": True, "back_side": "1"})
+        self.assertEqual(len(self.request(self.server, "GET", target)["items"]), 2)
+        self.assertEqual(len(self.request(self.server, "GET", target.replace("alice", "bob"))["items"]), 3)
+
+    #     - restore users' state from their journals, and keep their review histories
+    def test_restart(self):
+        body = {"user": "alice", "deck": self.template.deck_id, "results": [["a", True, None], ["b", True, None]]}
+        self.assertEqual(self.request(self.server, "POST", "/answers", body), {"applied": 2, "unknown": []})
+        restarted = carta_server.CartaServer([self.template], self.temp_dir.name)
+        target = "/review?user=alice&deck={}".format(self.template.deck_id)
+        self.assertEqual([item["key"] for item in self.request(restarted, "GET", target)["items"]], ["c"])
+        history = restarted.get_user("alice").history
+        self.assertEqual(history.file_name, os.path.join(self.temp_dir.name, "alice.history"))
+        self.assertEqual(len(history.records(self.template.deck_id)), 2)
+
+    #     - reject bad requests
+    def test_errors(self):
+        with self.assertRaises(carta_server.RequestError):
+            self.request(self.server, "GET", "/review?user=../x&deck={}".format(self.template.deck_id))
+        with self.assertRaises(carta_server.RequestError):
+            self.request(self.server, "GET", "/review?user=alice&deck=missing")
+
+class TestDataSetView(unittest.TestCase):
+    def setUp(self):
+        self.source = StaticDataSource({"front": ["a", "b", "c"], "back": ["1", "2", "3"], "group": ["x", "y", "x"]})
+        self.data_set = data.DataSet(self.source)
+
+    # a data set view should be able to:
+    #     - share the parent's columns
+    def test_zero_copy(self):
+        projection = self.data_set.project(["front"])
+        self.assertIs(projection["front"], self.data_set["front"])
+        self.assertEqual(projection.header(), ["front"])
+        self.assertEqual(projection[1], ["b"])
+
+    #     - select rows with filters and masks
+    def test_rows(self):
+        filtered = self.data_set.filter(lambda row: row["group"] == "x")
+        self.assertEqual(list(filtered["front"]), ["a", "c"])
+        self.assertEqual(list(filtered.rows(["front", "back"])), [("a", "1"), ("c", "3")])
+        masked = self.data_set.mask([False, True, True]).project(["back"])
+        self.assertEqual(masked.materialize().data_table, {"back": ["2", "3"]})
+
+    #     - serve decks that follow the parent's updates
+    def test_deck_on_view(self):
+        filtered = self.data_set.filter(lambda row: row["group"] == "x")
+        view_deck = deck.Deck(filtered, "front", "back", review_scheme.LeitnerReviewScheme())
+        self.assertEqual([card.front_side for card in view_deck.cards], ["a", "c"])
+        self.source.data_dict = {"front": ["a", "b", "d"], "back": ["1", "2", "4"], "group": ["x", "x", "y"]}
+        self.data_set.update()
+        self.assertEqual([card.front_side for card in view_deck.cards], ["a", "b"])
+
+    #     - register with the parent only once a deck is attached, and detach again
+    def test_registration(self):
+        filtered = self.data_set.filter(lambda row: row["group"] == "x")
+        nested = filtered.project(["front"])
+        self.assertEqual(self.data_set.children, [])
+        self.assertEqual(filtered.children, [])
+        self.source.data_dict = {"front": ["a", "b", "d"], "back": ["1", "2", "4"], "group": ["x", "x", "y"]}
+        self.data_set.update()
+        self.assertEqual(list(nested["front"]), ["a", "b"])
+        view_deck = deck.Deck(nested, "front", "front", review_scheme.LeitnerReviewScheme())
+        self.assertEqual(self.data_set.children, [filtered])
+        self.assertEqual(filtered.children, [nested])
+        nested.detach()
+        filtered.detach()
+        self.assertEqual(self.data_set.children, [])
+        self.source.data_dict = {"front": ["e"], "back": ["5"], "group": ["x"]}
+        self.data_set.update()
+        self.assertEqual(list(nested["front"]), ["e"])
+        self.assertEqual([card.front_side for card in view_deck.cards], ["a", "b"])
+
+class TestRefresh(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.data_sets = []
+        self.decks = []
+        for i in range(3):
+            csv_file = os.path.join(self.temp_dir.name, "words_{}.csv".format(i))
+            with open(csv_file, "w") as csv_output:
+                csv_output.write("front,back\na,{0}\nb,{0}\n".format(i))
+            data_set = data.DataSet(carta_local.CsvDataSource(csv_file))
+            self.data_sets.append(data_set)
+            self.decks.append(deck.Deck(data_set, "front", "back", review_scheme.LeitnerReviewScheme()))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    # a parallel refresh should:
+    #     - skip unchanged data sets
+    def test_unchanged(self):
+        results = refresh.refresh_all(self.data_sets, workers=2)
+        self.assertEqual([result["reloaded"] for result in results], [False, False, False])
+
+    #     - reload in parallel, reporting in data set order
+    def test_parallel(self):
+        with open(self.data_sets[1].data_source.file_name, "a") as csv_output:
+            csv_output.write("c,9\n")
+        results = refresh.refresh_all(self.data_sets, workers=2, force=True)
+        self.assertEqual([result["name"] for result in results], ["words_0.csv", "words_1.csv", "words_2.csv"])
+        self.assertEqual(results[1]["children"], [{"added": 1, "updated": 0, "removed": 0}])
+        self.assertEqual(self.decks[1].get_card("c").back_side, "9")
+
+    #     - install new data on the calling thread
+    def test_install_thread(self):
+        threads = []
+        class Probe:
+            def update(self):
+                threads.append(threading.current_thread())
+        for data_set in self.data_sets:
+            data_set.add_child(Probe())
+        refresh.refresh_all(self.data_sets, workers=2, force=True)
+        self.assertEqual(threads, [threading.current_thread()]*3)
+
+class TestFilters(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.csv_file = os.path.join(self.temp_dir.name, "words.csv")
+        with open(self.csv_file, "w") as csv_output:
+            csv_output.write("front,back,group\na,1,x\nb,2,y\nc,3,x\nd,4,z\n")
+        self.expression = (filters.Field("group") == "x") | filters.Field("front").matches("^d")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    # a filter expression should:
+    #     - evaluate on rows, and translate to SQL
+    def test_expression(self):
+        self.assertTrue(self.expression.evaluate({"group": "x", "front": "b"}))
+        self.assertFalse((~self.expression).evaluate({"group": "x", "front": "b"}))
+        self.assertTrue(filters.Field("back").between("2", "3").evaluate({"back": "3"}))
+        sql, parameters = (filters.Field("group").isin(["x"]) & (filters.Field("back") > "1")).to_sql(carta_local.quote_identifier)
+        self.assertEqual(sql, '("group" IN (?)) AND ("back" > ?)')
+        self.assertEqual(parameters, ["x", "1"])
+
+    #     - be pushed down to csv, sqlite and static sources
+    def test_pushdown(self):
+        csv_set = data.DataSet(carta_local.CsvDataSource(self.csv_file), where=self.expression)
+        self.assertEqual(csv_set["front"], ["a", "c", "d"])
+
+        db_file = os.path.join(self.temp_dir.name, "words.db")
+        sqlite_source = carta_local.SqliteDataSource(db_file, "words", read_only=False)
+        sqlite_source.push_data(data.DataSet(carta_local.CsvDataSource(self.csv_file)).data_table)
+        self.assertEqual(sqlite_source.pull_data(["back"], self.expression), {"back": ["1", "3", "4"]})
+
+        static_set = data.DataSet(StaticDataSource({"front": ["a", "b"], "group": ["x", "y"]}), where=self.expression)
+        self.assertEqual(static_set.data_table, {"front": ["a"], "group": ["x"]})
+
+    #     - select the rows a deck builds cards for
+    def test_deck_expression(self):
+        data_set = data.DataSet(carta_local.CsvDataSource(self.csv_file))
+        for columnar in [False, True]:
+            filtered_deck = deck.Deck(data_set, "front", "back", review_scheme.LeitnerReviewScheme(),
+                                      filters.Field("group") == "x", columnar=columnar)
+            self.assertEqual([card.front_side for card in filtered_deck.cards], ["a", "c"])
+
+    #     - not match blank or incomparable cells, on rows and as masks
+    def test_mixed_cells(self):
+        data_set = data.DataSet(StaticDataSource({"front": ["a", "b", "c", "d", "e"], "back": ["2", None, 5, "0", 1.5]}))
+        for vectorized in [False, True]:
+            self.assertEqual(filters.matching_rows(filters.Field("back") > "1", data_set, vectorized), [0])
+            self.assertEqual(filters.matching_rows(filters.Field("back") <= 5, data_set, vectorized), [2, 4])
+            self.assertEqual(filters.matching_rows(filters.Field("back") == "0", data_set, vectorized), [3])
+        blank_set = data.DataSet(StaticDataSource({"front": ["a", "b"], "back": [None, None]}))
+        for vectorized in [False, True]:
+            self.assertEqual(filters.matching_rows(filters.Field("back") >= "1", blank_set, vectorized), [])
+        csv_set = data.DataSet(StaticDataSource({"front": ["a", "b"], "back": ["x", "y"]}))
+        self.assertEqual(filters.matching_rows(filters.Field("back") < 3, csv_set, vectorized=True), [])
+
+    #     - compare typed fields numerically, on rows, in SQL and as masks
+    def test_typed_field(self):
+        rows = {"front": ["a", "b", "c", "d", "e"], "back": ["9", "10", "100", "", "2.5"]}
+        text_range = filters.Field("back").between("2", "20")
+        self.assertEqual(filters.matching_rows(text_range, data.DataSet(StaticDataSource(rows))), [4])
+        numeric_range = filters.Field("back", type=float).between(2, "20")
+        numeric_set = filters.Field("back", type=int).isin(["10", 100])
+        data_set = data.DataSet(StaticDataSource(rows))
+        for vectorized in [False, True]:
+            self.assertEqual(filters.matching_rows(numeric_range, data_set, vectorized), [0, 1, 4])
+            self.assertEqual(filters.matching_rows(filters.Field("back", type=float) != 9, data_set, vectorized), [1, 2, 4])
+            self.assertEqual(filters.matching_rows(numeric_set, data_set, vectorized), [1, 2])
+
+        db_file = os.path.join(self.temp_dir.name, "numbers.db")
+        sqlite_source = carta_local.SqliteDataSource(db_file, "numbers", read_only=False)
+        sqlite_source.push_data({"front": ["a", "b", "c", "e"], "back": ["9", "10", "100", "2.5"]})
+        self.assertEqual(sqlite_source.pull_data(["front"], numeric_range), {"front": ["a", "b", "e"]})
+        self.assertEqual(sqlite_source.pull_data(["front"], numeric_set), {"front": ["b", "c"]})
+        self.assertEqual(numeric_range.to_sql(carta_local.quote_identifier)[0],
+                         '(CAST("back" AS REAL) >= ?) AND (CAST("back" AS REAL) <= ?)')
+
+class TestDiagnostics(unittest.TestCase):
+    def setUp(self):
+        diagnostics.reset()
+        self.data_set = data.DataSet(StaticDataSource({"front": ["a", "b"], "back": ["1", "2"]}))
+
+    def tearDown(self):
+        diagnostics.disable()
+        diagnostics.reset()
+
+    # instrumentation should:
+    #     - record nothing while disabled
+    def test_disabled(self):
+        deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme())
+        self.assertEqual(diagnostics.stats(), {"timers": {}, "counters": {}})
+
+    #     - time the hot paths while enabled, and dump them as JSON
+    def test_enabled(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            diagnostics.enable(os.path.join(temp_dir, "session.prof"))
+            test_deck = deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme())
+            self.data_set.update(force=True)
+            test_deck.get_cards_to_review()[0].update_card(True)
+            diagnostics.disable()
+            self.assertTrue(os.path.isfile(os.path.join(temp_dir, "session.prof")))
+
+            timers = diagnostics.stats()["timers"]
+            self.assertEqual(timers["Deck.load_data_from_source"]["calls"], 2)
+            self.assertEqual(timers["DataSource.pull_data"]["calls"], 1)
+            self.assertEqual(timers["Card.update_card"]["calls"], 1)
+            dump_file = os.path.join(temp_dir, "stats.json")
+            diagnostics.dump(dump_file)
+            with open(dump_file) as dump_input:
+                self.assertEqual(json.load(dump_input)["timers"].keys(), timers.keys())
+
+class TestAnswerIndex(unittest.TestCase):
+    def setUp(self):
+        source = StaticDataSource({"front": ["today", "cat", "today", "hello"],
+                                   "back": ["aujourd’hui", "chat", "ce jour", "bonjour"]})
+        self.data_set = data.DataSet(source)
+
+    # answer checking should:
+    #     - ignore case, accents and whitespace
+    def test_normalize(self):
+        self.assertEqual(answers.normalize("  Aujourd’hui  Été "), "aujourd'hui ete")
+
+    #     - allow small typos in longer answers only, with a bounded distance
+    def test_within_distance(self):
+        self.assertTrue(answers.within_distance("bonjuor", "bonjour", 2))
+        self.assertFalse(answers.within_distance("bonjuor", "bonjour", 1))
+        self.assertTrue(answers.within_distance("kitten", "sitting", 3))
+        self.assertFalse(answers.within_distance("kitten", "sitting", 2))
+
+    #     - accept alternates from duplicate fronts, in both card layouts
+    def test_check_answer(self):
+        for columnar in [False, True]:
+            test_deck = deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme(), columnar=columnar)
+            today, cat, hello = test_deck.get_card("today"), test_deck.get_card("cat"), test_deck.get_card("hello")
+            self.assertTrue(test_deck.check_answer(today, "AUJOURD'HUI"))
+            self.assertTrue(test_deck.check_answer(today, "ce  jour"))
+            self.assertTrue(test_deck.check_answer(hello, "bonjor"))
+            self.assertFalse(test_deck.check_answer(cat, "chas"))
+            self.assertFalse(test_deck.check_answer(hello, "au revoir"))
+
+class TestColumnCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.csv_file = os.path.join(self.temp_dir.name, "words.csv")
+        with open(self.csv_file, "w") as csv_output:
+            csv_output.write("front,back\nété,summer\nhiver,\nété,season\n")
+        self.cache_dir = self.csv_file + ".carta-cache"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    # the column cache should:
+    #     - memory-map the columns, and be reused while the source is unchanged
+    def test_reuse(self):
+        first = data.DataSet(carta_local.CsvDataSource(self.csv_file), cache=True)
+        self.assertIsInstance(first["front"], column_cache.MappedColumn)
+        self.assertEqual(list(first["back"]), ["summer", "", "season"])
+        self.assertEqual(first["front"][-1], "été")
+
+        pulls = []
+        source = carta_local.CsvDataSource(self.csv_file)
+        source.pull_data = lambda *args: pulls.append(args)
+        second = data.DataSet(source, cache=True)
+        self.assertEqual(pulls, [])
+        self.assertEqual(second["front"][0:2], ["été", "hiver"])
+
+    #     - be invalidated when the source changes
+    def test_invalidate(self):
+        data_set = data.DataSet(carta_local.CsvDataSource(self.csv_file), cache=True)
+        with open(self.csv_file, "a") as csv_output:
+            csv_output.write("printemps,spring\n")
+        data_set.update()
+        self.assertEqual(data_set["front"][3], "printemps")
+        self.assertEqual(len(os.listdir(self.cache_dir)), 5)
+
+    #     - be safe to delete, even under a saved collection
+    def test_delete(self):
+        data_set = data.DataSet(carta_local.CsvDataSource(self.csv_file), cache=True)
+        test_deck = deck.Deck(data_set, "front", "back", review_scheme.LeitnerReviewScheme(), columnar=True)
+        save_file = os.path.join(self.temp_dir.name, "carta_data.p")
+        carta_local.save_data([data_set], [test_deck], save_file)
+        shutil.rmtree(self.cache_dir)
+        loaded = carta_local.load_from_file(save_file)
+        self.assertEqual(list(loaded["data_set"][0]["back"]), ["summer", "", "season"])
+        self.assertEqual(loaded["decks"][0].get_card("été").back_side, "summer")
+
+class TestCsvChangeSet(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.csv_file = os.path.join(self.temp_dir.name, "words.csv")
+        with open(self.csv_file, "w", newline="") as csv_output:
+            csv_output.write('id,front,back\n1,"a, b",1\n2,"multi\nline",2\n3,c,3\n')
+        self.source = carta_local.CsvDataSource(self.csv_file, read_only=False)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read(self):
+        with open(self.csv_file, newline="") as csv_input:
+            return csv_input.read()
+
+    # pushing a change set should:
+    #     - append inserted rows without rewriting the file
+    def test_insert(self):
+        inode = os.stat(self.csv_file).st_ino
+        self.source.push_data(data.ChangeSet("id", inserted=[{"id": "4", "front": "d"}]))
+        self.assertEqual(os.stat(self.csv_file).st_ino, inode)
+        self.assertEqual(self.read(), 'id,front,back\n1,"a, b",1\n2,"multi\nline",2\n3,c,3\n4,d,\n')
+
+    #     - rewrite updates and deletes, copying unchanged rows verbatim
+    def test_update_delete(self):
+        self.source.push_data(data.ChangeSet("id", updated=[{"id": "3", "back": "9"}], deleted=["1"]))
+        self.assertEqual(self.read(), 'id,front,back\n2,"multi\nline",2\n3,c,9\n')
+        self.assertEqual(data.DataSet(self.source)["front"], ["multi\nline", "c"])
+
+    #     - leave the file untouched when a key is missing
+    def test_missing_key(self):
+        with self.assertRaises(Exception):
+            self.source.push_data(data.ChangeSet("id", updated=[{"id": "7", "back": "9"}]))
+        self.assertEqual(self.read(), 'id,front,back\n1,"a, b",1\n2,"multi\nline",2\n3,c,3\n')
+        self.assertFalse(os.path.isfile(self.csv_file + ".tmp"))
+
+class TestMultiFileDataSource(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.write("chapter_1.csv", "front,back\na,1\nb,2\n")
+        self.write("chapter_2.csv", "front,back,notes\nc,3,x\n")
+        workbook = openpyxl.Workbook()
+        workbook.active.append(["front", "back"])
+        workbook.active.append(["d", "4"])
+        workbook.save(os.path.join(self.temp_dir.name, "chapter_3.xlsx"))
+        self.source = carta_local.MultiFileDataSource(self.temp_dir.name, file_field="file", workers=2)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, file_name, text):
+        with open(os.path.join(self.temp_dir.name, file_name), "w") as output:
+            output.write(text)
+
+    # a multi-file source should:
+    #     - concatenate its files under a unified header
+    def test_concatenate(self):
+        data_set = data.DataSet(self.source)
+        self.assertEqual(data_set.header(), ["front", "back", "notes", "file"])
+        self.assertEqual(data_set["front"], ["a", "b", "c", "d"])
+        self.assertEqual(data_set["notes"], ["", "", "x", ""])
+        self.assertEqual(data_set["file"][3], "chapter_3.xlsx")
+        multi_deck = deck.Deck(data_set, "front", "back", review_scheme.LeitnerReviewScheme())
+        self.assertEqual(multi_deck.get_card("d").back_side, "4")
+
+    #     - only parse changed files on refresh
+    def test_refresh(self):
+        data_set = data.DataSet(self.source)
+        unchanged = self.source.members[os.path.join(self.temp_dir.name, "chapter_1.csv")][1]
+        self.write("chapter_2.csv", "front,back\nc,3\ne,5\n")
+        self.assertTrue(data_set.update())
+        self.assertIs(self.source.members[os.path.join(self.temp_dir.name, "chapter_1.csv")][1], unchanged)
+        self.assertEqual(data_set["front"], ["a", "b", "c", "e", "d"])
+        self.assertIsInstance(carta_local.create_data_source(os.path.join(self.temp_dir.name, "*.csv")),
+                              carta_local.MultiFileDataSource)
+
+    #     - only read data files matching a glob pattern
+    def test_mixed_directory(self):
+        self.write("carta_data.p.journal", '["deck", "a", 1, 0]\n')
+        self.write("carta_data.p.history.cards", '["deck", "a"]\n')
+        self.write(".~lock.chapter_1.csv#", "user,,,")
+        os.mkdir(os.path.join(self.temp_dir.name, "old.csv"))
+        for pattern in [os.path.join(self.temp_dir.name, "*"), self.temp_dir.name]:
+            data_set = data.DataSet(carta_local.MultiFileDataSource(pattern, workers=1))
+            self.assertEqual(data_set["front"], ["a", "b", "c", "d"])
+
+    #     - read files whose names contain glob characters as single files
+    def test_glob_characters(self):
+        self.write("vocab[1].csv", "front,back\nf,6\n")
+        single_file = os.path.join(self.temp_dir.name, "vocab[1].csv")
+        self.assertIsInstance(carta_local.create_data_source(single_file), carta_local.CsvDataSource)
+        self.assertEqual(data.DataSet(carta_local.create_data_source(single_file))["front"], ["f"])
+        data_set = data.DataSet(carta_local.MultiFileDataSource(self.temp_dir.name, workers=1))
+        self.assertEqual(data_set["front"], ["a", "b", "c", "d", "f"])
+
+class TestCollectionReview(unittest.TestCase):
+    def setUp(self):
+        self.data_set = data.DataSet(StaticDataSource({"front": ["a", "b", "c", "d"], "back": ["1", "2", "3", "4"]}))
+        scheme = review_scheme.LeitnerReviewScheme(new_cards_per_session=1)
+        self.decks = [deck.Deck(self.data_set, "front", "back", scheme),
+                      deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme(), columnar=True)]
+        start = datetime.datetime(2020, 1, 1)
+        for i, front in enumerate(["a", "b"]):
+            self.decks[0].get_card(front).update_card(False, start + datetime.timedelta(hours=2*i))
+            self.decks[1].get_card(front).update_card(False, start + datetime.timedelta(hours=2*i + 1))
+
+    # collection review should:
+    #     - count due and new cards per deck, following reviews incrementally
+    def test_due_counts(self):
+        summary = review_session.due_summary(self.decks)
+        self.assertEqual([(due, new) for test_deck, due, new in summary["decks"]], [(2, 1), (2, 2)])
+        self.assertEqual((summary["due"], summary["new"]), (4, 3))
+        for test_deck in self.decks:
+            test_deck.get_card("a").update_card(True)
+            self.assertEqual(test_deck.due_counts(), (1, min(2, test_deck.review_scheme.new_cards_per_session)))
+            test_deck.get_card("c").update_card(False, datetime.datetime(2020, 1, 1))
+            self.assertEqual(test_deck.due_counts()[0], 2)
+        self.assertEqual(self.decks[0].due_counts(time.mktime((2019, 1, 1, 0, 0, 0, 0, 0, -1))), (0, 1))
+
+    #     - keep due counts in step with reviews as the clock advances
+    def test_incremental_counts(self):
+        start = time.mktime((2020, 1, 1, 0, 0, 0, 0, 0, -1))
+        for test_deck in self.decks:
+            scheme = test_deck.review_scheme
+            for hours in range(0, 200, 10):
+                now = start + hours*3600
+                expected = sum(1 for card in test_deck.cards if (card.status != -1) and (scheme.due_time(card) <= now))
+                self.assertEqual(test_deck.due_counts(now)[0], expected)
+                card = test_deck.cards[hours % len(test_deck.cards)]
+                card.update_card(hours % 20 == 0, datetime.datetime.fromtimestamp(now - 3600))
+
+    #     - merge the decks' due cards by due time, then honor each deck's new card limit
+    def test_merge(self):
+        with review_session.CollectionReviewSession(self.decks, clock=lambda: datetime.datetime(2021, 1, 1)) as session:
+            items = list(session)
+            keys = [(0 if key[0] == self.decks[0].deck_id else 1, key[1]) for key in (item.key for item in items)]
+            self.assertEqual(keys, [(0, "a"), (1, "a"), (0, "b"), (1, "b"), (0, "c"), (1, "c"), (1, "d")])
+            summary = session.submit([(items[0].key, True, None), ((self.decks[1].deck_id, "z"), True, None)])
+        self.assertEqual(summary, {"applied": 1, "unknown": [(self.decks[1].deck_id, "z")]})
+        self.assertEqual(self.decks[0].get_card("a").status, 1)
+
+@unittest.skipIf(review_stats.np is None, "numpy is not installed")
+class TestReviewHistory(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.save_file = os.path.join(self.temp_dir.name, "carta_data.p")
+        source = StaticDataSource({"front": ["a", "b", "c"], "back": ["1", "2", "3"]})
+        self.data_set = data.DataSet(source)
+        self.decks = [deck.Deck(self.data_set, "front", "back", review_scheme.LeitnerReviewScheme()),
+                      deck.Deck(self.data_set, "front", "back", review_scheme.StreakReviewScheme(), columnar=True)]
+        carta_local.save_data([self.data_set], self.decks, self.save_file)
+        self.history = carta_local.get_history(self.save_file)
+
+    def tearDown(self):
+        carta_local._journals.pop(self.save_file).truncate()
+        carta_local._histories.pop(self.save_file).close()
+        self.temp_dir.cleanup()
+
+    # a review history should:
+    #     - record each answer with the card's prior status, from single and batched reviews
+    def test_records(self):
+        start = datetime.datetime(2020, 1, 1)
+        self.decks[0].get_card("a").update_card(True, start)
+        self.decks[0].get_card("a").update_card(False, start + datetime.timedelta(days=1))
+        self.decks[1].get_card("a").update_card(True, start)
+        review_session.apply_results(self.decks[1], [("b", False, start), ("c", True, start)])
+        records = self.history.records()
+        self.assertEqual(records.itemsize, review_history.RECORD.size)
+        self.assertEqual(records["card"].tolist(), [0, 0, 1, 2, 3])
+        self.assertEqual(records["prior_status"].tolist(), [-1, 1, -1, -1, -1])
+        self.assertEqual(records["success"].tolist(), [1, 0, 1, 0, 1])
+        self.assertEqual(records["timestamp"][1] - records["timestamp"][0], 24*60*60)
+        self.assertEqual(self.history.cards()[0], (self.decks[0].deck_id, "a"))
+        self.assertEqual(len(self.history.records(self.decks[1].deck_id)), 3)
+
+    #     - record cards whose fronts aren't strings
+    def test_cell_types(self):
+        fronts = [datetime.datetime(2024, 5, 1, 12, 30), 7.5, None]
+        typed_set = data.DataSet(StaticDataSource({"front": fronts, "back": ["1", "2", "3"]}))
+        typed_deck = deck.Deck(typed_set, "front", "back", review_scheme.LeitnerReviewScheme())
+        typed_deck.history = self.history
+        for front in fronts:
+            typed_deck.get_card(front).update_card(True)
+        self.assertEqual(self.history.cards(), [(typed_deck.deck_id, front) for front in fronts])
+        reopened = review_history.ReviewHistory(self.history.file_name)
+        reopened.open()
+        reopened.append(typed_deck, typed_deck.get_card(fronts[0]), False, 1)
+        reopened.close()
+        self.assertEqual(self.history.records()["card"].tolist(), [0, 1, 2, 0])
+
+    #     - not record journal replays, and drop a partially written record
+    def test_reload(self):
+        self.decks[0].get_card("a").update_card(True)
+        carta_local.load_from_file(self.save_file)["decks"][0].get_card("b").update_card(True)
+        self.assertEqual(len(self.history), 2)
+        self.history.close()
+        with open(self.history.file_name, "ab") as history_file:
+            history_file.write(b"\x01\x02")
+        self.assertEqual(len(self.history.records()), 2)
+        self.decks[0].get_card("c").update_card(False)
+        self.assertEqual(self.history.records()["card"].tolist(), [0, 1, 2])
+
+    # review statistics should:
+    #     - compute retention by interval, pass rates by prior status and daily load
+    def test_stats(self):
+        dtype = review_history.record_dtype()
+        day = 24*60*60
+        records = review_stats.np.array([(0, 0, 1, -1), (0, day, 1, 1), (1, 0, 0, -1), (0, 4*day, 0, 2), (1, day//2, 1, 0)], dtype=dtype)
+        curve = review_stats.retention_curve(records, bin_days=(1, 3))
+        self.assertEqual(curve["reviews"].tolist(), [2, 1, 0])
+        self.assertEqual(curve["passed"].tolist(), [2, 0, 0])
+        self.assertTrue(review_stats.np.isnan(curve["retention"][2]))
+        rates = review_stats.pass_rates(records)
+        self.assertEqual(rates["status"].tolist(), [-1, 0, 1, 2])
+        self.assertEqual(rates["pass_rate"].tolist(), [0.5, 1.0, 1.0, 0.0])
+        load = review_stats.daily_load(records, utc_offset=0)
+        self.assertEqual(load["reviews"].tolist(), [3, 1, 1])
+        self.assertEqual(str(load["day"][-1]), "1970-01-05")
+
+@unittest.skipIf(forecast.np is None, "numpy is not installed")
+class TestForecast(unittest.TestCase):
+    def setUp(self):
+        source = StaticDataSource({"front": ["a", "b", "c"], "back": ["1", "2", "3"]})
+        self.data_set = data.DataSet(source)
+        scheme = review_scheme.LeitnerReviewScheme(new_cards_per_session=2)
+        self.decks = [deck.Deck(self.data_set, "front", "back", scheme),
+                      deck.Deck(self.data_set, "front", "back", scheme, columnar=True)]
+        self.start = time.mktime((2020, 1, 1, 12, 0, 0, 0, 0, -1))
+
+    # a forecast should:
+    #     - update statuses in batches as the schemes' status_update would
+    def test_status_updates(self):
+        statuses = forecast.np.array([-1, 0, 1, 4, -1, 0, 1, 4], dtype=forecast.np.int16)
+        successes = forecast.np.array([True]*4 + [False]*4)
+        for scheme in [review_scheme.LeitnerReviewScheme(), review_scheme.StreakReviewScheme()]:
+            card = self.decks[0].get_card("a")
+            expected = []
+            for success, status in zip(successes, statuses):
+                card.status = int(status)
+                expected.append(scheme.status_update(success, card))
+            self.assertEqual(scheme.status_updates(successes, statuses).tolist(), expected)
+
+    #     - project daily due and new cards for each scheme, without changing the deck
+    def test_compare(self):
+        for test_deck in self.decks:
+            forecasts = forecast.compare(test_deck, days=7, success_probability=1.0, start=self.start)
+            self.assertEqual(forecasts["Leitner"]["due"].tolist(), [0, 2, 1, 2, 1, 0, 2])
+            self.assertEqual(forecasts["Leitner"]["new"].tolist(), [2, 1, 0, 0, 0, 0, 0])
+            self.assertEqual(forecasts["Streak"]["due"].tolist(), [0, 2, 3, 1, 2, 1, 0])
+            self.assertEqual(str(forecasts["Streak"]["day"][0]), "2020-01-01")
+            self.assertEqual(test_deck.get_card("a").status, -1)
+        failing = forecast.simulate(self.decks[0], days=3, success_probability=0.0, start=self.start)
+        self.assertEqual(failing["due"].tolist(), [0, 2, 3])
+        self.assertEqual(failing["passed"].tolist(), [0, 0, 0])